@@ -1,18 +1,105 @@
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
+import warnings
 from collections import defaultdict
 from datetime import datetime
 from Oya_encounters import load_and_filter_encounters
+from Oya_loader import ROW_COLUMN, frame_or_read, read_export
+from Oya_cohort import HOME_ADMISSIONS, REAL_PATIENTS, SYKEHUS_ENCOUNTERS, Cohort
+from Oya_adl import apply_bins, combine_measurements, load_adl_measurements, n_bins_of, resolve_bin_spec
+from Oya_joins import LONG_TERM_TEMPLATE, build_decision_index, enclosing_interval, exclude_long_term_stays, nearest_in_time, next_event
+from Oya_kernels import COMPILED, consecutive_stay_pairs
+from Oya_lazy import collect, pl, scan_export, use_lazy
+from Oya_sql import run_query, use_sql
+
+
+# Discharge destinations grouped in the outcome tables
+HOSPITAL_DESTINATIONS = {
+    "Annen helseinstitusjon innen spesialisthelsetjenesten",
+    "Annen helseinstitusjon innenfor spesialisthelsetjenesten",
+    "Somatisk sykehus STO",
+    "Psykiatrisk sykehus STO"
+}
+OTHER_DESTINATIONS = {
+    "*Unspecified",
+    "Annet",
+    "Annen institusjon (ikke helse)"
+}
+
+# Dispositions left out of the ADL outcome tables, and the grouping of the others
+DROP_DISPOSITIONS = {
+    "*Unspecified",
+    "Dratt på eget ansvar",
+    "Feilregistrert",
+    "Ikke ankommet akuttmottak",
+    "Reserved by NUBC#70"
+}
+DISPOSITION_GROUPS = {
+    "Som død - Melding går til sykepleietjeneste": "Som død",
+    "Som død - Ingen melding går": "Som død",
+    "Som død - Melding går til psykisk helsetjeneste": "Som død",
+    "Ut til hjemmet - Ingen melding går": "Ut til hjemmet",
+    "Ut til hjemmet - Melding går til psykisk helsetjeneste": "Ut til hjemmet",
+    "Ut til hjemmet - Melding går til sykepleietjeneste": "Ut til hjemmet",
+    "Ut til hjemmet (N/A)": "Ut til hjemmet"
+}
+
+
+def _destination_map(nursing_home):
+    return {**{dest: "Hospital" for dest in HOSPITAL_DESTINATIONS},
+            **{dest: "Other/Unspecified" for dest in OTHER_DESTINATIONS},
+            **({"Kommunale institusjoner i HP": "Sykehjem"} if nursing_home else {})}
+
+def load_grouped_discharges(encounters_path="Øya_encounters.csv", encounters_df=None, nursing_home=False,
+                            clean_dispositions=False, backend="pandas"):
+    # Hospital contacts with DischargeDestGroup (hospital, other/unspecified and, with nursing_home,
+    # municipal institutions as "Sykehjem"); with clean_dispositions the unusable dispositions are
+    # dropped and the others grouped. backend: "polars" to prepare the rows with a lazy scan.
+    destination_map = _destination_map(nursing_home)
+    if use_lazy(backend):
+        lf = scan_export(encounters_path, SYKEHUS_ENCOUNTERS, encounters_df)
+        if clean_dispositions and "DischargeDisposition" in lf.collect_schema().names():
+            disposition = pl.col("DischargeDisposition").cast(pl.String)
+            lf = (lf.filter(~disposition.is_in(list(DROP_DISPOSITIONS)) | disposition.is_null())
+                  .with_columns(disposition.replace(DISPOSITION_GROUPS)))
+        destination = pl.col("DischargeDestination").cast(pl.String).str.strip_chars()
+        return collect(lf.with_columns(destination.replace(destination_map).alias("DischargeDestGroup")))
+
+    encounters_df = frame_or_read(encounters_df, encounters_path, SYKEHUS_ENCOUNTERS)
+    encounters_df["DischargeInstant"] = pd.to_datetime(encounters_df["DischargeInstant"], errors="coerce")
 
+    if clean_dispositions and "DischargeDisposition" in encounters_df.columns:
+        encounters_df = encounters_df[~encounters_df["DischargeDisposition"].isin(DROP_DISPOSITIONS)]
+        encounters_df["DischargeDisposition"] = encounters_df["DischargeDisposition"].astype(object).replace(DISPOSITION_GROUPS)
 
-def analyze_cfs_outcomes(cfs_path="\u00d8ya_CFS.csv", encounters_path="\u00d8ya_encounters.csv"):
-    # Load CFS data
-    cfs_df = pd.read_csv(cfs_path)
-    cfs_df = cfs_df[cfs_df["PatientPseudoKey"] != 2384]  # Remove test patient
+    def group_destination(dest):
+        if pd.isna(dest):
+            return None
+        dest = dest.strip()
+        return destination_map.get(dest, dest)
+
+    encounters_df["DischargeDestGroup"] = encounters_df["DischargeDestination"].astype(object).apply(group_destination)
+    return encounters_df
+
+
+def load_cfs_scores(cfs_path="Øya_CFS.csv", cfs_df=None, backend="pandas"):
+    # CFS scores without the test patient, TakenInstant parsed
+    if use_lazy(backend):
+        return collect(scan_export(cfs_path, REAL_PATIENTS, cfs_df))
+    cfs_df = frame_or_read(cfs_df, cfs_path, REAL_PATIENTS)
     cfs_df["TakenInstant"] = pd.to_datetime(cfs_df["TakenInstant"], errors="coerce")
+    return cfs_df
+
+
+def analyze_cfs_outcomes(cfs_path="\u00d8ya_CFS.csv", encounters_path="\u00d8ya_encounters.csv", cfs_df=None, encounters_df=None,
+                         backend="pandas"):
+    # backend: "polars" to prepare the rows with a lazy scan (see Oya_lazy.py)
+    # Load CFS data
+    cfs_df = load_cfs_scores(cfs_path, cfs_df, backend)
 
     # Load and filter encounters
-    encounters_df = load_and_filter_encounters(encounters_path)
+    encounters_df = load_and_filter_encounters(encounters_path, encounters_df, backend)
     encounters_df["DischargeInstant"] = pd.to_datetime(encounters_df["DischargeInstant"], errors="coerce")
 
     # Get all distinct DischargeDispositions
@@ -21,29 +108,23 @@ def analyze_cfs_outcomes(cfs_path="\u00d8ya_CFS.csv", encounters_path="\u00d8ya_
     # Prepare result structure: dict of dicts
     result_dict = defaultdict(lambda: {"Antall": 0, **{disp: 0 for disp in all_dispositions}})
 
-    # Iterate through each CFS entry
-    for _, row in cfs_df.iterrows():
-        patient_id = row["PatientPseudoKey"]
-        cfs = row["CFS"]
-        if pd.isna(row["TakenInstant"]):
-            continue
-
-        taken_date = row["TakenInstant"].normalize()  # round to midnight for consistent comparison
-
-        # Find matching encounters
-        patient_encounters = encounters_df[encounters_df["PatientPseudoKey"] == patient_id]
-        future_encounters = patient_encounters[patient_encounters["DischargeInstant"] >= taken_date]
-
-        if not future_encounters.empty:
-            first_encounter = future_encounters.sort_values(by="DischargeInstant").iloc[0]
-            disposition = first_encounter["DischargeDisposition"]
-
-            # Update result_dict
-            result_dict[cfs]["Antall"] += 1
-            if disposition in result_dict[cfs]:
-                result_dict[cfs][disposition] += 1
-            else:
-                result_dict[cfs][disposition] = 1  # handle unexpected disposition
+    # First discharge on or after the (midnight-rounded) day of each CFS measurement
+    cfs_df = cfs_df.dropna(subset=["TakenInstant"]).copy()
+    cfs_df["TakenDate"] = cfs_df["TakenInstant"].dt.normalize()
+    first_encounter = next_event(cfs_df, encounters_df, "TakenDate", "DischargeInstant")
+    matched = cfs_df[first_encounter >= 0].copy()
+    matched["DischargeDisposition"] = encounters_df["DischargeDisposition"].astype(object).to_numpy()[first_encounter[first_encounter >= 0]]
+
+    # Update result_dict
+    counts = matched.groupby(["CFS", "DischargeDisposition"], dropna=False, sort=False).size()
+    for (cfs, disposition), count in counts.items():
+        if pd.isna(disposition):
+            disposition = np.nan  # one shared key for missing dispositions
+        result_dict[cfs]["Antall"] += count
+        if disposition in result_dict[cfs]:
+            result_dict[cfs][disposition] += count
+        else:
+            result_dict[cfs][disposition] = count  # handle unexpected disposition
 
     # Convert to DataFrame
     result_df = pd.DataFrame.from_dict(result_dict, orient="index").fillna(0).reset_index()
@@ -58,79 +139,42 @@ def analyze_cfs_outcomes(cfs_path="\u00d8ya_CFS.csv", encounters_path="\u00d8ya_
     return result_df
 
 
-def analyze_cfs_destinations_by_intervals(cfs_path="Øya_CFS.csv", encounters_path="Øya_encounters.csv"):
+def analyze_cfs_destinations_by_intervals(cfs_path="Øya_CFS.csv", encounters_path="Øya_encounters.csv", cfs_df=None, encounters_df=None,
+                                          backend="pandas"):
     # Load and preprocess CFS data
-    cfs_df = pd.read_csv(cfs_path)
-    cfs_df = cfs_df[cfs_df["PatientPseudoKey"] != 2384]
-    cfs_df["TakenInstant"] = pd.to_datetime(cfs_df["TakenInstant"], errors="coerce")
+    cfs_df = load_cfs_scores(cfs_path, cfs_df, backend)
 
-    # Load and preprocess encounter data
-    encounters_df = pd.read_csv(encounters_path)
-    encounters_df = encounters_df[encounters_df["PatientPseudoKey"] != 2384]
-    encounters_df = encounters_df[encounters_df["EncounterType"] == "Sykehuskontakt"]
-    encounters_df["DischargeInstant"] = pd.to_datetime(encounters_df["DischargeInstant"], errors="coerce")
+    # Load and preprocess encounter data, destinations grouped
+    encounters_df = load_grouped_discharges(encounters_path, encounters_df, backend=backend)
 
-    # Group mappings
-    group_hospital = {
-        "Annen helseinstitusjon innen spesialisthelsetjenesten",
-        "Annen helseinstitusjon innenfor spesialisthelsetjenesten",  # Added this variant
-        "Somatisk sykehus STO",
-        "Psykiatrisk sykehus STO"
-    }
-    group_other = {
-        "*Unspecified",
-        "Annet",
-        "Annen institusjon (ikke helse)"
-    }
+    unique_destinations = encounters_df["DischargeDestGroup"].dropna().unique().tolist()
+    counts, date_diffs = cfs_destination_counts(cfs_df, encounters_df)
+    return report_cfs_destinations(counts, date_diffs, unique_destinations)
 
-    def group_destination(dest):
-        if pd.isna(dest):
-            return None
-        dest = dest.strip()
-        if dest in group_hospital:
-            return "Hospital"
-        elif dest in group_other:
-            return "Other/Unspecified"
-        else:
-            return dest
 
-    encounters_df["DischargeDestGroup"] = encounters_df["DischargeDestination"].apply(group_destination)
+def cfs_destination_counts(cfs_df, encounters_df):
+    # Discharges per (CFS, destination group), each counted under the CFS interval it falls in, and
+    # the days from the interval start to every matched discharge. Per patient, so it can run per
+    # shard of patients (see Oya_shards.py).
+    # Each CFS score covers discharges from its day until the patient's next CFS day
+    cfs_df = cfs_df.dropna(subset=["TakenInstant"]).sort_values(["PatientPseudoKey", "TakenInstant"], kind="stable")
+    cfs_df["IntervalStart"] = cfs_df["TakenInstant"].dt.normalize()
+    interval = enclosing_interval(encounters_df, cfs_df, "DischargeInstant", "IntervalStart")
+    matched = encounters_df[interval >= 0].copy()
+    matched["CFS"] = cfs_df["CFS"].to_numpy()[interval[interval >= 0]]
+    matched["IntervalStart"] = cfs_df["IntervalStart"].to_numpy()[interval[interval >= 0]]
+
+    date_diffs = (matched["DischargeInstant"].dt.normalize() - matched["IntervalStart"]).dt.days.tolist()
+    counts = matched.dropna(subset=["DischargeDestGroup"]).groupby(["CFS", "DischargeDestGroup"], sort=False).size()
+    return counts, date_diffs
 
-    # Prepare result structure
-    unique_destinations = encounters_df["DischargeDestGroup"].dropna().unique().tolist()
-    result_dict = defaultdict(lambda: {"Antall": 0, **{d: 0 for d in unique_destinations}})
 
-    date_diffs = []
-
-    # Process each patient
-    for patient_id, patient_cfs in cfs_df.groupby("PatientPseudoKey"):
-        patient_cfs = patient_cfs.dropna(subset=["TakenInstant"]).sort_values("TakenInstant")
-        patient_encounters = encounters_df[encounters_df["PatientPseudoKey"] == patient_id]
-
-        cfs_times = patient_cfs["TakenInstant"].tolist()
-        cfs_scores = patient_cfs["CFS"].tolist()
-
-        for i, (cfs, start_time) in enumerate(zip(cfs_scores, cfs_times)):
-            start_time = start_time.normalize()
-            end_time = cfs_times[i + 1].normalize() if i + 1 < len(cfs_times) else None
-
-            if end_time:
-                relevant_encounters = patient_encounters[
-                    (patient_encounters["DischargeInstant"] >= start_time) &
-                    (patient_encounters["DischargeInstant"] < end_time)
-                ]
-            else:
-                relevant_encounters = patient_encounters[
-                    (patient_encounters["DischargeInstant"] >= start_time)
-                ]
-
-            for _, enc in relevant_encounters.iterrows():
-                dest_group = enc["DischargeDestGroup"]
-                date_diff = (enc["DischargeInstant"].normalize() - start_time).days
-                date_diffs.append(date_diff)
-                if pd.notna(dest_group):
-                    result_dict[cfs]["Antall"] += 1
-                    result_dict[cfs][dest_group] += 1
+def report_cfs_destinations(counts, date_diffs, unique_destinations):
+    # The table of analyze_cfs_destinations_by_intervals from cfs_destination_counts
+    result_dict = defaultdict(lambda: {"Antall": 0, **{d: 0 for d in unique_destinations}})
+    for (cfs, dest_group), count in counts.items():
+        result_dict[cfs]["Antall"] += count
+        result_dict[cfs][dest_group] += count
 
     # Print average date difference if available
     if date_diffs:
@@ -157,223 +201,150 @@ def plot_cfs_vs_adl(
     cfs_path="Øya_CFS.csv",
     adl_path="Øya_2_ADL.csv",
     encounters_path="Øya_encounters.csv",
-    measurement_name="ADL",  #"ADL", "Total score ADL", "R HP COCM IPLOS/ADL TOTAL VANLIG GJENNOMSNITT"
+    measurement_name="ADL",  #"ADL", "Total score ADL", "R HP COCM IPLOS/ADL TOTAL VANLIG GJENNOMSNITT", a list of these or "all"
     onlyUseLast50Days=True,
+    cfs_df=None,
+    adl_frames=None,
+    encounters_df=None,
 ):
     # Load and preprocess data
-    cfs_df = pd.read_csv(cfs_path)
-    adl_df = pd.read_csv(adl_path)
-    encounters_df = load_and_filter_encounters(encounters_path)
+    cfs_df = frame_or_read(cfs_df, cfs_path, REAL_PATIENTS)
+    adl_by_measurement = load_adl_measurements(adl_path, measurement_name, adl_frames)
+    encounters_df = load_and_filter_encounters(encounters_path, encounters_df)
 
     # Filter and convert date fields
-    cfs_df = cfs_df[cfs_df["PatientPseudoKey"] != 2384]
-    adl_df = adl_df[adl_df["PatientPseudoKey"] != 2384]
     encounters_df = encounters_df[encounters_df["PatientPseudoKey"] != 2384]
     encounters_df["DischargeInstant"] = pd.to_datetime(encounters_df["DischargeInstant"], errors="coerce")
+    encounters_df = encounters_df.dropna(subset=["DischargeInstant"])
     cfs_df["TakenInstant"] = pd.to_datetime(cfs_df["TakenInstant"], errors="coerce")
-    adl_df["MeasurementTime"] = pd.to_datetime(adl_df["MeasurementTime"], errors="coerce")
-    adl_df = adl_df[adl_df["MeasurementName"] == measurement_name]
-    adl_df = adl_df.dropna(subset=["MeasurementTime", "Value"])
-    adl_df["Value"] = pd.to_numeric(adl_df["Value"], errors="coerce")
-
-    results = []
-
-    for _, encounter in encounters_df.iterrows():
-        patient_id = encounter["PatientPseudoKey"]
-        discharge_time = encounter["DischargeInstant"]
-
-        if pd.isna(discharge_time):
-            continue
 
-        # Latest CFS before or at discharge
-        patient_cfs = cfs_df[(cfs_df["PatientPseudoKey"] == patient_id) & 
-                             (cfs_df["TakenInstant"] <= discharge_time)]
-        if patient_cfs.empty:
-            continue
-        latest_cfs_row = patient_cfs.sort_values("TakenInstant").iloc[-1]
-        latest_cfs = latest_cfs_row["CFS"]
-        cfs_diff_days = (discharge_time - latest_cfs_row["TakenInstant"]).days
+    # Latest CFS before or at discharge
+    cfs_match = nearest_in_time(encounters_df, cfs_df, "DischargeInstant", "TakenInstant", direction="backward")
+    encounters_df = encounters_df[cfs_match >= 0].copy()
+    latest_cfs = cfs_df.iloc[cfs_match[cfs_match >= 0]]
+    encounters_df["CFS"] = latest_cfs["CFS"].to_numpy()
+    encounters_df["CFSDiffDays"] = (encounters_df["DischargeInstant"] - latest_cfs["TakenInstant"].to_numpy()).dt.days
 
+    results = {}
+    for adl_name, adl_df in adl_by_measurement.items():
         # Latest ADL before or at discharge
-        patient_adl = adl_df[(adl_df["PatientPseudoKey"] == patient_id) & 
-                             (adl_df["MeasurementTime"] <= discharge_time)]
-        if patient_adl.empty:
-            continue
-        latest_adl_row = patient_adl.sort_values("MeasurementTime").iloc[-1]
-        latest_adl = latest_adl_row["Value"]
-        adl_diff_days = (discharge_time - latest_adl_row["MeasurementTime"]).days
+        adl_match = nearest_in_time(encounters_df, adl_df, "DischargeInstant", "MeasurementTime", direction="backward")
+        matched = encounters_df[adl_match >= 0]
+        latest_adl = adl_df.iloc[adl_match[adl_match >= 0]]
+        adl_diff_days = (matched["DischargeInstant"] - latest_adl["MeasurementTime"].to_numpy()).dt.days
 
-        if onlyUseLast50Days and (cfs_diff_days > 50 or adl_diff_days > 50):
-            continue
+        if onlyUseLast50Days:
+            recent = (matched["CFSDiffDays"] <= 50) & (adl_diff_days <= 50)
+            matched, latest_adl = matched[recent], latest_adl[recent.to_numpy()]
 
-        results.append({"CFS": latest_cfs, "ADL": latest_adl})
+        if matched.empty:
+            print(f"⚠️ No valid CFS and {adl_name} matches found.")
+            continue
+        results[adl_name] = pd.DataFrame({"CFS": matched["CFS"].to_numpy(), "ADL": latest_adl["Value"].to_numpy()})
 
     if not results:
-        print("⚠️ No valid CFS and ADL matches found.")
         return
 
-    result_df = pd.DataFrame(results)
-
-    # Plotting
-    plt.figure(figsize=(8, 6))
-    plt.scatter(result_df["CFS"], result_df["ADL"], alpha=0.7)
-    plt.xlabel("CFS Score")
-    plt.ylabel(f"{measurement_name} Value")
-    plt.title(f"CFS vs {measurement_name} (based on encounter discharge)")
-    plt.grid(True)
+    # Plotting, one panel per measurement
+    fig, axes = plt.subplots(1, len(results), figsize=(8 * len(results), 6), squeeze=False)
+    for ax, (adl_name, result_df) in zip(axes[0], results.items()):
+        ax.scatter(result_df["CFS"], result_df["ADL"], alpha=0.7)
+        ax.set_xlabel("CFS Score")
+        ax.set_ylabel(f"{adl_name} Value")
+        ax.set_title(f"CFS vs {adl_name} (based on encounter discharge)")
+        ax.grid(True)
     plt.tight_layout()
     plt.show()
 
+    return combine_measurements(measurement_name, results)
 
 
-def analyze_adl_outcomes_by_decile(adl_path="Øya_2_ADL.csv", encounters_path="Øya_encounters.csv", measurement_name="R HP COCM IPLOS/ADL TOTAL VANLIG GJENNOMSNITT", accept_scores_after=True):
-    #"ADL", "Total score ADL", "R HP COCM IPLOS/ADL TOTAL VANLIG GJENNOMSNITT"
-    # Load and preprocess ADL data
-    adl_df = pd.read_csv(adl_path)
-    adl_df = adl_df[adl_df["PatientPseudoKey"] != 2384]
-    adl_df = adl_df[adl_df["MeasurementName"] == measurement_name]
-    adl_df["MeasurementTime"] = pd.to_datetime(adl_df["MeasurementTime"], errors="coerce")
-    adl_df = adl_df.dropna(subset=["MeasurementTime", "Value"])
-    adl_df["Value"] = pd.to_numeric(adl_df["Value"], errors="coerce")
-    adl_df = adl_df.dropna(subset=["Value"])
-
-    # Load and preprocess encounters
-    encounters_df = pd.read_csv(encounters_path)
-    encounters_df = encounters_df[encounters_df["PatientPseudoKey"] != 2384]
-    encounters_df = encounters_df[encounters_df["EncounterType"] == "Sykehuskontakt"]
-    encounters_df["DischargeInstant"] = pd.to_datetime(encounters_df["DischargeInstant"], errors="coerce")
-
-    # Clean and group DischargeDisposition
-    drop_dispositions = {
-        "*Unspecified",
-        "Dratt på eget ansvar",
-        "Feilregistrert",
-        "Ikke ankommet akuttmottak",
-        "Reserved by NUBC#70"
-    }
-
-    group_disposition_map = {
-        "Som død - Melding går til sykepleietjeneste": "Som død",
-        "Som død - Ingen melding går": "Som død",
-        "Som død - Melding går til psykisk helsetjeneste": "Som død",
-        "Ut til hjemmet - Ingen melding går": "Ut til hjemmet",
-        "Ut til hjemmet - Melding går til psykisk helsetjeneste": "Ut til hjemmet",
-        "Ut til hjemmet - Melding går til sykepleietjeneste": "Ut til hjemmet",
-        "Ut til hjemmet (N/A)": "Ut til hjemmet"
-    }
 
-    if "DischargeDisposition" in encounters_df.columns:
-        encounters_df = encounters_df[~encounters_df["DischargeDisposition"].isin(drop_dispositions)]
-        encounters_df["DischargeDisposition"] = encounters_df["DischargeDisposition"].replace(group_disposition_map)
+def analyze_adl_outcomes_by_decile(adl_path="Øya_2_ADL.csv", encounters_path="Øya_encounters.csv", measurement_name="R HP COCM IPLOS/ADL TOTAL VANLIG GJENNOMSNITT", accept_scores_after=True, binning=None,
+                                   adl_frames=None, encounters_df=None, decisions_df=None, backend="pandas", decisions_path="Øya_decisions.csv"):
+    #"ADL", "Total score ADL", "R HP COCM IPLOS/ADL TOTAL VANLIG GJENNOMSNITT", a list of these or "all"
+    # Load and preprocess ADL data (every requested measurement in one read)
+    adl_by_measurement = load_adl_measurements(adl_path, measurement_name, adl_frames)
 
-    # Group mappings for DischargeDestination (existing logic)
-    group_hospital = {
-        "Annen helseinstitusjon innen spesialisthelsetjenesten",
-        "Annen helseinstitusjon innenfor spesialisthelsetjenesten",
-        "Somatisk sykehus STO",
-        "Psykiatrisk sykehus STO"
-    }
-    group_other = {
-        "*Unspecified",
-        "Annet",
-        "Annen institusjon (ikke helse)"
-    }
+    # Load and preprocess encounters: clean and group DischargeDisposition, group DischargeDestination
+    encounters_df = load_grouped_discharges(encounters_path, encounters_df, nursing_home=True, clean_dispositions=True,
+                                            backend=backend)
 
-    def group_destination(dest):
-        if pd.isna(dest):
-            return None
-        dest = dest.strip()
-        if dest in group_hospital:
-            return "Hospital"
-        elif dest in group_other:
-            return "Other/Unspecified"
-        elif dest == "Kommunale institusjoner i HP":
-            return "Sykehjem"
-        else:
-            return dest
-
-    encounters_df["DischargeDestGroup"] = encounters_df["DischargeDestination"].apply(group_destination)
-
-    # Prepare deciles from ADL values using equal-width bins
-    adl_df["Decile"] = pd.cut(adl_df["Value"], 9, labels=False)
-    bins = pd.cut(adl_df["Value"], 9)
-    bin_labels = bins.astype(str)
-    adl_df["DecileLabel"] = bin_labels
-
-    # Load Øya_decisions.csv to identify long-term care decisions
-    decisions_df = pd.read_csv("Øya_decisions.csv")
-    decisions_df = decisions_df[
-        (decisions_df["DecisionStatus"] == "Signert") &
-        (decisions_df["DecisionTemplate"] == "Vedtak om langtidsopphold i institusjon")
-    ]
+    # Load the decisions export to identify long-term care decisions
+    long_term = Cohort().where("DecisionStatus", "==", "Signert").where("DecisionTemplate", "==", LONG_TERM_TEMPLATE)
+    if use_lazy(backend):
+        decisions_df = collect(scan_export(decisions_path, long_term, decisions_df).select("PatientPseudoKey").unique())
+    else:
+        decisions_df = frame_or_read(decisions_df, decisions_path, long_term)
     long_term_patients = set(decisions_df["PatientPseudoKey"])
 
     # Result structure
     unique_destinations = encounters_df["DischargeDestGroup"].dropna().replace({"Kommunale institusjoner i HP": "Sykehjem"}).unique().tolist()
     unique_destinations = [d for d in unique_destinations if d not in {"Other/Unspecified", "Annen (somatisk) enhet ved egen helseinstitusjon", "Som død"}]
-    result_dict = defaultdict(lambda: {"Antall": 0, **{d: 0 for d in unique_destinations}, "Død, normal": 0, "Død, langtid": 0})
 
-    date_diffs = []
+    results = {}
+    for adl_name, adl_df in adl_by_measurement.items():
+        if len(adl_by_measurement) > 1:
+            print(f"\n📐 {adl_name}")
+
+        # Prepare deciles from ADL values (9 equal-width bins unless binning says otherwise)
+        adl_df = apply_bins(adl_df, resolve_bin_spec(binning, adl_df["Value"], adl_name))
 
-    for _, encounter in encounters_df.iterrows():
-        patient_id = encounter["PatientPseudoKey"]
-        discharge_time = encounter["DischargeInstant"]
-        dest_group = encounter["DischargeDestGroup"]
+        result_dict = defaultdict(lambda: {"Antall": 0, **{d: 0 for d in unique_destinations}, "Død, normal": 0, "Død, langtid": 0})
+
+        # Closest ADL measurement for every encounter relative to discharge time
+        match = nearest_in_time(
+            encounters_df, adl_df, "DischargeInstant", "MeasurementTime",
+            direction="nearest" if accept_scores_after else "backward",
+        )
+        matched = encounters_df[match >= 0].copy()
+        closest_adl = adl_df.iloc[match[match >= 0]]
+        matched["DecileLabel"] = closest_adl["DecileLabel"].to_numpy()
+        matched["MeasurementTime"] = closest_adl["MeasurementTime"].to_numpy()
 
         # Custom logic for "Som død" to split by long-term decision
-        if dest_group == "Som død":
-            if patient_id in long_term_patients:
-                dest_group = "Død, langtid"
-            else:
-                dest_group = "Død, normal"
-
-        # Find closest ADL measurement for this patient relative to discharge time
-        patient_adls = adl_df[adl_df["PatientPseudoKey"] == patient_id]
-        if not accept_scores_after:
-            patient_adls = patient_adls[patient_adls["MeasurementTime"] <= discharge_time]
-
-        if not patient_adls.empty and pd.notna(dest_group) and dest_group not in {"Other/Unspecified", "Annen (somatisk) enhet ved egen helseinstitusjon"}:
-            patient_adls = patient_adls.copy()
-            patient_adls["TimeDiff"] = (patient_adls["MeasurementTime"] - discharge_time).abs()
-            closest_adl = patient_adls.sort_values("TimeDiff").iloc[0]
-            # Guard clause for null MeasurementTime
-            if pd.isna(closest_adl["MeasurementTime"]):
-                continue
-            decile = closest_adl["DecileLabel"]
-            result_dict[decile]["Antall"] += 1
-            result_dict[decile][dest_group] += 1
-            if pd.notna(closest_adl["MeasurementTime"]) and pd.notna(discharge_time):
-                time_diff_days = abs((discharge_time - closest_adl["MeasurementTime"]).days)
-                date_diffs.append(time_diff_days)
+        is_death = matched["DischargeDestGroup"] == "Som død"
+        is_long_term = matched["PatientPseudoKey"].isin(long_term_patients)
+        matched.loc[is_death & is_long_term, "DischargeDestGroup"] = "Død, langtid"
+        matched.loc[is_death & ~is_long_term, "DischargeDestGroup"] = "Død, normal"
+        matched = matched.dropna(subset=["DischargeDestGroup"])
+        matched = matched[~matched["DischargeDestGroup"].isin({"Other/Unspecified", "Annen (somatisk) enhet ved egen helseinstitusjon"})]
+
+        for (decile, dest_group), count in matched.groupby(["DecileLabel", "DischargeDestGroup"]).size().items():
+            result_dict[decile]["Antall"] += count
+            result_dict[decile][dest_group] += count
+
+        date_diffs = (matched["DischargeInstant"] - matched["MeasurementTime"]).dt.days.abs()
+        if not date_diffs.empty:
+            avg_days_diff = date_diffs.mean()
+            print(f"📏 Average days between latest {adl_name} and discharge: {avg_days_diff:.2f} days")
+        else:
+            print("⚠️ No valid ADL-discharge matches to calculate average days difference.")
 
-    if date_diffs:
-        avg_days_diff = sum(date_diffs) / len(date_diffs)
-        print(f"📏 Average days between latest {measurement_name} and discharge: {avg_days_diff:.2f} days")
-    else:
-        print("⚠️ No valid ADL-discharge matches to calculate average days difference.")
+        # Convert to DataFrame
+        result_df = pd.DataFrame.from_dict(result_dict, orient="index").fillna(0).reset_index()
+        result_df.rename(columns={"index": "ADL_DecileLabel"}, inplace=True)
+        result_df = result_df.sort_values(by="ADL_DecileLabel")
 
-    # Convert to DataFrame
-    result_df = pd.DataFrame.from_dict(result_dict, orient="index").fillna(0).reset_index()
-    result_df.rename(columns={"index": "ADL_DecileLabel"}, inplace=True)
-    result_df = result_df.sort_values(by="ADL_DecileLabel")
+        # Add sum row
+        sum_row = result_df.drop(columns=["ADL_DecileLabel"]).sum()
+        sum_row["ADL_DecileLabel"] = "sum"
+        result_df = pd.concat([result_df, pd.DataFrame([sum_row])], ignore_index=True)
 
-    # Add sum row
-    sum_row = result_df.drop(columns=["ADL_DecileLabel"]).sum()
-    sum_row["ADL_DecileLabel"] = "sum"
-    result_df = pd.concat([result_df, pd.DataFrame([sum_row])], ignore_index=True)
+        # Calculate and display percentages
+        percentage_df = result_df.copy()
+        numeric_cols = [col for col in percentage_df.columns if col not in ["ADL_DecileLabel", "Antall"]]
+        for col in numeric_cols:
+            percentage_df[col] = (percentage_df[col] / percentage_df["Antall"] * 100).round(1).astype(str) + '%'
+        percentage_df = percentage_df.drop(columns=["Antall"])
+        print("\n📊 Original counts by ADL decile:")
+        print(result_df)
+        print("\n📊 Percentage breakdown by ADL decile:")
+        print(percentage_df)
 
-    # Calculate and display percentages
-    percentage_df = result_df.copy()
-    numeric_cols = [col for col in percentage_df.columns if col not in ["ADL_DecileLabel", "Antall"]]
-    for col in numeric_cols:
-        percentage_df[col] = (percentage_df[col] / percentage_df["Antall"] * 100).round(1).astype(str) + '%'
-    percentage_df = percentage_df.drop(columns=["Antall"])
-    print("\n📊 Original counts by ADL decile:")
-    print(result_df)
-    print("\n📊 Percentage breakdown by ADL decile:")
-    print(percentage_df)
+        results[adl_name] = result_df
 
-    return result_df
+    return combine_measurements(measurement_name, results)
 
 
 # New function: analyze_hospital_outcomes_by_decile
@@ -382,21 +353,18 @@ def analyze_hospital_outcomes_by_decile(
     hospital_path="Øya_2_hospitalencounters.csv",
     measurement_name="R HP COCM IPLOS/ADL TOTAL VANLIG GJENNOMSNITT",
     accept_scores_after=True,
+    decisions_path="Øya_decisions.csv",
+    binning=None,
+    adl_frames=None,
+    hospital_df=None,
+    decision_index=None,
+    backend="pandas",
 ):
-    # Load ADL
-    adl_df = pd.read_csv(adl_path)
-    adl_df = adl_df[adl_df["PatientPseudoKey"] != 2384]
-    adl_df = adl_df[adl_df["MeasurementName"] == measurement_name]
-    adl_df["MeasurementTime"] = pd.to_datetime(adl_df["MeasurementTime"], errors="coerce")
-    adl_df = adl_df.dropna(subset=["MeasurementTime", "Value"])
-    adl_df["Value"] = pd.to_numeric(adl_df["Value"], errors="coerce")
-    adl_df = adl_df.dropna(subset=["Value"])
-
-    # Load and preprocess hospital encounters
-    df = pd.read_csv(hospital_path)
-    df = df[df["PatientPseudoKey"] != 2384]
-    df = df[df["AdmissionSource"] == "Bosted/arbeidsted"]
-    df = df.dropna(subset=["DischargeDestination"])
+    # backend: "pandas", "duckdb" to run the long-term exclusion join in the SQL engine (see Oya_sql.py),
+    #          or "polars" to prepare the encounters with a lazy scan (see Oya_lazy.py)
+    # Load ADL (every requested measurement in one read)
+    adl_by_measurement = load_adl_measurements(adl_path, measurement_name, adl_frames)
+
     # Group mappings for merged categories
     merged_destination_map = {
         "Sykehjem": {"Sykehjem", "Langtidsopphold i sykehjem"}
@@ -407,8 +375,6 @@ def analyze_hospital_outcomes_by_decile(
     for merged_label, originals in merged_destination_map.items():
         for original in originals:
             destination_reverse_map[original] = merged_label
-    # Update DischargeDestination before grouping
-    df["DischargeDestination"] = df["DischargeDestination"].replace(destination_reverse_map)
     # Then define the filtered valid set
     valid_destinations = {
         "Sykehjem",
@@ -416,36 +382,22 @@ def analyze_hospital_outcomes_by_decile(
         "Som død",
         "Bosted/arbeidsted"
     }
-    df = df[df["DischargeDestination"].isin(valid_destinations)]
-    df = df[df["DischargeDestination"] != "Sykehjem"]
-    df["EncounterEnd"] = pd.to_datetime(df["EncounterEnd"], errors="coerce")
 
-    # --- Start Øya_decisions exclusion logic ---
-    # Load and preprocess Øya_decisions.csv
-    decisions_df = pd.read_csv("Øya_decisions.csv")
-    decisions_df = decisions_df[
-        (decisions_df["DecisionStatus"] == "Signert") &
-        (decisions_df["DecisionTemplate"] == "Vedtak om langtidsopphold i institusjon")
-    ]
-    decisions_df["DecisionValidDate"] = pd.to_datetime(decisions_df["DecisionValidDate"], format="%d/%m/%Y", errors="coerce")
-    # Parse hospital encounter dates as date-only for comparison
-    df["EncounterEndDateOnly"] = pd.to_datetime(df["EncounterEnd"], errors="coerce").dt.date
-    # Identify PatientPseudoKeys with valid long-term decisions before or on the day of encounter end
-    decisions_df = decisions_df.dropna(subset=["DecisionValidDate", "PatientPseudoKey"])
-    merged = pd.merge(
-        df[["PatientPseudoKey", "EncounterEndDateOnly"]],
-        decisions_df[["PatientPseudoKey", "DecisionValidDate"]],
-        on="PatientPseudoKey",
-        how="left"
-    )
-    merged = merged.dropna(subset=["DecisionValidDate"])
-    merged["DecisionValidDate"] = pd.to_datetime(merged["DecisionValidDate"]).dt.date
-    merged["FlagExclude"] = merged["DecisionValidDate"] <= merged["EncounterEndDateOnly"]
-    patients_to_exclude = set(merged[merged["FlagExclude"]]["PatientPseudoKey"])
-    df = df[~df["PatientPseudoKey"].isin(patients_to_exclude)]
-    # Remove the temporary date-only column after filtering
-    df = df.drop(columns=["EncounterEndDateOnly"])
-    # --- End Øya_decisions exclusion logic ---
+    # Load hospital encounters, without those that end on or after the patient's signed long-term decision
+    if use_lazy(backend) and decision_index is None:
+        # The exclusion join and the destination filters as one lazy plan
+        destination = pl.col("DischargeDestination").cast(pl.String).replace(destination_reverse_map)
+        df = collect(home_admissions_plan(hospital_path, decisions_path, hospital_df)
+                     .filter(destination.is_in(list(valid_destinations)) & (destination != "Sykehjem"))
+                     .with_columns(destination))
+    else:
+        df = load_home_admissions(hospital_path, decisions_path, hospital_df, decision_index, backend)
+        df = df.dropna(subset=["DischargeDestination"])
+        # Update DischargeDestination before grouping
+        df["DischargeDestination"] = df["DischargeDestination"].astype(object).replace(destination_reverse_map)
+        df = df[df["DischargeDestination"].isin(valid_destinations)]
+        df = df[df["DischargeDestination"] != "Sykehjem"]
+    df["EncounterEnd"] = pd.to_datetime(df["EncounterEnd"], errors="coerce")
 
     # Note: Only DischargeDestGroup (from DischargeDestination) is used in this function, not DischargeDisposition.
     # If cleaning/grouping DischargeDisposition is needed, add similar logic as above.
@@ -453,171 +405,309 @@ def analyze_hospital_outcomes_by_decile(
     # No additional grouping needed: DischargeDestination has already been merged/grouped above.
     df["DischargeDestGroup"] = df["DischargeDestination"]  # Already grouped
 
-    # Decile bucketing using equal-width bins
-    adl_df["Decile"] = pd.cut(adl_df["Value"], 9, labels=False)
-    bins = pd.cut(adl_df["Value"], 9)
-    bin_labels = bins.astype(str)
-    adl_df["DecileLabel"] = bin_labels
-
     # Result
     unique_destinations = df["DischargeDestGroup"].dropna().unique().tolist()
-    result_dict = defaultdict(lambda: {"Antall": 0, **{d: 0 for d in unique_destinations}})
-
-    date_diffs = []
-
-    for _, enc in df.iterrows():
-        patient_id = enc["PatientPseudoKey"]
-        discharge_time = enc["EncounterEnd"]
-        dest_group = enc["DischargeDestGroup"]
-
-        patient_adls = adl_df[adl_df["PatientPseudoKey"] == patient_id]
-        if not accept_scores_after:
-            patient_adls = patient_adls[patient_adls["MeasurementTime"] <= discharge_time]
 
-        if not patient_adls.empty and pd.notna(dest_group):
-            patient_adls = patient_adls.copy()
-            patient_adls["TimeDiff"] = (patient_adls["MeasurementTime"] - discharge_time).abs()
-            closest_adl = patient_adls.sort_values("TimeDiff").iloc[0]
-
-            if pd.isna(closest_adl["MeasurementTime"]):
-                continue
+    results = {}
+    for adl_name, adl_df in adl_by_measurement.items():
+        if len(adl_by_measurement) > 1:
+            print(f"\n📐 {adl_name}")
+
+        # Decile bucketing (9 equal-width bins unless binning says otherwise)
+        adl_df = apply_bins(adl_df, resolve_bin_spec(binning, adl_df["Value"], adl_name))
+
+        result_dict = defaultdict(lambda: {"Antall": 0, **{d: 0 for d in unique_destinations}})
+
+        # Closest ADL measurement for every encounter relative to hospital discharge
+        match = nearest_in_time(
+            df, adl_df, "EncounterEnd", "MeasurementTime",
+            direction="nearest" if accept_scores_after else "backward",
+        )
+        matched = df[match >= 0].copy()
+        closest_adl = adl_df.iloc[match[match >= 0]]
+        matched["DecileLabel"] = closest_adl["DecileLabel"].to_numpy()
+        matched["MeasurementTime"] = closest_adl["MeasurementTime"].to_numpy()
+        matched = matched.dropna(subset=["DischargeDestGroup"])
+
+        for (decile, dest_group), count in matched.groupby(["DecileLabel", "DischargeDestGroup"]).size().items():
+            result_dict[decile]["Antall"] += count
+            result_dict[decile][dest_group] += count
+
+        date_diffs = (matched["EncounterEnd"] - matched["MeasurementTime"]).dt.days.abs()
+        if not date_diffs.empty:
+            avg_days_diff = date_diffs.mean()
+            print(f"📏 Average days between latest {adl_name} and hospital discharge: {avg_days_diff:.2f} days")
+        else:
+            print("⚠️ No valid ADL-hospital matches to calculate average days difference.")
 
-            decile = closest_adl["DecileLabel"]
-            result_dict[decile]["Antall"] += 1
-            result_dict[decile][dest_group] += 1
+        result_df = pd.DataFrame.from_dict(result_dict, orient="index").fillna(0).reset_index()
+        result_df.rename(columns={"index": "ADL_DecileLabel"}, inplace=True)
+        result_df = result_df.sort_values(by="ADL_DecileLabel")
 
-            if pd.notna(discharge_time):
-                time_diff_days = abs((discharge_time - closest_adl["MeasurementTime"]).days)
-                date_diffs.append(time_diff_days)
+        # Add sum row
+        sum_row = result_df.drop(columns=["ADL_DecileLabel"]).sum()
+        sum_row["ADL_DecileLabel"] = "sum"
+        result_df = pd.concat([result_df, pd.DataFrame([sum_row])], ignore_index=True)
 
-    if date_diffs:
-        avg_days_diff = sum(date_diffs) / len(date_diffs)
-        print(f"📏 Average days between latest {measurement_name} and hospital discharge: {avg_days_diff:.2f} days")
-    else:
-        print("⚠️ No valid ADL-hospital matches to calculate average days difference.")
+        # Calculate and display percentages
+        percentage_df = result_df.copy()
+        numeric_cols = [col for col in percentage_df.columns if col not in ["ADL_DecileLabel", "Antall"]]
+        for col in numeric_cols:
+            percentage_df[col] = (percentage_df[col] / percentage_df["Antall"] * 100).round(1).astype(str) + '%'
+        percentage_df = percentage_df.drop(columns=["Antall"])
+        print("\n📊 Original counts by ADL decile:")
+        print(result_df)
+        print("\n📊 Percentage breakdown by ADL decile:")
+        print(percentage_df)
 
-    result_df = pd.DataFrame.from_dict(result_dict, orient="index").fillna(0).reset_index()
-    result_df.rename(columns={"index": "ADL_DecileLabel"}, inplace=True)
-    result_df = result_df.sort_values(by="ADL_DecileLabel")
+        results[adl_name] = result_df
 
-    # Add sum row
-    sum_row = result_df.drop(columns=["ADL_DecileLabel"]).sum()
-    sum_row["ADL_DecileLabel"] = "sum"
-    result_df = pd.concat([result_df, pd.DataFrame([sum_row])], ignore_index=True)
+    return combine_measurements(measurement_name, results)
 
-    # Calculate and display percentages
-    percentage_df = result_df.copy()
-    numeric_cols = [col for col in percentage_df.columns if col not in ["ADL_DecileLabel", "Antall"]]
-    for col in numeric_cols:
-        percentage_df[col] = (percentage_df[col] / percentage_df["Antall"] * 100).round(1).astype(str) + '%'
-    percentage_df = percentage_df.drop(columns=["Antall"])
-    print("\n📊 Original counts by ADL decile:")
-    print(result_df)
-    print("\n📊 Percentage breakdown by ADL decile:")
-    print(percentage_df)
 
-    return result_df
+# Helper: home admissions outside long-term stays, shared by the decile outcomes and the transition pairs
+def load_home_admissions(
+    hospital_path="Øya_2_hospitalencounters.csv",
+    decisions_path="Øya_decisions.csv",
+    hospital_df=None,
+    decision_index=None,
+    backend="pandas",
+):
+    # Drop encounters that end on or after the patient's signed long-term decision
+    if use_sql(backend) and decision_index is None:
+        # Same rule as Oya_joins.exclude_long_term_stays, as a join on the first signed decision per patient
+        return run_query('''
+            WITH first_long_term AS (
+                SELECT "PatientPseudoKey", MIN("DecisionValidDate") AS first_valid
+                FROM decisions
+                WHERE "DecisionTemplate" = ? AND "DecisionStatus" = 'Signert'
+                  AND "PatientPseudoKey" IS NOT NULL AND "DecisionValidDate" IS NOT NULL
+                GROUP BY "PatientPseudoKey"
+            )
+            SELECT stays.*
+            FROM hospital AS stays
+            LEFT JOIN first_long_term ON stays."PatientPseudoKey" = first_long_term."PatientPseudoKey"
+            WHERE NOT COALESCE(CAST(first_long_term.first_valid AS DATE) <= CAST(stays."EncounterEnd" AS DATE), FALSE)
+            ORDER BY stays.__row
+        ''', {"hospital": (hospital_path, hospital_df, HOME_ADMISSIONS), "decisions": (decisions_path, None, None)},
+            [LONG_TERM_TEMPLATE])
+
+    if use_lazy(backend) and decision_index is None:
+        return collect(home_admissions_plan(hospital_path, decisions_path, hospital_df))
+
+    df = frame_or_read(hospital_df, hospital_path, HOME_ADMISSIONS)
+    if decision_index is None:
+        decision_index = build_decision_index(read_export(decisions_path))
+    return exclude_long_term_stays(df, "EncounterEnd", decision_index)
+
+def home_admissions_plan(hospital_path="Øya_2_hospitalencounters.csv", decisions_path="Øya_decisions.csv", hospital_df=None):
+    # load_home_admissions as a polars LazyFrame, the exclusion as a join on the first signed decision per patient
+    first_long_term = (
+        scan_export(decisions_path)
+        .filter((pl.col("DecisionTemplate") == LONG_TERM_TEMPLATE) & (pl.col("DecisionStatus") == "Signert")
+                & pl.col("PatientPseudoKey").is_not_null() & pl.col("DecisionValidDate").is_not_null())
+        .group_by(pl.col("PatientPseudoKey").cast(pl.Int64).alias("_key"))
+        .agg(pl.col("DecisionValidDate").min().alias("_first_valid"))
+    )
+    held = (pl.col("_first_valid").dt.date() <= pl.col("EncounterEnd").dt.date()).fill_null(False)
+    return (
+        scan_export(hospital_path, HOME_ADMISSIONS, hospital_df)
+        .with_columns(pl.col("PatientPseudoKey").cast(pl.Int64).alias("_key"))
+        .join(first_long_term, on="_key", how="left")
+        .filter(~held)
+        .drop("_key", "_first_valid")
+        .sort(ROW_COLUMN)
+    )
 
 
-# New function: analyze_adl_development_matrix
-def analyze_adl_development_matrix(
+# Helper: consecutive-stay ADL transitions shared by the matrix and its bootstrap
+def load_adl_transition_pairs(
     adl_path="Øya_2_ADL.csv",
     hospital_path="Øya_2_hospitalencounters.csv",
     decisions_path="Øya_decisions.csv",
     measurement_name="R HP COCM IPLOS/ADL TOTAL VANLIG GJENNOMSNITT",
+    window_days=30,
+    binning=None,
+    adl_frames=None,
+    hospital_df=None,
+    decision_index=None,
+    backend="pandas",
 ):
-    import numpy as np
-
-    # Load data
-    adl_df = pd.read_csv(adl_path)
-    enc_df = pd.read_csv(hospital_path)
-    dec_df = pd.read_csv(decisions_path)
-
-    # Preprocess ADL
-    adl_df = adl_df[adl_df["PatientPseudoKey"] != 2384]
-    adl_df = adl_df[adl_df["MeasurementName"] == measurement_name]
-    adl_df["MeasurementTime"] = pd.to_datetime(adl_df["MeasurementTime"], errors="coerce")
-    adl_df["Value"] = pd.to_numeric(adl_df["Value"], errors="coerce")
-    adl_df = adl_df.dropna(subset=["MeasurementTime", "Value"])
+    # Load data, without encounters during long-term stays
+    adl_df = load_adl_measurements(adl_path, measurement_name, adl_frames)[measurement_name]
+    enc_df = load_home_admissions(hospital_path, decisions_path, hospital_df, decision_index, backend)
 
     # Preprocess hospital encounters
-    enc_df = enc_df[enc_df["PatientPseudoKey"] != 2384]
-    enc_df = enc_df[enc_df["AdmissionSource"] == "Bosted/arbeidsted"]
     enc_df["EncounterEnd"] = pd.to_datetime(enc_df["EncounterEnd"], errors="coerce")
     enc_df = enc_df.dropna(subset=["EncounterEnd"])
 
-    # Exclude long-term patients
-    dec_df = dec_df[
-        (dec_df["DecisionStatus"] == "Signert") &
-        (dec_df["DecisionTemplate"] == "Vedtak om langtidsopphold i institusjon")
-    ]
-    dec_df["DecisionValidDate"] = pd.to_datetime(dec_df["DecisionValidDate"], format="%d/%m/%Y", errors="coerce")
-    enc_df["EncounterEndDateOnly"] = enc_df["EncounterEnd"].dt.date
-    merged = pd.merge(
-        enc_df[["PatientPseudoKey", "EncounterEndDateOnly"]],
-        dec_df[["PatientPseudoKey", "DecisionValidDate"]],
-        on="PatientPseudoKey",
-        how="left"
-    )
-    merged = merged.dropna(subset=["DecisionValidDate"])
-    merged["DecisionValidDate"] = pd.to_datetime(merged["DecisionValidDate"]).dt.date
-    merged["FlagExclude"] = merged["DecisionValidDate"] <= merged["EncounterEndDateOnly"]
-    patients_to_exclude = set(merged[merged["FlagExclude"]]["PatientPseudoKey"])
-    enc_df = enc_df[~enc_df["PatientPseudoKey"].isin(patients_to_exclude)].drop(columns=["EncounterEndDateOnly"])
-
     # Build deciles
-    adl_df["Decile"] = pd.cut(adl_df["Value"], 9, labels=False)
-
-    # Init matrix
-    matrix = np.zeros((9, 9), dtype=int)
-    skipped = 0
-
-    # Group by patient
-    for pid, group in enc_df.groupby("PatientPseudoKey"):
-        sorted_encounters = group.sort_values("EncounterEnd")
-        if len(sorted_encounters) < 2:
-            continue
-
-        for i in range(len(sorted_encounters) - 1):
-            row1 = sorted_encounters.iloc[i]
-            row2 = sorted_encounters.iloc[i + 1]
-
-            # Get closest ADL within ±30 days
-            adl1 = adl_df[(adl_df["PatientPseudoKey"] == pid) &
-                          (adl_df["MeasurementTime"] >= row1["EncounterEnd"] - pd.Timedelta(days=30)) &
-                          (adl_df["MeasurementTime"] <= row1["EncounterEnd"] + pd.Timedelta(days=30))]
-
-            adl2 = adl_df[(adl_df["PatientPseudoKey"] == pid) &
-                          (adl_df["MeasurementTime"] >= row2["EncounterEnd"] - pd.Timedelta(days=30)) &
-                          (adl_df["MeasurementTime"] <= row2["EncounterEnd"] + pd.Timedelta(days=30))]
+    spec = resolve_bin_spec(binning, adl_df["Value"], measurement_name)
+    adl_df = apply_bins(adl_df, spec, label_col=None)
+
+    from_decile, to_decile, pair_patients, valid = pair_consecutive_stays(enc_df, adl_df, window_days)
+    skipped = int(len(valid) - valid.sum())
+    return from_decile[valid], to_decile[valid], pair_patients[valid], skipped, n_bins_of(spec)
+
+
+def pair_consecutive_stays(enc_df, adl_df, window_days=30, kernels=COMPILED):
+    # Closest binned ADL within ±window_days of every stay, then pair each stay with the patient's next one.
+    # Returns (from_decile, to_decile, pair_patients, valid) per pair; pairs with a missing measurement,
+    # a measurement outside every bin (fixed cut points), or where both stays map to the same measurement,
+    # are not valid and have deciles -1.
+    # kernels: match and pair each patient's stays in one walk in Oya_kernels.py (the default when numba is installed)
+    if kernels:
+        first, second, pair_patients, valid = consecutive_stay_pairs(
+            enc_df["PatientPseudoKey"].to_numpy(), enc_df["EncounterEnd"], adl_df["PatientPseudoKey"].to_numpy(),
+            adl_df["MeasurementTime"], pd.Timedelta(days=window_days))
+    else:
+        enc_df = enc_df.sort_values(["PatientPseudoKey", "EncounterEnd"], kind="stable")
+        match = nearest_in_time(enc_df, adl_df, "EncounterEnd", "MeasurementTime", tolerance=pd.Timedelta(days=window_days),
+                                kernels=False)
+        patients = enc_df["PatientPseudoKey"].to_numpy()
+        same_patient = patients[1:] == patients[:-1]
+        first, second = match[:-1][same_patient], match[1:][same_patient]
+        pair_patients = patients[1:][same_patient]
+
+        times = adl_df["MeasurementTime"].to_numpy()
+        valid = (first >= 0) & (second >= 0)
+        valid[valid] = times[first[valid]] != times[second[valid]]
+
+    deciles = adl_df["Decile"].to_numpy(dtype=float)
+    valid[valid] = ~np.isnan(deciles[first[valid]]) & ~np.isnan(deciles[second[valid]])
+    from_decile = np.full(len(valid), -1)
+    to_decile = np.full(len(valid), -1)
+    from_decile[valid] = deciles[first[valid]].astype(int)
+    to_decile[valid] = deciles[second[valid]].astype(int)
+    return from_decile, to_decile, pair_patients, valid
 
-            if adl1.empty or adl2.empty:
-                skipped += 1
-                continue
 
-            closest1 = adl1.loc[(adl1["MeasurementTime"] - row1["EncounterEnd"]).abs().idxmin()]
-            closest2 = adl2.loc[(adl2["MeasurementTime"] - row2["EncounterEnd"]).abs().idxmin()]
+# New function: analyze_adl_development_matrix
+def analyze_adl_development_matrix(
+    adl_path="Øya_2_ADL.csv",
+    hospital_path="Øya_2_hospitalencounters.csv",
+    decisions_path="Øya_decisions.csv",
+    measurement_name="R HP COCM IPLOS/ADL TOTAL VANLIG GJENNOMSNITT",
+    binning=None,
+    adl_frames=None,
+    hospital_df=None,
+    decision_index=None,
+    backend="pandas",
+):
+    from_decile, to_decile, _, skipped, n_bins = load_adl_transition_pairs(
+        adl_path, hospital_path, decisions_path, measurement_name, binning=binning,
+        adl_frames=adl_frames, hospital_df=hospital_df, decision_index=decision_index, backend=backend,
+    )
 
-            if closest1["MeasurementTime"] == closest2["MeasurementTime"]:
-                skipped += 1
-                continue
+    # Count transitions
+    matrix = np.zeros((n_bins, n_bins), dtype=int)
+    np.add.at(matrix, (from_decile, to_decile), 1)
+    return report_adl_development_matrix(matrix, skipped)
 
-            from_decile = int(closest1["Decile"])
-            to_decile = int(closest2["Decile"])
-            matrix[from_decile, to_decile] += 1
 
-    # Output
-    matrix_df = pd.DataFrame(matrix, columns=[f"To_{i}" for i in range(9)], index=[f"From_{i}" for i in range(9)])
+def report_adl_development_matrix(matrix, skipped):
+    # Print the transition counts and row-wise percentages; returns the counts as a DataFrame
+    n_bins = matrix.shape[0]
+    matrix_df = pd.DataFrame(matrix, columns=[f"To_{i}" for i in range(n_bins)], index=[f"From_{i}" for i in range(n_bins)])
     print("\n📈 ADL Development Matrix (hospital stay to stay):")
     print(matrix_df)
     # Calculate row-wise percentages
     percentage_matrix = matrix / matrix.sum(axis=1, keepdims=True)
-    percentage_df = pd.DataFrame((percentage_matrix * 100).round(1), columns=[f"To_{i}" for i in range(9)], index=[f"From_{i}" for i in range(9)])
+    percentage_df = pd.DataFrame((percentage_matrix * 100).round(1), columns=matrix_df.columns, index=matrix_df.index)
     print("\n📊 ADL Development Matrix (% transitions row-wise):")
     print(percentage_df)
     print(f"\n⚠️ Skipped transitions due to missing or duplicate measurements: {skipped}")
     return matrix_df
 
+
+def _transition_probabilities(counts):
+    # Row-normalise (..., n, n) count matrices; rows without transitions are unknown (NaN)
+    totals = counts.sum(axis=-1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(totals > 0, counts / totals, np.nan)
+
+
+def _k_step_probabilities(probs, k):
+    # k-step probabilities of (..., n, n) transition matrices. A row is unknown (NaN) when the chain
+    # can reach a state without transitions within k steps: its mass leaks out of the known rows.
+    power = np.linalg.matrix_power(np.nan_to_num(probs), k)
+    return np.where(np.isclose(power.sum(axis=-1, keepdims=True), 1), power, np.nan)
+
+
+# New function: bootstrap_adl_development_matrix
+def bootstrap_adl_development_matrix(
+    adl_path="Øya_2_ADL.csv",
+    hospital_path="Øya_2_hospitalencounters.csv",
+    decisions_path="Øya_decisions.csv",
+    measurement_name="R HP COCM IPLOS/ADL TOTAL VANLIG GJENNOMSNITT",
+    n_bootstrap=1000,
+    confidence=0.95,
+    k_steps=(1, 2, 3),
+    random_state=None,
+    batch_size=200,
+    binning=None,
+    adl_frames=None,
+    hospital_df=None,
+    decision_index=None,
+    backend="pandas",
+):
+    # Patient-level bootstrap of the transition probabilities. Patients are resampled with
+    # replacement, and every replicate is a weighted sum of per-patient count matrices, so a
+    # whole batch of replicates is one matrix product.
+    from_decile, to_decile, pair_patients, _, n_bins = load_adl_transition_pairs(
+        adl_path, hospital_path, decisions_path, measurement_name, binning=binning,
+        adl_frames=adl_frames, hospital_df=hospital_df, decision_index=decision_index, backend=backend,
+    )
+    labels_to = [f"To_{i}" for i in range(n_bins)]
+    labels_from = [f"From_{i}" for i in range(n_bins)]
+
+    patients, patient_code = np.unique(pair_patients, return_inverse=True)
+    per_patient = np.zeros((len(patients), n_bins * n_bins))
+    np.add.at(per_patient, (patient_code, from_decile * n_bins + to_decile), 1)
+    point = per_patient.sum(axis=0).reshape(n_bins, n_bins)
+
+    rng = np.random.default_rng(random_state)
+    replicates = np.zeros((n_bootstrap, n_bins, n_bins))
+    if len(patients) > 0:
+        uniform = np.full(len(patients), 1 / len(patients))
+        for start in range(0, n_bootstrap, batch_size):
+            stop = min(start + batch_size, n_bootstrap)
+            weights = rng.multinomial(len(patients), uniform, size=stop - start)
+            replicates[start:stop] = (weights @ per_patient).reshape(-1, n_bins, n_bins)
+
+    alpha = (1 - confidence) / 2 * 100
+    point_probs = _transition_probabilities(point)
+    replicate_probs = _transition_probabilities(replicates)
+
+    results = {"counts": pd.DataFrame(point.astype(int), columns=labels_to, index=labels_from), "k_step": {}}
+    for k in k_steps:
+        # Intervals over the replicates in which the row is known ("replicates" per row)
+        point_k = _k_step_probabilities(point_probs, k)
+        replicate_k = _k_step_probabilities(replicate_probs, k)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # Rows no replicate covers stay NaN
+            lower, upper = np.nanpercentile(replicate_k, [alpha, 100 - alpha], axis=0)
+        results["k_step"][k] = {
+            "probability": pd.DataFrame(point_k, columns=labels_to, index=labels_from),
+            "lower": pd.DataFrame(lower, columns=labels_to, index=labels_from),
+            "upper": pd.DataFrame(upper, columns=labels_to, index=labels_from),
+            "replicates": pd.Series((~np.isnan(replicate_k[..., 0])).sum(axis=0), index=labels_from, name="replicates"),
+        }
+
+    print(f"\n🔁 ADL transition bootstrap: {n_bootstrap} resamples of {len(patients)} patients, {confidence:.0%} intervals")
+    for k in k_steps:
+        bands = results["k_step"][k]
+        print(f"\n📊 {k}-step transition probabilities (%):")
+        print((bands["probability"] * 100).round(1))
+        print("  Lower bound (%):")
+        print((bands["lower"] * 100).round(1))
+        print("  Upper bound (%):")
+        print((bands["upper"] * 100).round(1))
+        sparse = bands["replicates"][bands["replicates"] < n_bootstrap]
+        if len(sparse):
+            print(f"  Replicates covering each row (of {n_bootstrap}): {sparse.to_dict()}")
+    return results
+
 if __name__ == "__main__":
     
     #summary = analyze_cfs_outcomes()
@@ -1,91 +1,114 @@
 import pandas as pd
 from collections import Counter
-from scipy import stats
-
-def analyze_daily_deaths(file_path="Øya_2_hospitalencounters.csv"):
-    df = pd.read_csv(file_path, na_values=[""])
-
-    # Filter out test patient
-    df = df[df["PatientPseudoKey"] != 2384]
+from Oya_loader import frame_or_read, read_export
+from Oya_cohort import HOME_ADMISSIONS, REAL_PATIENTS
+from Oya_adl import apply_bins, combine_measurements, load_adl_measurements, resolve_bin_spec
+from Oya_counts import daily_statistics
+from Oya_joins import build_decision_index, exclude_long_term_stays, join_nearest, nearest_in_time
+from Oya_kernels import COMPILED, days_since_previous
+from Oya_lazy import collect, pl, scan_export, use_lazy
+
+def analyze_daily_deaths(file_path="Øya_2_hospitalencounters.csv", hospital_df=None, backend="pandas"):
+    # backend: "polars" to prepare the rows with a lazy scan (see Oya_lazy.py)
+    # Without the test patient, and only the columns used here
+    cohort = REAL_PATIENTS.select(["PatientPseudoKey", "DeathDate"])
+    if use_lazy(backend):
+        # DeathDate is parsed by the scan; first valid death date per patient
+        df = collect(scan_export(file_path, cohort, hospital_df)
+                     .filter(pl.col("DeathDate").is_not_null())
+                     .unique(subset=["PatientPseudoKey"], keep="first", maintain_order=True))
+    else:
+        df = frame_or_read(hospital_df, file_path, cohort)
 
-    # Filter out blank DeathDate values before parsing
-    df = df[df["DeathDate"].notna()]
-    df["DeathDate"] = pd.to_datetime(df["DeathDate"], dayfirst=True, errors="coerce")
-    df = df[df["DeathDate"].notna()]
+        # Filter out blank DeathDate values before parsing
+        df = df[df["DeathDate"].notna()]
+        df["DeathDate"] = pd.to_datetime(df["DeathDate"], dayfirst=True, errors="coerce")
+        df = df[df["DeathDate"].notna()]
 
-    # Drop duplicate PatientPseudoKey to count each patient once
-    df = df.drop_duplicates(subset=["PatientPseudoKey"])
+        # Drop duplicate PatientPseudoKey to count each patient once
+        df = df.drop_duplicates(subset=["PatientPseudoKey"])
     print(f"✅ Parsed valid death dates (unique patients): {len(df)}")
 
     # Get only date part
     df["DeathDateOnly"] = df["DeathDate"].dt.date
 
     # Count deaths per day (unique patients)
-    daily_deaths = df["DeathDateOnly"].value_counts().sort_index()
+    stats, cube = daily_statistics(df, "DeathDateOnly")
+    daily_deaths = pd.Series(cube.iloc[0].to_numpy(), index=pd.Index(cube.columns, name="DeathDateOnly"), name="count")
 
     if daily_deaths.empty:
         print("\n💀 Deaths per day:\nNo valid death dates found.")
         return daily_deaths
 
-    min_val = daily_deaths.min()
-    max_val = daily_deaths.max()
-    avg_val = daily_deaths.mean()
-    mode_result = stats.mode(daily_deaths, keepdims=True)
-    mode_val = mode_result.mode[0] if len(mode_result.mode) > 0 else float("nan")
-
-    print(f"\n💀 Deaths per day (unique patients):")
-    print(f"Minimum: {min_val}")
-    print(f"Maximum: {max_val}")
-    print(f"Average: {avg_val:.2f}")
-    print(f"Mode: {mode_val}")
+    print_day_statistics("\n💀 Deaths per day (unique patients):", stats.iloc[0])
 
-    return daily_deaths.sort_index()
+    return daily_deaths
 
+def print_day_statistics(title, day_stats):
+    # day_stats: one row of Oya_counts.cube_statistics
+    print(title)
+    print(f"Minimum: {int(day_stats['Minimum'])}")
+    print(f"Maximum: {int(day_stats['Maximum'])}")
+    print(f"Average: {day_stats['Average']:.2f}")
+    print(f"Mode: {int(day_stats['Mode'])}")
 
-def analyze_daily_admissions(file_path="Øya_2_hospitalencounters.csv"):
-    df = pd.read_csv(file_path)
 
-    # Filter out test patient and keep only relevant source
-    df = df[df["PatientPseudoKey"] != 2384]
-    df = df[df["AdmissionSource"] == "Bosted/arbeidsted"]
+def analyze_daily_admissions(file_path="Øya_2_hospitalencounters.csv", strata=(), hospital_df=None, backend="pandas"):
+    # Without the test patient, admissions from home only
+    if use_lazy(backend):
+        # One admission per patient and day, deduplicated in the scan
+        df = collect(scan_export(file_path, HOME_ADMISSIONS, hospital_df)
+                     .with_columns(pl.col("EncounterStart").dt.date().alias("AdmissionDate"))
+                     .unique(subset=["PatientPseudoKey", "AdmissionDate"], keep="first", maintain_order=True)
+                     .drop("AdmissionDate"))
+        df["AdmissionDate"] = df["EncounterStart"].dt.date
+    else:
+        df = frame_or_read(hospital_df, file_path, HOME_ADMISSIONS)
 
-    # Parse EncounterStart to date
-    df["EncounterStart"] = pd.to_datetime(df["EncounterStart"], format="%Y-%m-%d %H:%M:%S", errors="coerce")
-    df["AdmissionDate"] = df["EncounterStart"].dt.date
+        # Parse EncounterStart to date
+        df["EncounterStart"] = pd.to_datetime(df["EncounterStart"], format="%Y-%m-%d %H:%M:%S", errors="coerce")
+        df["AdmissionDate"] = df["EncounterStart"].dt.date
 
-    df = df.drop_duplicates(subset=["PatientPseudoKey", "AdmissionDate"])
+        df = df.drop_duplicates(subset=["PatientPseudoKey", "AdmissionDate"])
 
     # Count admissions per day
-    daily_counts = df["AdmissionDate"].value_counts().sort_index()
-
-    min_val = daily_counts.min()
-    max_val = daily_counts.max()
-    avg_val = daily_counts.mean()
-    mode_val = stats.mode(daily_counts, keepdims=True).mode[0]
-
-    print(f"📆 Admissions from home per day:")
-    print(f"Minimum: {min_val}")
-    print(f"Maximum: {max_val}")
-    print(f"Average: {avg_val:.2f}")
-    print(f"Mode: {mode_val}")
-    
-    return daily_counts.sort_index()
-
-def count_unique_patients(file_path="Øya_2_hospitalencounters.csv"):
-    df = pd.read_csv(file_path, na_values=[""])
-
-    # Filter out test patient
-    df = df[df["PatientPseudoKey"] != 2384]
-
-    total_unique = df["PatientPseudoKey"].nunique()
-
-    # Parse and filter DeathDate properly
-    if "DeathDate" in df.columns:
-        df["DeathDate"] = pd.to_datetime(df["DeathDate"], dayfirst=True, errors="coerce")
-        df = df[df["DeathDate"].notna()]
-        df = df.drop_duplicates(subset=["PatientPseudoKey"])
-        deceased_unique = df["PatientPseudoKey"].nunique()
+    stats, cube = daily_statistics(df, "AdmissionDate")
+    daily_counts = pd.Series(cube.iloc[0].to_numpy(), index=pd.Index(cube.columns, name="AdmissionDate"), name="count")
+
+    print_day_statistics("📆 Admissions from home per day:", stats.iloc[0])
+
+    # Optional breakdown, e.g. strata=["Department"] or ["Weekday"]; days without admissions
+    # in a stratum are left out, as for the overall counts
+    if strata:
+        strata_stats, _ = daily_statistics(df, "AdmissionDate", strata, skip_zero_days=True)
+        print(f"\n📆 Admissions from home per day by {', '.join(strata)}:")
+        print(strata_stats.round(2).to_string())
+
+    return daily_counts
+
+def count_unique_patients(file_path="Øya_2_hospitalencounters.csv", hospital_df=None, backend="pandas"):
+    # Without the test patient, and only the columns used here
+    cohort = REAL_PATIENTS.select(["PatientPseudoKey", "DeathDate"])
+    if use_lazy(backend):
+        # Both counts in one pass over the scan
+        lf = scan_export(file_path, cohort, hospital_df)
+        has_death_date = "DeathDate" in lf.collect_schema().names()
+        patients = pl.col("PatientPseudoKey").drop_nulls()
+        deceased = patients.filter(pl.col("DeathDate").is_not_null()) if has_death_date else patients
+        total_unique, deceased_unique = lf.select(patients.n_unique(), deceased.n_unique().alias("deceased")).collect().row(0)
     else:
+        df = frame_or_read(hospital_df, file_path, cohort)
+        total_unique = df["PatientPseudoKey"].nunique()
+        has_death_date = "DeathDate" in df.columns
+
+        # Parse and filter DeathDate properly
+        if has_death_date:
+            df["DeathDate"] = pd.to_datetime(df["DeathDate"], dayfirst=True, errors="coerce")
+            df = df[df["DeathDate"].notna()]
+            df = df.drop_duplicates(subset=["PatientPseudoKey"])
+            deceased_unique = df["PatientPseudoKey"].nunique()
+
+    if not has_death_date:
         print("⚠️ 'DeathDate' column not found in the dataset.")
         deceased_unique = None
 
@@ -98,26 +121,57 @@ def count_unique_patients(file_path="Øya_2_hospitalencounters.csv"):
 
 
 
+def classify_readmissions(admissions, discharges, windows=(7, 30, 90), start_on="EncounterStart", end_on="EncounterEnd",
+                          kernels=COMPILED):
+    # Label every admission as readmission for each window (in days), based on the patient's
+    # latest discharge on an earlier calendar day. Adds DaysSinceLastDischarge and Readmission<N>d.
+    # kernels: walk each patient's discharges in Oya_kernels.py (the default when numba is installed)
+    admissions = admissions.copy()
+    if kernels:
+        days = pd.Series(days_since_previous(admissions["PatientPseudoKey"].to_numpy(), admissions[start_on],
+                                             discharges["PatientPseudoKey"].to_numpy(), discharges[end_on]),
+                         index=admissions.index)
+        admissions["DaysSinceLastDischarge"] = days if days.isna().any() else days.astype("int64")
+    else:
+        admissions["_AdmissionDay"] = admissions[start_on].dt.normalize()
+        discharges = discharges[["PatientPseudoKey", end_on]].copy()
+        discharges["_DischargeDay"] = discharges[end_on].dt.normalize()
+
+        match = nearest_in_time(admissions, discharges, "_AdmissionDay", "_DischargeDay",
+                                direction="backward", allow_exact_matches=False, kernels=False)
+        last_discharge = pd.Series(pd.NaT, index=admissions.index, dtype="datetime64[ns]")
+        last_discharge[match >= 0] = discharges["_DischargeDay"].to_numpy()[match[match >= 0]]
+
+        admissions["DaysSinceLastDischarge"] = (admissions["_AdmissionDay"] - last_discharge).dt.days
+        admissions = admissions.drop(columns=["_AdmissionDay"])
+    for window in windows:
+        admissions[f"Readmission{window}d"] = admissions["DaysSinceLastDischarge"] <= window
+    return admissions
+
+
 # New function: analyze_daily_admissions_byCFS
 def analyze_daily_admissions_byCFS(
     hospital_path="Øya_2_hospitalencounters.csv",
     oya_path="Øya_encounters.csv",
     adl_path="Øya_2_ADL.csv",
-    measurement_name="R HP COCM IPLOS/ADL TOTAL VANLIG GJENNOMSNITT"
+    measurement_name="R HP COCM IPLOS/ADL TOTAL VANLIG GJENNOMSNITT",
+    readmission_windows=(7, 30, 90),
+    decisions_path="Øya_decisions.csv",
+    extra_strata=(),
+    binning=None,
+    hospital_df=None,
+    encounters_df=None,
+    adl_frames=None,
+    decision_index=None,
 ):
     import numpy as np
 
     # Load and preprocess hospital data
-    hosp_df = pd.read_csv(hospital_path)
-    hosp_df = hosp_df[hosp_df["PatientPseudoKey"] != 2384]
-
-    # Filter by AdmissionSource
-    hosp_df = hosp_df[hosp_df["AdmissionSource"] == "Bosted/arbeidsted"]
+    hosp_df = frame_or_read(hospital_df, hospital_path, HOME_ADMISSIONS)
 
     # Load vedtak data
-    vedtak_df = pd.read_csv("Øya_decisions.csv")
-    vedtak_df = vedtak_df[vedtak_df["DecisionTemplate"] == "Vedtak om langtidsopphold i institusjon"]
-    vedtak_df["DecisionValidDate"] = pd.to_datetime(vedtak_df["DecisionValidDate"], format="%Y-%m-%d", errors="coerce")
+    if decision_index is None:
+        decision_index = build_decision_index(read_export(decisions_path))
 
     # Parse EncounterStart/End after filtering
     hosp_df["EncounterStart"] = pd.to_datetime(hosp_df["EncounterStart"], format="%Y-%m-%d %H:%M:%S", errors="coerce")
@@ -126,135 +180,86 @@ def analyze_daily_admissions_byCFS(
     hosp_df["EncounterEndDate"] = hosp_df["EncounterEnd"].dt.date
     hosp_df = hosp_df.drop_duplicates(subset=["PatientPseudoKey", "EncounterStart", "EncounterEnd"])
 
-    # Mark patients to exclude based on vedtak
-    def has_vedtak_before_encounter(row):
-        patient_decisions = vedtak_df[vedtak_df["PatientPseudoKey"] == row["PatientPseudoKey"]]
-        return any(patient_decisions["DecisionValidDate"] <= row["EncounterEnd"])
-
-    hosp_df = hosp_df[~hosp_df.apply(has_vedtak_before_encounter, axis=1)]
+    # Exclude encounters that end on or after a signed long-term vedtak
+    hosp_df = exclude_long_term_stays(hosp_df, "EncounterEnd", decision_index)
 
     # Load and preprocess Øya encounters
-    oya_df = pd.read_csv(oya_path)
-    oya_df = oya_df[oya_df["PatientPseudoKey"] != 2384]
+    oya_df = frame_or_read(encounters_df, oya_path, REAL_PATIENTS)
     oya_df["EncounterEnd"] = pd.to_datetime(oya_df["EncounterEnd"], format="%Y-%m-%d %H:%M:%S", errors="coerce")
     oya_df["EncounterEndDate"] = oya_df["EncounterEnd"].dt.date
 
     # Load and preprocess ADL data
-    adl_df = pd.read_csv(adl_path)
-    adl_df = adl_df[adl_df["PatientPseudoKey"] != 2384]
-    adl_df = adl_df[adl_df["MeasurementName"] == measurement_name]
-    adl_df["MeasurementTime"] = pd.to_datetime(adl_df["MeasurementTime"], format="%Y-%m-%d %H:%M:%S", errors="coerce")
-    adl_df = adl_df.dropna(subset=["MeasurementTime", "Value"])
-    adl_df["Value"] = pd.to_numeric(adl_df["Value"], errors="coerce")
-    adl_df = adl_df.dropna(subset=["Value"])
-
-    # Bin ADL values into 9 equal-width deciles
-    adl_df["Decile"] = pd.cut(adl_df["Value"], 9, labels=False)
-    adl_df["DecileLabel"] = pd.cut(adl_df["Value"], 9).astype(str)
+    adl_df = load_adl_measurements(adl_path, measurement_name, adl_frames)[measurement_name]
 
-    # Assign decile to each hospital encounter based on closest ADL to EncounterEnd
-    hosp_df["ADL_DecileLabel"] = None
-    for i, row in hosp_df.iterrows():
-        patient_adls = adl_df[adl_df["PatientPseudoKey"] == row["PatientPseudoKey"]]
-        if not patient_adls.empty and pd.notna(row["EncounterEnd"]):
-            patient_adls = patient_adls.copy()
-            patient_adls["TimeDiff"] = (patient_adls["MeasurementTime"] - row["EncounterEnd"]).abs()
-            closest = patient_adls.sort_values("TimeDiff").iloc[0]
-            hosp_df.at[i, "ADL_DecileLabel"] = closest["DecileLabel"]
+    # Bin ADL values into deciles (9 equal-width bins unless binning says otherwise)
+    adl_df = apply_bins(adl_df, resolve_bin_spec(binning, adl_df["Value"], measurement_name))
 
+    # Assign decile to each hospital encounter based on closest ADL to EncounterEnd
+    hosp_df = join_nearest(hosp_df, adl_df, "EncounterEnd", "MeasurementTime", ["DecileLabel"])
+    hosp_df = hosp_df.rename(columns={"DecileLabel": "ADL_DecileLabel"})
     hosp_df = hosp_df.dropna(subset=["ADL_DecileLabel"])
 
-    # Determine readmissions
-    readmission_flags = []
-    for idx, row in hosp_df.iterrows():
-        patient_id = row["PatientPseudoKey"]
-        current_start = row["EncounterStartDate"]
-
-        other_hosp_ends = hosp_df[
-            (hosp_df["PatientPseudoKey"] == patient_id) &
-            (hosp_df["EncounterEndDate"] < current_start)
-        ]["EncounterEndDate"]
-
-        other_oya_ends = oya_df[
-            (oya_df["PatientPseudoKey"] == patient_id) &
-            (oya_df["EncounterEndDate"] < current_start)
-        ]["EncounterEndDate"]
-
-        readmitted = False
-        for past_date in pd.concat([other_hosp_ends, other_oya_ends]):
-            if (current_start - past_date).days <= 30:
-                readmitted = True
-                break
-
-        readmission_flags.append("Readmission" if readmitted else "New admission")
-
-    hosp_df["AdmissionType"] = readmission_flags
+    # Determine readmissions: any hospital or Øya discharge within 30 days before admission
+    discharges = pd.concat([
+        hosp_df[["PatientPseudoKey", "EncounterEnd"]],
+        oya_df[["PatientPseudoKey", "EncounterEnd"]],
+    ], ignore_index=True)
+    hosp_df = classify_readmissions(hosp_df, discharges, windows=readmission_windows)
+    hosp_df["AdmissionType"] = np.where(hosp_df["DaysSinceLastDischarge"] <= 30, "Readmission", "New admission")
 
     # Find min/max date for EncounterStartDate
     min_date = hosp_df["EncounterStartDate"].min()
     max_date = hosp_df["EncounterStartDate"].max()
     date_range = pd.date_range(start=min_date, end=max_date).date
 
-    # Group by decile and admission type
-    results = {}
-
-    for decile in hosp_df["ADL_DecileLabel"].unique():
-        results[decile] = {}
-        for adm_type in ["New admission", "Readmission"]:
-            subset = hosp_df[
-                (hosp_df["ADL_DecileLabel"] == decile) &
-                (hosp_df["AdmissionType"] == adm_type)
-            ]
-            counts = subset["EncounterStartDate"].value_counts()
-            counts = counts.reindex(date_range, fill_value=0).sort_index()
-            total_admissions = len(subset)
-            if not counts.empty:
-                min_val = counts.min()
-                max_val = counts.max()
-                avg_val = counts.mean()
-                mode_result = stats.mode(counts, keepdims=True)
-                mode_val = mode_result.mode[0] if len(mode_result.mode) > 0 else float("nan")
-            else:
-                min_val = max_val = avg_val = mode_val = 0
-            results[decile][adm_type] = {
-                "Minimum": min_val,
-                "Maximum": max_val,
-                "Average": round(avg_val, 2),
-                "Mode": mode_val,
-                "TotalAdmissions": total_admissions
-            }
+    # Count admissions per (decile, admission type, extra strata) and day in one pass.
+    # Every decile gets both admission types, also when one of them never occurs.
+    adm_types = ["New admission", "Readmission"]
+    strata = ["ADL_DecileLabel", "AdmissionType"] + list(extra_strata)
+    levels = [sorted(hosp_df["ADL_DecileLabel"].unique()), adm_types]
+    for col in extra_strata:
+        if col == "Weekday":
+            levels.append(["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"])
+        else:
+            levels.append(sorted(hosp_df[col].dropna().unique()))
+    results, _ = daily_statistics(hosp_df, "EncounterStartDate", strata, date_range=date_range, levels=levels)
 
     print("\n📊 Daily hospital admissions by ADL decile and admission type:")
-    for decile in sorted(results.keys()):
+    for decile, decile_stats in results.groupby(level="ADL_DecileLabel", sort=False):
         print(f"\nDecile: {decile}")
-        for adm_type in ["New admission", "Readmission"]:
-            stats_ = results[decile][adm_type]
-            print(f"  {adm_type}: Min={stats_['Minimum']}, Max={stats_['Maximum']}, Avg={stats_['Average']}, Mode={stats_['Mode']}, Total={stats_['TotalAdmissions']}")
+        for key, stats_ in decile_stats.iterrows():
+            label = " / ".join(str(k) for k in key[1:])
+            print(f"  {label}: Min={stats_['Minimum']:.0f}, Max={stats_['Maximum']:.0f}, Avg={round(stats_['Average'], 2)}, "
+                  f"Mode={stats_['Mode']:.0f}, Total={stats_['Total']:.0f}")
+
+    return results
 
 def analyze_initial_adl_distribution(
     adl_path="Øya_2_ADL.csv",
-    measurement_name="R HP COCM IPLOS/ADL TOTAL VANLIG GJENNOMSNITT"
+    measurement_name="R HP COCM IPLOS/ADL TOTAL VANLIG GJENNOMSNITT",  # or a list of names, or "all"
+    binning=None,
+    adl_frames=None,
 ):
-    adl_df = pd.read_csv(adl_path)
-
-    # Filter out test patient and invalid entries
-    adl_df = adl_df[adl_df["PatientPseudoKey"] != 2384]
-    adl_df = adl_df[adl_df["MeasurementName"] == measurement_name]
-    adl_df["MeasurementTime"] = pd.to_datetime(adl_df["MeasurementTime"], errors="coerce")
-    adl_df = adl_df.dropna(subset=["MeasurementTime", "Value"])
-    adl_df["Value"] = pd.to_numeric(adl_df["Value"], errors="coerce")
-    adl_df = adl_df.dropna(subset=["Value"])
-
-    # Find earliest measurement for each patient
-    earliest = adl_df.sort_values("MeasurementTime").groupby("PatientPseudoKey").first().reset_index()
-
-    # Create 9 equal-width bins
-    earliest["DecileLabel"] = pd.cut(earliest["Value"], 9).astype(str)
-    counts = earliest["DecileLabel"].value_counts().sort_index()
-
-    print("📊 Initial ADL decile distribution (based on earliest measurement):")
-    for label, count in counts.items():
-        print(f"  {label}: {count} patients")
+    # Filter out test patient and invalid entries (every requested measurement in one read)
+    adl_by_measurement = load_adl_measurements(adl_path, measurement_name, adl_frames)
+
+    results = {}
+    for adl_name, adl_df in adl_by_measurement.items():
+        # Find earliest measurement for each patient
+        earliest = adl_df.sort_values("MeasurementTime").groupby("PatientPseudoKey").first().reset_index()
+
+        # Same decile edges as the other ADL tables (from all values of the measurement, not only the earliest)
+        earliest = apply_bins(earliest, resolve_bin_spec(binning, adl_df["Value"], adl_name))
+        counts = earliest["DecileLabel"].value_counts().sort_index()
+
+        if len(adl_by_measurement) > 1:
+            print(f"\n📐 {adl_name}")
+        print("📊 Initial ADL decile distribution (based on earliest measurement):")
+        for label, count in counts.items():
+            print(f"  {label}: {count} patients")
+        results[adl_name] = counts.rename("Patients")
+
+    return combine_measurements(measurement_name, results)
 
 
 if __name__ == "__main__":
@@ -1,110 +1,49 @@
+import numpy as np
 import pandas as pd
 from Oya_encounters import load_and_filter_encounters, get_last_encounter_per_patient  
-from mlxtend.preprocessing import TransactionEncoder
-from mlxtend.frequent_patterns import fpgrowth
-
-
-def load_and_filter_decisions(file_path="\u00d8ya_decisions.csv"):
-    # Load CSV
-    df = pd.read_csv(file_path)
-
-    # Remove test patient
-    df = df[df["PatientPseudoKey"] != 2384]
-
-    # Keep only relevant DecisionTemplate values
-    valid_templates = [
-        "Vedtak om helsetjenester i hjemmet - Tjenester i hjemmet",
-        "Vedtak om tidsbegrenset opphold",
-        "Vedtak om langtidsopphold i institusjon",
-        "Vedtak om praktisk bistand daglige gj\u00f8rem\u00e5l - Tjenester i hjemmet"
-    ]
-    df = df[df["DecisionTemplate"].isin(valid_templates)]
-
-    # Keep only valid DecisionStatus values
-    valid_statuses = ["Signert", "Omgjort", "Inaktiv"]
-    df = df[df["DecisionStatus"].isin(valid_statuses)]
-
-    return df
-
-def analyze_decision_patterns(file_path="Øya_decisions.csv", min_support=0.1):
-    # Load data
-    df = pd.read_csv(file_path)
-
-    # Step 1: Filter out test patient
-    df = df[df["PatientPseudoKey"] != 2384]
-
-    # Step 2: Keep only valid templates
-    valid_templates = [
-        "Vedtak om helsetjenester i hjemmet - Tjenester i hjemmet",
-        "Vedtak om tidsbegrenset opphold",
-        "Vedtak om langtidsopphold i institusjon",
-        "Vedtak om praktisk bistand daglige gjøremål - Tjenester i hjemmet"
-    ]
-    df = df[df["DecisionTemplate"].isin(valid_templates)]
-
-    # Step 3: Keep only valid statuses
-    valid_statuses = ["Signert", "Omgjort", "Inaktiv"]
-    df = df[df["DecisionStatus"].isin(valid_statuses)]
-
-    # Step 4: Group by PatientPseudoKey to get unique decision templates per patient
-    transactions = (
-        df.groupby("PatientPseudoKey")["DecisionTemplate"]
-        .apply(lambda x: list(set(x)))  # Use set() to remove duplicates
-        .tolist()
-    )
-
-    # Step 5: TransactionEncoder
-    te = TransactionEncoder()
-    te_array = te.fit(transactions).transform(transactions)
-    te_df = pd.DataFrame(te_array, columns=te.columns_)
-
-    # Step 6: Run FP-Growth
-    frequent_itemsets = fpgrowth(te_df, min_support=min_support, use_colnames=True)
-
-    # Optional: Add length column for readability
-    frequent_itemsets["itemset_size"] = frequent_itemsets["itemsets"].apply(len)
-
-    return frequent_itemsets.sort_values(by="support", ascending=False).reset_index(drop=True)
-
-def analyze_all_templates_for_valid_patients(file_path="Øya_decisions.csv", min_support=0.1, export_excel=True):
-    import pandas as pd
-    from mlxtend.preprocessing import TransactionEncoder
-    from mlxtend.frequent_patterns import fpgrowth
-
-    # Load and filter data
-    df = pd.read_csv(file_path)
-    df = df[df["PatientPseudoKey"] != 2384]
-
-    valid_templates = [
-        "Vedtak om helsetjenester i hjemmet - Tjenester i hjemmet",
-        "Vedtak om tidsbegrenset opphold",
-        "Vedtak om langtidsopphold i institusjon",
-        "Vedtak om praktisk bistand daglige gjøremål - Tjenester i hjemmet"
-    ]
-    valid_statuses = ["Signert", "Omgjort", "Inaktiv"]
-    df = df[df["DecisionStatus"].isin(valid_statuses)]
-
-    # Get patients who have at least one valid template
-    valid_patients = df[df["DecisionTemplate"].isin(valid_templates)]["PatientPseudoKey"].unique()
-
-    # Keep all rows for those patients, even if template is not valid
-    df = df[df["PatientPseudoKey"].isin(valid_patients)]
-
-    # Group DecisionTemplate per patient
-    transactions = (
-        df.groupby("PatientPseudoKey")["DecisionTemplate"]
-        .apply(lambda x: list(set(x)))  # remove duplicates within patient
-        .tolist()
-    )
-
-    # Transaction encoding and fpgrowth
-    te = TransactionEncoder()
-    te_array = te.fit(transactions).transform(transactions)
-    te_df = pd.DataFrame(te_array, columns=te.columns_)
-
-    frequent_itemsets = fpgrowth(te_df, min_support=min_support, use_colnames=True)
-    frequent_itemsets["itemset_size"] = frequent_itemsets["itemsets"].apply(len)
-    frequent_itemsets_sorted = frequent_itemsets.sort_values(by="support", ascending=False).reset_index(drop=True)
+from Oya_loader import frame_or_read
+from Oya_patterns import (association_rules, cached_encoding, encode_sequences, encode_transactions, frequent_itemsets,
+                          frequent_sequences, readable_rules, support_sweep)
+from Oya_cohort import REAL_PATIENTS, VALID_DECISION_STATUSES, VALID_DECISION_TEMPLATES, VALID_DECISIONS
+
+
+def load_and_filter_decisions(file_path="\u00d8ya_decisions.csv", decisions_df=None):
+    # Load CSV: without the test patient, only relevant DecisionTemplate and valid DecisionStatus values
+    # (see Oya_cohort.VALID_DECISIONS; applied while reading)
+    return frame_or_read(decisions_df, file_path, VALID_DECISIONS)
+
+def valid_template_transactions(file_path="Øya_decisions.csv", decisions_df=None):
+    # Patients x valid decision templates as a sparse matrix (see Oya_patterns.encode_transactions).
+    # Without the test patient, only valid templates and statuses (applied while reading, only the
+    # columns used); an export is encoded once until it changes, a frame on every call.
+    def load():
+        return frame_or_read(decisions_df, file_path, VALID_DECISIONS.select(["PatientPseudoKey", "DecisionTemplate"]))
+    return encode_transactions(load()) if decisions_df is not None else cached_encoding("valid_templates", file_path, load)
+
+def all_template_transactions(file_path="Øya_decisions.csv", decisions_df=None):
+    # Patients with at least one valid template x all their templates (valid statuses only)
+    def load():
+        # Test patient and invalid statuses are dropped while reading
+        df = frame_or_read(decisions_df, file_path, REAL_PATIENTS.where("DecisionStatus", "in", VALID_DECISION_STATUSES).select(
+            ["PatientPseudoKey", "DecisionTemplate"]))
+
+        # Get patients who have at least one valid template
+        valid_patients = df[df["DecisionTemplate"].isin(VALID_DECISION_TEMPLATES)]["PatientPseudoKey"].unique()
+
+        # Keep all rows for those patients, even if template is not valid
+        return df[df["PatientPseudoKey"].isin(valid_patients)]
+    return encode_transactions(load()) if decisions_df is not None else cached_encoding("all_templates", file_path, load)
+
+def analyze_decision_patterns(file_path="Øya_decisions.csv", min_support=0.1, decisions_df=None):
+    # Steps 1-4: Load valid decisions and encode the unique decision templates per patient
+    encoded = valid_template_transactions(file_path, decisions_df)
+
+    # Step 5: Run FP-Growth (itemsets, support and itemset_size, sorted by support)
+    return frequent_itemsets(encoded, min_support)
+
+def analyze_all_templates_for_valid_patients(file_path="Øya_decisions.csv", min_support=0.1, export_excel=True, decisions_df=None):
+    # Load, filter and encode the templates per patient, then run FP-Growth
+    frequent_itemsets_sorted = frequent_itemsets(all_template_transactions(file_path, decisions_df), min_support)
 
     # Export
     if export_excel:
@@ -116,16 +55,69 @@ def analyze_all_templates_for_valid_patients(file_path="Øya_decisions.csv", min
 
     return frequent_itemsets_sorted
 
-def analyze_outcomes_for_longterm_decision(decisions_path="\u00d8ya_decisions.csv", encounters_path="\u00d8ya_encounters.csv"):
-    # Step 1: Load decisions
-    decisions = pd.read_csv(decisions_path)
+def decision_pattern_sweep(file_path="Øya_decisions.csv", supports=(0.05, 0.1, 0.15, 0.2, 0.3), all_templates=False, decisions_df=None):
+    # {min_support: frequent itemsets} for each support, mined once at the lowest one; the tables
+    # are those of analyze_decision_patterns (or analyze_all_templates_for_valid_patients)
+    encode = all_template_transactions if all_templates else valid_template_transactions
+    sweep = support_sweep(encode(file_path, decisions_df), supports)
+    print("\n🔎 Frequent itemsets per minimum support:")
+    for support, itemsets in sweep.items():
+        print(f"  {support:.2f}: {len(itemsets)} itemsets")
+    return sweep
+
+def analyze_decision_rules(file_path="Øya_decisions.csv", min_support=0.1, min_confidence=0.5, min_lift=1.0, min_leverage=None,
+                           all_templates=True, export_excel=True, decisions_df=None):
+    # Association rules between decision templates (confidence, lift, leverage, conviction) from the
+    # frequent itemsets of analyze_all_templates_for_valid_patients (or analyze_decision_patterns
+    # with all_templates=False); rules below any given threshold are left out
+    encode = all_template_transactions if all_templates else valid_template_transactions
+    itemsets = frequent_itemsets(encode(file_path, decisions_df), min_support)
+    rules = association_rules(itemsets, min_confidence, min_lift, min_leverage)
+    print(f"\n🔗 {len(rules)} rules from {len(itemsets)} itemsets (min_support={min_support}, min_confidence={min_confidence})")
 
-    # Remove test patient
-    decisions = decisions[decisions["PatientPseudoKey"] != 2384]
-
-    # Only include valid statuses
-    valid_statuses = ["Signert", "Omgjort", "Inaktiv"]
-    decisions = decisions[decisions["DecisionStatus"].isin(valid_statuses)]
+    # Export
+    if export_excel:
+        readable_rules(rules).to_excel("association_rules_templates.xlsx", index=False)
+        print("✅ Results written to association_rules_templates.xlsx")
+    else:
+        readable_rules(rules).to_csv("association_rules_templates.csv", index=False)
+        print("✅ Results written to association_rules_templates.csv")
+
+    return rules
+
+def valid_template_sequences(file_path="Øya_decisions.csv", collapse_repeats=True, decisions_df=None):
+    # Each patient's valid decision templates ordered by DecisionValidDate (see Oya_patterns.encode_sequences);
+    # an export is encoded once until it changes, a frame on every call
+    def load():
+        return frame_or_read(decisions_df, file_path, VALID_DECISIONS.select(["PatientPseudoKey", "DecisionTemplate", "DecisionValidDate"]))
+    def encode(df):
+        return encode_sequences(df, collapse_repeats=collapse_repeats)
+    if decisions_df is not None:
+        return encode(load())
+    return cached_encoding(f"valid_sequences_{'collapsed' if collapse_repeats else 'all'}", file_path, load, encode)
+
+def analyze_decision_sequences(file_path="Øya_decisions.csv", min_support=0.1, max_gap_days=None, max_length=None,
+                               collapse_repeats=True, decisions_df=None):
+    # Typical orders of decisions, e.g. home services -> time-limited stay -> long-term stay: every
+    # sequence of valid templates that at least min_support of the patients went through, with at
+    # most max_gap_days between consecutive steps, and the median days of each step.
+    # collapse_repeats: a renewed decision (the same template twice in a row) counts once
+    sequences = frequent_sequences(valid_template_sequences(file_path, collapse_repeats, decisions_df),
+                                   min_support, max_gap_days, max_length)
+
+    print("\n🧭 Most common decision sequences:")
+    if not (sequences["length"] > 1).any():
+        print(f"  No sequence of two or more decisions at min_support={min_support}")
+    for _, row in sequences[sequences["length"] > 1].head(10).iterrows():
+        days = " → ".join(f"{d:g}" for d in row["median_days"])
+        print(f"  {' → '.join(row['sequence'])}: {row['patients']} patients ({row['support']:.1%}), median days {days}")
+
+    return sequences
+
+def analyze_outcomes_for_longterm_decision(decisions_path="\u00d8ya_decisions.csv", encounters_path="\u00d8ya_encounters.csv",
+                                           decisions_df=None, encounters_df=None):
+    # Step 1: Load decisions without the test patient, only valid statuses (applied while reading)
+    decisions = frame_or_read(decisions_df, decisions_path, REAL_PATIENTS.where("DecisionStatus", "in", VALID_DECISION_STATUSES))
 
     # Step 2: Identify patients with a long-term institution decision
     longterm_patients = decisions[
@@ -133,7 +125,7 @@ def analyze_outcomes_for_longterm_decision(decisions_path="\u00d8ya_decisions.cs
     ]["PatientPseudoKey"].unique()
 
     # Step 3: Load and filter encounters
-    encounters = load_and_filter_encounters(encounters_path)
+    encounters = load_and_filter_encounters(encounters_path, encounters_df)
 
     # Step 4: Keep only patients who were granted long-term institution stay
     encounters = encounters[encounters["PatientPseudoKey"].isin(longterm_patients)]
@@ -144,6 +136,7 @@ def analyze_outcomes_for_longterm_decision(decisions_path="\u00d8ya_decisions.cs
     # Step 6: Count DischargeDisposition for these patients
     disposition_counts = (
         last_encounters["DischargeDisposition"]
+        .astype(object)
         .value_counts(dropna=False)
         .reset_index()
     )
@@ -155,6 +148,7 @@ def analyze_outcomes_for_longterm_decision(decisions_path="\u00d8ya_decisions.cs
     ]
     discharge_destination_counts = (
         to_other_institution["DischargeDestination"]
+        .astype(object)
         .value_counts(dropna=False)
         .reset_index()
     )
@@ -183,11 +177,13 @@ def analyze_outcomes_for_longterm_decision(decisions_path="\u00d8ya_decisions.cs
     # Merge with sent_home patients
     sent_home = sent_home.merge(earliest_decision, on="PatientPseudoKey", how="left")
 
-    # Compare date parts only
-    sent_home["Category"] = sent_home.apply(
-        lambda row: "Sendt hjem med vedtak" if pd.notnull(row["DecisionValidDate"]) and row["DecisionValidDate"].date() <= row["DischargeInstant"].date() else "Sendt hjem uten vedtak",
-        axis=1
+    # Compare date parts only; a missing decision or discharge date counts as without a decision
+    with_decision = (
+        sent_home["DecisionValidDate"].notna()
+        & sent_home["DischargeInstant"].notna()
+        & (sent_home["DecisionValidDate"].dt.normalize() <= sent_home["DischargeInstant"].dt.normalize())
     )
+    sent_home["Category"] = np.where(with_decision, "Sendt hjem med vedtak", "Sendt hjem uten vedtak")
 
     category_counts = sent_home["Category"].value_counts().reset_index()
     category_counts.columns = ["Category", "NumberOfPatients"]
@@ -0,0 +1,184 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from Oya_loader import read_export
+from Oya_cohort import adl_cohort
+
+# Pass measurement_name="all" to run an analysis for every measurement in the ADL export
+ALL_MEASUREMENTS = "all"
+
+### --- Measurement Selection --- ###
+
+def is_single_measurement(measurement_name):
+    return isinstance(measurement_name, str) and measurement_name != ALL_MEASUREMENTS
+
+def load_adl_measurements(adl_path="Øya_2_ADL.csv", measurement_name=ALL_MEASUREMENTS, adl_frames=None):
+    # Read the ADL export once and keep every requested measurement (a name, a list of names or "all").
+    # Returns {measurement name: cleaned rows}, in the requested order; unknown names map to an empty frame.
+    # adl_frames: an earlier result (e.g. the pipeline's "adl" stage) to select from instead of reading.
+    if adl_frames is not None:
+        return _select_measurements(adl_frames, measurement_name)
+
+    # Only the requested measurements and the used columns are read (see Oya_cohort.adl_cohort)
+    if measurement_name == ALL_MEASUREMENTS:
+        cohort = adl_cohort()
+    else:
+        cohort = adl_cohort([measurement_name] if isinstance(measurement_name, str) else measurement_name)
+    return clean_adl_measurements(read_export(adl_path, cohort=cohort), measurement_name)
+
+def clean_adl_measurements(adl_df, measurement_name=ALL_MEASUREMENTS):
+    # The cleaning of load_adl_measurements on already read rows, e.g. one partition of the export
+    adl_df = adl_df[adl_df["PatientPseudoKey"] != 2384]
+
+    if measurement_name == ALL_MEASUREMENTS:
+        names = sorted(adl_df["MeasurementName"].dropna().unique())
+    elif isinstance(measurement_name, str):
+        names = [measurement_name]
+    else:
+        names = list(measurement_name)
+
+    adl_df = adl_df[adl_df["MeasurementName"].isin(names)]
+    adl_df["MeasurementTime"] = pd.to_datetime(adl_df["MeasurementTime"], errors="coerce")
+    adl_df = adl_df.dropna(subset=["MeasurementTime", "Value"])
+    adl_df["Value"] = pd.to_numeric(adl_df["Value"], errors="coerce")
+    adl_df = adl_df.dropna(subset=["Value"])
+
+    groups = {name: group for name, group in adl_df.groupby("MeasurementName", observed=True, sort=False)}
+    return {name: groups.get(name, adl_df.iloc[0:0]).copy() for name in names}
+
+def _select_measurements(adl_frames, measurement_name):
+    if measurement_name == ALL_MEASUREMENTS:
+        names = sorted(adl_frames)
+    elif isinstance(measurement_name, str):
+        names = [measurement_name]
+    else:
+        names = list(measurement_name)
+    empty = next(iter(adl_frames.values())).iloc[0:0] if adl_frames else pd.DataFrame(columns=["PatientPseudoKey", "MeasurementName", "MeasurementTime", "Value"])
+    return {name: adl_frames.get(name, empty).copy() for name in names}
+
+def combine_measurements(measurement_name, results):
+    # Single name: that measurement's result as before. Several names: one long frame keyed by MeasurementName.
+    if is_single_measurement(measurement_name):
+        return results.get(measurement_name)
+    frames = []
+    for name, result in results.items():
+        if result is None:
+            continue
+        if isinstance(result, pd.Series):
+            result = result.reset_index()
+        frames.append(result.assign(MeasurementName=name))
+    if not frames:
+        return pd.DataFrame(columns=["MeasurementName"])
+    long_df = pd.concat(frames, ignore_index=True)
+    return long_df[["MeasurementName"] + [col for col in long_df.columns if col != "MeasurementName"]]
+
+
+### --- Binning --- ###
+
+# Default ADL bucketing: 9 equal-width bins over all values of a measurement
+DEFAULT_BINNING = {"method": "equal_width", "n_bins": 9}
+
+# Bins per method when n_bins is not given: quantile bins are deciles
+DEFAULT_N_BINS = {"equal_width": 9, "quantile": 10}
+
+def _equal_width_edges(values, n_bins):
+    # Same edges as pd.cut(values, n_bins)
+    low, high = float(np.nanmin(values)), float(np.nanmax(values))
+    if low == high:
+        low -= 0.001 * abs(low) if low != 0 else 0.001
+        high += 0.001 * abs(high) if high != 0 else 0.001
+        return np.linspace(low, high, n_bins + 1)
+    edges = np.linspace(low, high, n_bins + 1)
+    edges[0] -= (high - low) * 0.001
+    return edges
+
+def _quantile_edges(values, n_bins):
+    # Quantile edges; tied quantiles are merged, so heavily tied scales can get fewer bins
+    edges = np.unique(np.nanquantile(values, np.linspace(0, 1, n_bins + 1)))
+    if len(edges) < 2:
+        return _equal_width_edges(values, 1)
+    edges[0] -= (edges[-1] - edges[0]) * 0.001
+    return edges
+
+def build_bin_spec(values, method="equal_width", n_bins=None, cut_points=None, measurement_name=None):
+    # Bin edges for one measurement. Intervals are right-closed, (edge_i, edge_i+1], as in pd.cut.
+    #   method="equal_width": n_bins equal-width bins between the smallest and largest value (default 9)
+    #   method="quantile":    n_bins bins with (roughly) the same number of values each (default 10, deciles)
+    #   method="fixed":       the given cut_points, e.g. clinical thresholds
+    values = np.asarray(values, dtype=float)
+    n_bins = n_bins or DEFAULT_N_BINS.get(method)
+    if method == "fixed":
+        if cut_points is None:
+            raise ValueError("method='fixed' needs cut_points")
+        edges = np.asarray(sorted(cut_points), dtype=float)
+    elif len(values) == 0 or np.isnan(values).all():
+        edges = np.array([], dtype=float)
+    elif method == "equal_width":
+        edges = _equal_width_edges(values, n_bins)
+    elif method == "quantile":
+        edges = _quantile_edges(values, n_bins)
+    else:
+        raise ValueError(f"Unknown binning method: {method}")
+    return {"measurement": measurement_name, "method": method, "edges": [float(e) for e in edges]}
+
+def resolve_bin_spec(binning, values, measurement_name=None):
+    # binning may be None (default), a method name, a list of cut points, a spec from
+    # build_bin_spec, a dict of such specs keyed by measurement name, or the path of a
+    # file written by save_bin_specs.
+    if binning is None:
+        binning = DEFAULT_BINNING
+    if isinstance(binning, str) and os.path.exists(binning):
+        binning = load_bin_specs(binning)
+    if isinstance(binning, str):
+        return build_bin_spec(values, method=binning, measurement_name=measurement_name)
+    if isinstance(binning, (list, tuple, np.ndarray)):
+        return build_bin_spec(values, method="fixed", cut_points=binning, measurement_name=measurement_name)
+    if "edges" in binning:
+        return binning
+    if measurement_name in binning:
+        return resolve_bin_spec(binning[measurement_name], values, measurement_name)
+    return build_bin_spec(values, method=binning.get("method", "equal_width"), n_bins=binning.get("n_bins"),
+                          cut_points=binning.get("cut_points"), measurement_name=measurement_name)
+
+def n_bins_of(spec):
+    return max(len(spec["edges"]) - 1, 0)
+
+def assign_bins(values, spec):
+    # Bin code per value (0 .. n_bins-1), -1 for values outside the edges or missing
+    edges = np.asarray(spec["edges"], dtype=float)
+    values = np.asarray(values, dtype=float)
+    codes = np.searchsorted(edges, values, side="left") - 1
+    if len(edges):
+        codes[values == edges[0]] = 0  # The lowest fixed cut point belongs to the first bin
+    codes[(codes < 0) | (codes >= len(edges) - 1) | np.isnan(values)] = -1
+    return codes
+
+def bin_labels(spec):
+    # Interval labels as printed by pd.cut, e.g. "(1.006, 1.451]"
+    if n_bins_of(spec) == 0:
+        return np.array([], dtype=object)
+    categories = pd.cut(pd.Series([], dtype=float), bins=np.asarray(spec["edges"], dtype=float)).cat.categories
+    return np.asarray(categories.astype(str), dtype=object)
+
+def apply_bins(adl_df, spec, code_col="Decile", label_col="DecileLabel"):
+    # Integer bin codes from searchsorted, labels only looked up from the (short) label array
+    codes = assign_bins(adl_df["Value"].to_numpy(), spec)
+    labels = np.append(bin_labels(spec), np.nan)
+    adl_df[code_col] = np.where(codes >= 0, codes, np.nan)
+    if label_col is not None:
+        adl_df[label_col] = labels[codes]  # code -1 picks the trailing NaN
+    return adl_df
+
+def build_bin_specs(adl_by_measurement, binning=None):
+    # One spec per measurement, from all of its values, e.g. to save and reuse across analyses
+    return {name: resolve_bin_spec(binning, adl_df["Value"], name) for name, adl_df in adl_by_measurement.items()}
+
+def save_bin_specs(specs, path):
+    # specs: {measurement name: spec}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(specs, f, indent=2, ensure_ascii=False)
+
+def load_bin_specs(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
@@ -0,0 +1,131 @@
+import argparse
+import contextlib
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from Oya_pipeline import ANALYSES, DEFAULT_PATHS, print_timings, run_pipeline
+from Oya_results import DEFAULT_BUDGET_MB, PLOTTING, RESULT_DIR
+
+# Command line entry point for batch runs, e.g.
+#   python Oya_batch.py --list
+#   python Oya_batch.py --data-dir data --workers 8
+#   python Oya_batch.py analyze_adl_outcomes_by_decile analyze_hospital_outcomes_by_decile --measurement-name all
+# Results are kept in <data-dir>/.oya_results, so a rerun with unchanged exports, parameters
+# and scripts only reads them back (--no-cache to always recompute).
+
+# Stage outputs kept by each worker process, so later analyses in the same worker reuse them
+_worker_stages = {}
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use("Agg")  # Worker processes never open windows
+    _worker_stages.clear()
+
+def _run_in_worker(name, params, paths, cache):
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        results, timings = run_pipeline([name], params=params, workers=1, show_timings=False,
+                                        stage_cache=_worker_stages, **cache, **paths)
+    return name, name in results, timings.get(name, 0.0), output.getvalue()
+
+def run_batch(analyses, params, paths, workers=None, result_cache=None, cache_budget_mb=DEFAULT_BUDGET_MB):
+    # Independent analyses on a process pool; figure-drawing analyses afterwards in this process.
+    # Returns {analysis: (succeeded, seconds)}.
+    cache = {"result_cache": result_cache, "cache_budget_mb": cache_budget_mb}
+    batch = [name for name in analyses if name not in PLOTTING]
+    plots = [name for name in analyses if name in PLOTTING]
+    summary = {}
+
+    if batch:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            futures = [pool.submit(_run_in_worker, name, params, paths, cache) for name in batch]
+            for future in as_completed(futures):
+                name, succeeded, seconds, output = future.result()
+                summary[name] = (succeeded, seconds)
+                print(output, end="", flush=True)
+
+    if plots:
+        results, timings = run_pipeline(plots, params=params, show_timings=False, **paths)
+        for name in plots:
+            summary[name] = (name in results, timings.get(name, 0.0))
+    return summary
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run Øya analyses in batch.")
+    parser.add_argument("analyses", nargs="*",
+                        help="Analyses to run (see --list); default: every analysis that does not draw figures, 'all' for every analysis")
+    parser.add_argument("--list", action="store_true", help="List the available analyses and exit")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes (default: all cores)")
+
+    paths = parser.add_argument_group("data paths")
+    paths.add_argument("--data-dir", default=".", help="Folder with the exports (default: current folder)")
+    for key, default in DEFAULT_PATHS.items():
+        paths.add_argument("--" + key.replace("_path", "").replace("_", "-"), dest=key, default=default,
+                           help=f"Export file, relative to --data-dir (default: {default})")
+
+    cache = parser.add_argument_group("result cache")
+    cache.add_argument("--cache-dir", help=f"Result cache folder (default: {RESULT_DIR} in --data-dir)")
+    cache.add_argument("--cache-budget-mb", type=float, default=DEFAULT_BUDGET_MB,
+                       help=f"Size budget of the result cache, least recently used results are evicted (default: {DEFAULT_BUDGET_MB})")
+    cache.add_argument("--no-cache", action="store_true", help="Recompute every analysis and leave the cache untouched")
+
+    params = parser.add_argument_group("analysis parameters")
+    params.add_argument("--measurement-name", nargs="+",
+                        help="ADL measurement name(s), or 'all' (default: each analysis' own default)")
+    params.add_argument("--min-support", type=float, help="Minimum support for FP-Growth")
+    params.add_argument("--min-confidence", type=float, help="Minimum confidence for association rules")
+    params.add_argument("--min-lift", type=float, help="Minimum lift for association rules")
+    params.add_argument("--max-gap-days", type=float, help="Maximum days between consecutive steps of a decision sequence")
+    params.add_argument("--accept-scores-after", action=argparse.BooleanOptionalAction, default=None,
+                        help="Allow ADL scores taken after discharge")
+    params.add_argument("--only-last-50-days", dest="onlyUseLast50Days", action=argparse.BooleanOptionalAction, default=None,
+                        help="Only use CFS/ADL scores from the last 50 days before discharge")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = _parse_args(argv)
+
+    if args.list:
+        print("Available analyses (* draws figures):")
+        for name, (func, _) in ANALYSES.items():
+            print(f"  {name}{' *' if name in PLOTTING else ''}  ({func.__module__})")
+        return 0
+
+    if not args.analyses:
+        analyses = [name for name in ANALYSES if name not in PLOTTING]
+    elif args.analyses == ["all"]:
+        analyses = list(ANALYSES)
+    else:
+        analyses = args.analyses
+    unknown = [name for name in analyses if name not in ANALYSES]
+    if unknown:
+        print(f"❌ Unknown analyses: {', '.join(unknown)} (see --list)")
+        return 2
+
+    paths = {key: os.path.abspath(os.path.join(args.data_dir, getattr(args, key))) for key in DEFAULT_PATHS}
+    params = {}
+    if args.measurement_name is not None:
+        names = args.measurement_name
+        params["measurement_name"] = names[0] if len(names) == 1 else names
+    for key in ("min_support", "min_confidence", "min_lift", "max_gap_days", "accept_scores_after", "onlyUseLast50Days"):
+        if getattr(args, key) is not None:
+            params[key] = getattr(args, key)
+
+    start = time.perf_counter()
+    result_cache = None if args.no_cache else os.path.abspath(args.cache_dir or os.path.join(args.data_dir, RESULT_DIR))
+    summary = run_batch(analyses, params, paths, workers=args.workers, result_cache=result_cache,
+                        cache_budget_mb=args.cache_budget_mb)
+    failed = [name for name, (succeeded, _) in summary.items() if not succeeded]
+
+    print_timings({name: seconds for name, (_, seconds) in summary.items()}, title="Wall time per analysis")
+    print(f"\n✅ {len(summary) - len(failed)} of {len(summary)} analyses finished in {time.perf_counter() - start:.2f} s"
+          f" with {args.workers} workers")
+    if failed:
+        print(f"❌ Failed: {', '.join(failed)}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,137 @@
+import pandas as pd
+
+# Declarative row filters and column projections for the exports. A cohort is handed to
+# Oya_loader.read_export, which pushes it down into the parquet scan of its cache, so rows
+# outside the cohort and unused columns are never turned into pandas objects. The same cohort
+# filters an already loaded frame (e.g. a pipeline stage) with the usual pandas comparisons.
+
+class Cohort:
+    # filters: ((column, op, value), ...) that must all hold; op is "==", "!=", "in" or "not in".
+    #          As in pandas, "!=" and "not in" keep rows where the column is missing.
+    # columns: columns to keep, or None for all of them
+    OPS = ("==", "!=", "in", "not in")
+
+    def __init__(self, filters=(), columns=None):
+        for _, op, _ in filters:
+            if op not in self.OPS:
+                raise ValueError(f"Unknown cohort operator: {op}")
+        self.filters = tuple((column, op, tuple(value) if op in ("in", "not in") else value)
+                             for column, op, value in filters)
+        self.columns = tuple(columns) if columns is not None else None
+
+    def where(self, column, op, value):
+        return Cohort(self.filters + ((column, op, value),), self.columns)
+
+    def select(self, columns):
+        return Cohort(self.filters, columns)
+
+    def key(self):
+        return self.filters, self.columns
+
+    def __repr__(self):
+        return f"Cohort(filters={list(self.filters)}, columns={None if self.columns is None else list(self.columns)})"
+
+    def mask(self, df):
+        keep = pd.Series(True, index=df.index)
+        for column, op, value in self.filters:
+            if op == "==":
+                keep &= df[column] == value
+            elif op == "!=":
+                keep &= df[column] != value
+            elif op == "in":
+                keep &= df[column].isin(value)
+            else:
+                keep &= ~df[column].isin(value)
+        return keep
+
+    def apply(self, df):
+        # Rows and columns of a loaded frame that belong to the cohort
+        df = df[self.mask(df)] if self.filters else df
+        return df[[col for col in df.columns if col in self.columns]] if self.columns is not None else df
+
+    def expression(self):
+        # The filters as a pyarrow dataset expression, or None without filters
+        import pyarrow.compute as pc
+        expression = None
+        for column, op, value in self.filters:
+            field = pc.field(column)
+            if op == "==":
+                term = field == value
+            elif op == "!=":
+                term = (field != value) | field.is_null()
+            elif op == "in":
+                term = field.isin(list(value))
+            else:
+                term = ~field.isin(list(value)) | field.is_null()
+            expression = term if expression is None else expression & term
+        return expression
+
+    def sql(self):
+        # The filters as an SQL condition (values inlined as literals), "TRUE" without filters
+        terms = []
+        for column, op, value in self.filters:
+            field = '"' + column.replace('"', '""') + '"'
+            if op in ("==", "!="):
+                term = f"{field} {'=' if op == '==' else '!='} {_sql_literal(value)}"
+            elif not value:
+                term = "FALSE" if op == "in" else "TRUE"
+            else:
+                term = f"{field} {'IN' if op == 'in' else 'NOT IN'} ({', '.join(_sql_literal(v) for v in value)})"
+            terms.append(f"({term} OR {field} IS NULL)" if op in ("!=", "not in") else term)
+        return " AND ".join(terms) or "TRUE"
+
+    def polars(self):
+        # The filters as a polars expression, for a lazy scan (see Oya_lazy.py)
+        import polars as pl
+        expression = pl.lit(True)
+        for column, op, value in self.filters:
+            field = pl.col(column)
+            if op == "==":
+                term = field == value
+            elif op == "!=":
+                term = (field != value) | field.is_null()
+            elif op == "in":
+                term = field.is_in(list(value))
+            else:
+                term = ~field.is_in(list(value)) | field.is_null()
+            expression = expression & term
+        return expression
+
+
+def _sql_literal(value):
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return repr(value)
+
+
+### --- Cohorts --- ###
+
+TEST_PATIENT = 2384
+
+VALID_DECISION_TEMPLATES = [
+    "Vedtak om helsetjenester i hjemmet - Tjenester i hjemmet",
+    "Vedtak om tidsbegrenset opphold",
+    "Vedtak om langtidsopphold i institusjon",
+    "Vedtak om praktisk bistand daglige gjøremål - Tjenester i hjemmet"
+]
+VALID_DECISION_STATUSES = ["Signert", "Omgjort", "Inaktiv"]
+
+ADL_COLUMNS = ["PatientPseudoKey", "MeasurementName", "MeasurementTime", "Value"]
+
+# Every export without the test patient
+REAL_PATIENTS = Cohort().where("PatientPseudoKey", "!=", TEST_PATIENT)
+
+# Encounters: hospital contacts only
+SYKEHUS_ENCOUNTERS = REAL_PATIENTS.where("EncounterType", "==", "Sykehuskontakt")
+
+# Hospital encounters: admissions from home
+HOME_ADMISSIONS = REAL_PATIENTS.where("AdmissionSource", "==", "Bosted/arbeidsted")
+
+# Decisions: the templates and statuses used in the decision analyses
+VALID_DECISIONS = (REAL_PATIENTS.where("DecisionTemplate", "in", VALID_DECISION_TEMPLATES)
+                   .where("DecisionStatus", "in", VALID_DECISION_STATUSES))
+
+def adl_cohort(names=None):
+    # ADL rows of the given measurement names (None for every measurement), used columns only
+    cohort = REAL_PATIENTS.select(ADL_COLUMNS)
+    return cohort if names is None else cohort.where("MeasurementName", "in", names)
@@ -0,0 +1,93 @@
+import warnings
+import numpy as np
+import pandas as pd
+
+### --- Dense Stratum x Day Count Cube --- ###
+
+def daily_count_cube(df, date_col, strata=(), date_range=None, levels=None):
+    # Count rows per (stratum, day) in one groupby and scatter them into a dense array.
+    #   strata:     columns that define a stratum, e.g. ["ADL_DecileLabel", "AdmissionType"]
+    #   date_range: days to report (zero-filled); defaults to the days present in df
+    #   levels:     optional list of levels per stratum column, to also report empty strata
+    # Returns (keys, dates, cube) with cube[i, j] = rows in stratum keys[i] on day dates[j].
+    strata = list(strata)
+    counts = df.groupby(strata + [date_col], observed=True).size()
+
+    if date_range is None:
+        dates = pd.Index(sorted(df[date_col].dropna().unique()))
+    else:
+        dates = pd.Index(date_range)
+
+    if strata:
+        stratum_index = counts.index.droplevel(date_col)
+        if levels is not None:
+            keys = pd.MultiIndex.from_product(levels, names=strata) if len(strata) > 1 else pd.Index(levels[0], name=strata[0])
+        else:
+            keys = stratum_index.unique()
+        stratum_pos = keys.get_indexer(stratum_index)
+    else:
+        keys = pd.Index(["All"])
+        stratum_pos = np.zeros(len(counts), dtype=np.int64)
+
+    day_pos = dates.get_indexer(counts.index.get_level_values(date_col))
+    inside = (day_pos >= 0) & (stratum_pos >= 0)
+    cube = np.zeros((len(keys), len(dates)), dtype=np.int64)
+    cube[stratum_pos[inside], day_pos[inside]] = counts.to_numpy()[inside]
+    return keys, dates, cube
+
+def weekday_mask(keys, dates, level="Weekday"):
+    # For cubes stratified by weekday name: only the stratum's own weekday counts as a day
+    weekdays = pd.to_datetime(pd.Series(dates)).dt.day_name().to_numpy()
+    key_weekdays = keys.get_level_values(level).to_numpy()
+    return key_weekdays[:, None] == weekdays[None, :]
+
+def cube_mode(values):
+    # Smallest most frequent value per row (as scipy.stats.mode); NaN cells are ignored
+    n_rows = values.shape[0]
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0).astype(np.int64)
+    width = int(filled.max()) + 1 if filled.size else 1
+    rows = np.repeat(np.arange(n_rows), values.shape[1])[valid.ravel()]
+    freq = np.bincount(rows * width + filled.ravel()[valid.ravel()], minlength=n_rows * width).reshape(n_rows, width)
+    mode = freq.argmax(axis=1).astype(float)
+    mode[~valid.any(axis=1)] = np.nan
+    return mode
+
+def cube_statistics(keys, cube, quantiles=(0.25, 0.5, 0.75), skip_zero_days=False, mask=None):
+    # Per-stratum statistics over the day axis, all computed on the whole cube at once.
+    #   skip_zero_days: only use days with at least one count (value_counts semantics)
+    #   mask:           boolean array shaped like cube, False cells are not days of that stratum
+    values = cube.astype(float)
+    if mask is not None:
+        values[~mask] = np.nan
+    if skip_zero_days:
+        values[values == 0] = np.nan
+    if values.shape[1] == 0:
+        values = np.full((len(keys), 1), np.nan)  # No days at all
+
+    stats = pd.DataFrame(index=keys)
+    with warnings.catch_warnings():
+        # Strata without any days give NaN statistics
+        warnings.simplefilter("ignore", RuntimeWarning)
+        stats["Minimum"] = np.nanmin(values, axis=1)
+        stats["Maximum"] = np.nanmax(values, axis=1)
+        stats["Average"] = np.nanmean(values, axis=1)
+        stats["Variance"] = np.nanvar(values, axis=1, ddof=1)
+        stats["Mode"] = cube_mode(values)
+        for q in quantiles:
+            stats[f"Q{round(q * 100)}"] = np.nanquantile(values, q, axis=1)
+    stats["Days"] = (~np.isnan(values)).sum(axis=1)
+    stats["Total"] = np.nansum(values, axis=1).astype(np.int64)
+    return stats
+
+def daily_statistics(df, date_col, strata=(), date_range=None, levels=None, quantiles=(0.25, 0.5, 0.75),
+                     skip_zero_days=False):
+    # Cube + statistics in one call. A "Weekday" stratum is derived from date_col when the
+    # frame has no such column, and each weekday stratum only uses its own weekdays.
+    strata = list(strata)
+    if "Weekday" in strata and "Weekday" not in df.columns:
+        df = df.assign(Weekday=pd.to_datetime(df[date_col]).dt.day_name())
+    keys, dates, cube = daily_count_cube(df, date_col, strata, date_range=date_range, levels=levels)
+    mask = weekday_mask(keys, dates) if "Weekday" in strata else None
+    stats = cube_statistics(keys, cube, quantiles=quantiles, skip_zero_days=skip_zero_days, mask=mask)
+    return stats, pd.DataFrame(cube, index=keys, columns=dates)
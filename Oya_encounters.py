@@ -1,12 +1,26 @@
 import pandas as pd
 import plotly.graph_objects as go
+from Oya_loader import frame_or_read
+from Oya_cohort import SYKEHUS_ENCOUNTERS
+from Oya_lazy import collect, pl, scan_export, use_lazy
+from Oya_sql import run_query, use_sql
+
+# DischargeDisposition -> category in the disposition tables
+DISPOSITION_CATEGORIES = {
+    "Som d\u00f8d - Ingen melding g\u00e5r": "Deaths",
+    "Ut til hjemmet - Ingen melding g\u00e5r": "SentHome",
+    "Til annen enhet - Ingen melding g\u00e5r": "SentToInstitution"
+}
 
 ### --- Reusable Helper Functions --- ###
 
-def load_and_filter_encounters(file_path):
-    df = pd.read_csv(file_path)
-    df = df[df["PatientPseudoKey"] != 2384]  # Remove test patient
-    df = df[df["EncounterType"] == "Sykehuskontakt"]  # Only sykehuskontakt
+def load_and_filter_encounters(file_path, encounters_df=None, backend="pandas"):
+    # encounters_df: an already loaded export (e.g. a pipeline stage) to filter instead of reading file_path
+    # backend: "polars" to prepare the rows with a lazy scan (see Oya_lazy.py)
+    if use_lazy(backend):
+        return collect(scan_export(file_path, SYKEHUS_ENCOUNTERS, encounters_df)
+                       .with_columns(pl.col("LengthOfStay").cast(pl.Float64, strict=False)))
+    df = frame_or_read(encounters_df, file_path, SYKEHUS_ENCOUNTERS)  # No test patient, only sykehuskontakt
     df["LengthOfStay"] = pd.to_numeric(df["LengthOfStay"], errors="coerce")
     return df
 
@@ -23,20 +37,45 @@ def get_last_encounter_per_patient(df):
 
 ### --- Analysis Functions --- ###
 
-def analyze_encounters(file_path="\u00d8ya_encounters.csv"):
-    df = load_and_filter_encounters(file_path)
-
-    total_visits = df.groupby("Department")["PatientPseudoKey"].count().reset_index()
+def _encounter_source(file_path, encounters_df):
+    # SQL view "encounters": the hospital contacts, as in load_and_filter_encounters
+    return {"encounters": (file_path, encounters_df, SYKEHUS_ENCOUNTERS)}
+
+def _count_per_category(category_col):
+    # SQL: one count column per disposition category, in the order of DISPOSITION_CATEGORIES
+    return ", ".join(f"COUNT(*) FILTER (WHERE {category_col} = ?) AS \"{category}\"" for category in DISPOSITION_CATEGORIES.values())
+
+def analyze_encounters(file_path="\u00d8ya_encounters.csv", encounters_df=None, backend="pandas"):
+    # backend: "pandas", "duckdb" to aggregate in the SQL engine (see Oya_sql.py), or "polars"
+    #          to prepare the rows with a lazy scan (see Oya_lazy.py)
+    if use_sql(backend):
+        # Departments without any discharge disposition drop out, as in the merge below
+        return run_query(f'''
+            SELECT "Department",
+                   COUNT("PatientPseudoKey") AS "TotalVisits",
+                   COUNT(DISTINCT "PatientPseudoKey") AS "UniquePatientCount",
+                   AVG("LengthOfStay") AS "AverageLengthOfStay",
+                   {_count_per_category('"DischargeDisposition"')}
+            FROM encounters
+            WHERE "Department" IS NOT NULL
+            GROUP BY "Department"
+            HAVING COUNT("DischargeDisposition") > 0
+            ORDER BY "Department"
+        ''', _encounter_source(file_path, encounters_df), list(DISPOSITION_CATEGORIES))
+
+    df = load_and_filter_encounters(file_path, encounters_df, backend)
+
+    total_visits = df.groupby("Department", observed=True)["PatientPseudoKey"].count().reset_index()
     total_visits.columns = ["Department", "TotalVisits"]
 
     unique_visits = df[["PatientPseudoKey", "Department"]].drop_duplicates()
-    unique_patients = unique_visits.groupby("Department")["PatientPseudoKey"].nunique().reset_index()
+    unique_patients = unique_visits.groupby("Department", observed=True)["PatientPseudoKey"].nunique().reset_index()
     unique_patients.columns = ["Department", "UniquePatientCount"]
 
-    avg_los = df.groupby("Department")["LengthOfStay"].mean().reset_index()
+    avg_los = df.groupby("Department", observed=True)["LengthOfStay"].mean().reset_index()
     avg_los.columns = ["Department", "AverageLengthOfStay"]
 
-    disposition_counts = df.groupby(["Department", "DischargeDisposition"]).size().unstack(fill_value=0).reset_index()
+    disposition_counts = df.groupby(["Department", "DischargeDisposition"], observed=True).size().unstack(fill_value=0).reset_index()
     disposition_counts["Deaths"] = disposition_counts.get("Som d\u00f8d - Ingen melding g\u00e5r", 0)
     disposition_counts["SentHome"] = disposition_counts.get("Ut til hjemmet - Ingen melding g\u00e5r", 0)
     disposition_counts["SentToInstitution"] = disposition_counts.get("Til annen enhet - Ingen melding g\u00e5r", 0)
@@ -48,20 +87,30 @@ def analyze_encounters(file_path="\u00d8ya_encounters.csv"):
 
     return summary.sort_values(by="Department").reset_index(drop=True)
 
-def analyze_dispositions_by_service(file_path="\u00d8ya_encounters.csv"):
-    df = load_and_filter_encounters(file_path)
-
-    disposition_map = {
-        "Som d\u00f8d - Ingen melding g\u00e5r": "Deaths",
-        "Ut til hjemmet - Ingen melding g\u00e5r": "SentHome",
-        "Til annen enhet - Ingen melding g\u00e5r": "SentToInstitution"
-    }
-
-    df = df[df["DischargeDisposition"].isin(disposition_map.keys())]
-    df["DispositionCategory"] = df["DischargeDisposition"].map(disposition_map)
+def analyze_dispositions_by_service(file_path="\u00d8ya_encounters.csv", encounters_df=None, backend="pandas"):
+    if use_sql(backend):
+        case = " ".join(f"WHEN ? THEN '{category}'" for category in DISPOSITION_CATEGORIES.values())
+        placeholders = ", ".join("?" for _ in DISPOSITION_CATEGORIES)
+        return run_query(f'''
+            SELECT "HospitalService", {_count_per_category("category")}
+            FROM (
+                SELECT DISTINCT "PatientPseudoKey", "HospitalService", CASE "DischargeDisposition" {case} END AS category
+                FROM encounters
+                WHERE "DischargeDisposition" IN ({placeholders})
+            )
+            WHERE "HospitalService" IS NOT NULL
+            GROUP BY "HospitalService"
+            ORDER BY "Deaths" DESC, "HospitalService"
+        ''', _encounter_source(file_path, encounters_df),
+            list(DISPOSITION_CATEGORIES.values()) + list(DISPOSITION_CATEGORIES) * 2)
+
+    df = load_and_filter_encounters(file_path, encounters_df, backend)
+
+    df = df[df["DischargeDisposition"].isin(DISPOSITION_CATEGORIES.keys())]
+    df["DispositionCategory"] = df["DischargeDisposition"].map(DISPOSITION_CATEGORIES)
 
     unique_cases = df[["PatientPseudoKey", "HospitalService", "DispositionCategory"]].drop_duplicates()
-    summary = unique_cases.groupby(["HospitalService", "DispositionCategory"]).size().unstack(fill_value=0).reset_index()
+    summary = unique_cases.groupby(["HospitalService", "DispositionCategory"], observed=True).size().unstack(fill_value=0).reset_index()
 
     for col in ["Deaths", "SentHome", "SentToInstitution"]:
         if col not in summary:
@@ -69,12 +118,12 @@ def analyze_dispositions_by_service(file_path="\u00d8ya_encounters.csv"):
 
     return summary.sort_values(by="Deaths", ascending=False).reset_index(drop=True)
 
-def count_admissions_by_source(file_path="\u00d8ya_encounters.csv"):
-    df = load_and_filter_encounters(file_path)
-    return df["AdmissionSource"].value_counts(dropna=False).reset_index().rename(columns={"index": "AdmissionSource", "AdmissionSource": "NumberOfEncounters"})
+def count_admissions_by_source(file_path="\u00d8ya_encounters.csv", encounters_df=None, backend="pandas"):
+    df = load_and_filter_encounters(file_path, encounters_df, backend)
+    return df["AdmissionSource"].astype(object).value_counts(dropna=False).reset_index().rename(columns={"index": "AdmissionSource", "AdmissionSource": "NumberOfEncounters"})
 
-def get_revisit_details(file_path="\u00d8ya_encounters.csv"):
-    df = load_and_filter_encounters(file_path)
+def get_revisit_details(file_path="\u00d8ya_encounters.csv", encounters_df=None, backend="pandas"):
+    df = load_and_filter_encounters(file_path, encounters_df, backend)
     df = remove_zero_length_stays(df)
 
     revisiting_patients = get_revisiting_patients(df)
@@ -83,37 +132,64 @@ def get_revisit_details(file_path="\u00d8ya_encounters.csv"):
     cols = ["PatientPseudoKey", "EncounterPseudoKey", "EncounterStart", "EncounterEnd", "LengthOfStay", "AdmittingDepartment", "AdmissionSource", "DischargeDisposition"]
     return df[cols].sort_values(by=["PatientPseudoKey", "EncounterStart"]).reset_index(drop=True)
 
-def count_revisits(file_path="\u00d8ya_encounters.csv"):
-    df = load_and_filter_encounters(file_path)
-    df = remove_zero_length_stays(df)
-
-    visit_counts = df["PatientPseudoKey"].value_counts().reset_index()
-    visit_counts.columns = ["PatientPseudoKey", "VisitCount"]
-    revisit_counts = visit_counts[visit_counts["VisitCount"] > 1].reset_index(drop=True)
+def count_revisits(file_path="\u00d8ya_encounters.csv", encounters_df=None, backend="pandas"):
+    if use_sql(backend):
+        revisit_counts = run_query('''
+            SELECT "PatientPseudoKey", COUNT(*) AS "VisitCount"
+            FROM encounters
+            WHERE "LengthOfStay" > 0 AND "PatientPseudoKey" IS NOT NULL
+            GROUP BY "PatientPseudoKey"
+            HAVING COUNT(*) > 1
+            ORDER BY "VisitCount" DESC, MIN(__row)
+        ''', _encounter_source(file_path, encounters_df))
+    else:
+        df = load_and_filter_encounters(file_path, encounters_df, backend)
+        df = remove_zero_length_stays(df)
+
+        visit_counts = df["PatientPseudoKey"].value_counts().reset_index()
+        visit_counts.columns = ["PatientPseudoKey", "VisitCount"]
+        revisit_counts = visit_counts[visit_counts["VisitCount"] > 1].reset_index(drop=True)
 
     avg_visits = revisit_counts["VisitCount"].mean()
     print(f"\U0001F4CA Average number of visits among revisiting patients (LengthOfStay > 0): {avg_visits:.2f}\n")
 
     return revisit_counts
 
-def count_last_dispositions_from_revisit_list(file_path="\u00d8ya_encounters.csv"):
-    df = load_and_filter_encounters(file_path)
+def count_last_dispositions_from_revisit_list(file_path="\u00d8ya_encounters.csv", encounters_df=None, backend="pandas"):
+    df = load_and_filter_encounters(file_path, encounters_df, backend)
     df = remove_zero_length_stays(df)
 
     revisiting_patients = get_revisiting_patients(df)
     df = df[df["PatientPseudoKey"].isin(revisiting_patients)]
     last_encounters = get_last_encounter_per_patient(df)
 
-    disposition_counts = last_encounters["DischargeDisposition"].value_counts(dropna=False).reset_index()
+    disposition_counts = last_encounters["DischargeDisposition"].astype(object).value_counts(dropna=False).reset_index()
     disposition_counts.columns = ["ListOfDischargeDisposition", "NumberOfLastOccurences"]
 
     return disposition_counts
 
-def inflow_analysis(file_path="\u00d8ya_encounters.csv", output_file="WriteToExcel.xlsx"):
-    df = load_and_filter_encounters(file_path)
-    inflow_table = df.groupby(["Department", "AdmissionSource"]).size().unstack(fill_value=0).reset_index()
-
-    outflow_table = df.groupby(["Department", "DischargeDestination"]).size().unstack(fill_value=0).reset_index()
+def flow_tables(file_path="\u00d8ya_encounters.csv", encounters_df=None, backend="pandas"):
+    # Encounters per department and admission source (inflow) and per department and discharge destination (outflow)
+    if use_sql(backend):
+        tables = []
+        for column in ["AdmissionSource", "DischargeDestination"]:
+            counts = run_query(f'''
+                SELECT "Department", "{column}", COUNT(*) AS n
+                FROM encounters
+                WHERE "Department" IS NOT NULL AND "{column}" IS NOT NULL
+                GROUP BY "Department", "{column}"
+            ''', _encounter_source(file_path, encounters_df))
+            tables.append(counts.set_index(["Department", column])["n"].unstack(fill_value=0).reset_index())
+        return tuple(tables)
+
+    df = load_and_filter_encounters(file_path, encounters_df, backend)
+    inflow_table = df.groupby(["Department", "AdmissionSource"], observed=True).size().unstack(fill_value=0).reset_index()
+
+    outflow_table = df.groupby(["Department", "DischargeDestination"], observed=True).size().unstack(fill_value=0).reset_index()
+    return inflow_table, outflow_table
+
+def inflow_analysis(file_path="\u00d8ya_encounters.csv", output_file="WriteToExcel.xlsx", encounters_df=None, backend="pandas"):
+    inflow_table, outflow_table = flow_tables(file_path, encounters_df, backend)
 
     with pd.ExcelWriter(output_file, engine="openpyxl", mode="w") as writer:
         inflow_table.to_excel(writer, index=False, sheet_name="Inflow")
@@ -121,18 +197,18 @@ def inflow_analysis(file_path="\u00d8ya_encounters.csv", output_file="WriteToExc
 
     print(f"\u2705 Inflow and Outflow tables written to {output_file}")
 
-def flow_visualization(file_path="\u00d8ya_encounters.csv"):
-    df = load_and_filter_encounters(file_path)
+def flow_visualization(file_path="\u00d8ya_encounters.csv", encounters_df=None, backend="pandas"):
+    df = load_and_filter_encounters(file_path, encounters_df, backend)
     df = df.dropna(subset=["AdmissionSource", "DischargeDestination"])
 
     group_other = ["*Unspecified", "Annet", "Annen institusjon (ikke helse)"]
     group_hospital = ["Annen helseinstitusjon innenfor spesialisthelsetjenesten", "Somatisk sykehus STO", "Psykiatrisk sykehus STO"]
 
-    df["SourceGroup"] = df["AdmissionSource"].replace({**{v: "Other/Unspecified" for v in group_other}, **{v: "Hospital (SpecHelsetjeneste)" for v in group_hospital}})
-    df["SourceGroup"] = df["SourceGroup"].fillna(df["AdmissionSource"])
+    df["SourceGroup"] = df["AdmissionSource"].astype(object).replace({**{v: "Other/Unspecified" for v in group_other}, **{v: "Hospital (SpecHelsetjeneste)" for v in group_hospital}})
+    df["SourceGroup"] = df["SourceGroup"].fillna(df["AdmissionSource"].astype(object))
 
-    df["DestGroup"] = df["DischargeDestination"].replace({**{v: "Other/Unspecified" for v in group_other}, **{v: "Hospital (SpecHelsetjeneste)" for v in group_hospital}})
-    df["DestGroup"] = df["DestGroup"].fillna(df["DischargeDestination"])
+    df["DestGroup"] = df["DischargeDestination"].astype(object).replace({**{v: "Other/Unspecified" for v in group_other}, **{v: "Hospital (SpecHelsetjeneste)" for v in group_hospital}})
+    df["DestGroup"] = df["DestGroup"].fillna(df["DischargeDestination"].astype(object))
 
     df["SourceLabel"] = "From: " + df["SourceGroup"]
     df["DestLabel"] = "To: " + df["DestGroup"]
@@ -170,10 +246,8 @@ def flow_visualization(file_path="\u00d8ya_encounters.csv"):
     fig.update_layout(title_text="Pasientflyt: Inngang → Avdeling → Utskrivning", font_size=10)
     fig.show()
 
-def flow_visualization_simplified_with_colors(file_path="Øya_encounters.csv"):
-    df = pd.read_csv(file_path)
-    df = df[df["PatientPseudoKey"] != 2384]  # Exclude test patient
-    df = df[df["EncounterType"] == "Sykehuskontakt"]
+def flow_visualization_simplified_with_colors(file_path="Øya_encounters.csv", encounters_df=None):
+    df = frame_or_read(encounters_df, file_path, SYKEHUS_ENCOUNTERS)
     df = df.dropna(subset=["AdmissionSource", "DischargeDestination"])
 
     # Strip and normalize
@@ -280,11 +354,9 @@ def flow_visualization_simplified_with_colors(file_path="Øya_encounters.csv"):
     fig.update_layout(title="Pasientflyt (Forenklet, Fargekodet)", font_size=11)
     fig.show()
 
-def one_unit_visualization(file_path="Øya_encounters.csv"):
+def one_unit_visualization(file_path="Øya_encounters.csv", encounters_df=None):
     # Load and filter
-    df = pd.read_csv(file_path)
-    df = df[df["PatientPseudoKey"] != 2384]
-    df = df[df["EncounterType"] == "Sykehuskontakt"]
+    df = frame_or_read(encounters_df, file_path, SYKEHUS_ENCOUNTERS)
     df = df.dropna(subset=["AdmissionSource", "DischargeDestination"])
 
     # Normalize text
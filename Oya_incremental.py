@@ -0,0 +1,367 @@
+import json
+import os
+from collections import Counter
+import numpy as np
+import pandas as pd
+
+from CFS_Outcomes import pair_consecutive_stays, report_adl_development_matrix
+from Hospital_encounters import print_day_statistics
+from Oya_adl import apply_bins, load_adl_measurements, n_bins_of, resolve_bin_spec
+from Oya_cohort import REAL_PATIENTS, VALID_DECISION_STATUSES, VALID_DECISION_TEMPLATES, VALID_DECISIONS
+from Oya_counts import cube_statistics
+from Oya_encounters import load_and_filter_encounters
+from Oya_joins import build_decision_index, exclude_long_term_stays
+from Oya_loader import read_export
+from Oya_patterns import maintain_itemsets, maintained_table, min_count, mine_at_count
+from Oya_results import code_version
+
+# Incremental refresh for monthly appended exports. Every analysis here keeps a per-patient
+# contribution table in STATE_DIR, together with a watermark (latest timestamp seen) and a hash
+# of every processed row per export. On refresh only "re-opened" patients are recomputed:
+#   - patients with rows after the watermark (the new month),
+#   - patients with earlier rows that were added late or edited (e.g. a DeathDate filled in),
+#   - patients with rows that disappeared from the export.
+# A re-opened patient is recomputed from all of their current rows, so results that depend on
+# a patient's whole history (first death date, stay-to-next-stay pairs, nearest ADL, long-term
+# decisions) stay exact. A change of parameters, bin edges, export path or analysis code
+# starts over with a full build.
+# The decision itemsets keep, next to each patient's templates, their counts above a support
+# floor; a refresh counts only the transactions that changed (see Oya_patterns.maintain_itemsets),
+# and the saved counts answer any support at or above the floor without mining again.
+STATE_DIR = ".oya_state"
+
+### --- State --- ###
+
+def row_hashes(df):
+    # One uint64 per row; repeated identical rows get distinct hashes through their occurrence number
+    hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    occurrence = pd.Series(hashes).groupby(hashes).cumcount().to_numpy()
+    return pd.util.hash_pandas_object(pd.DataFrame({"row": hashes, "occurrence": occurrence}), index=False).to_numpy()
+
+def _state_paths(name, state_dir):
+    base = os.path.join(state_dir, name)
+    return base + ".json", base + ".{}.parquet"
+
+def _load_state(name, state_dir, params):
+    meta_path, table_path = _state_paths(name, state_dir)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta["code"] != code_version() or meta["params"] != params:
+        return None
+    tables = {table: pd.read_parquet(table_path.format(table)) for table in meta["tables"]}
+    return meta, tables
+
+def _save_state(name, state_dir, params, sources, tables):
+    os.makedirs(state_dir, exist_ok=True)
+    meta_path, table_path = _state_paths(name, state_dir)
+    for table, df in tables.items():
+        df.to_parquet(table_path.format(table), index=False)
+    meta = {"code": code_version(), "params": params, "sources": sources, "tables": sorted(tables)}
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2, ensure_ascii=False)
+
+def _watermark(times):
+    latest = times.max() if len(times) else pd.NaT
+    return None if pd.isna(latest) else pd.Timestamp(latest).isoformat()
+
+def _reopened_patients(df, hashes, time_col, watermark, rows):
+    # Patients to recompute, rows after the watermark, and earlier rows that are new or edited
+    patients = df["PatientPseudoKey"].to_numpy()
+    after = (df[time_col] > pd.Timestamp(watermark)).to_numpy() if watermark else np.ones(len(df), dtype=bool)
+    unknown = ~np.isin(hashes, rows["RowHash"].to_numpy())
+    gone = ~np.isin(rows["RowHash"].to_numpy(), hashes)
+    reopened = set(patients[after | unknown]) | set(rows["PatientPseudoKey"].to_numpy()[gone])
+    return reopened, int(after.sum()), int((unknown & ~after).sum())
+
+def refresh_contributions(name, frames, time_cols, contribute, params, state_dir=STATE_DIR, verbose=True):
+    # frames:     {source: rows of that export the analysis uses}
+    # time_cols:  {source: timestamp column that defines its watermark}
+    # contribute: function({source: rows}) -> per-patient contribution table with a PatientPseudoKey column
+    # Returns the contribution table for all patients, saved for the next refresh.
+    hashes = {source: row_hashes(df) for source, df in frames.items()}
+    state = _load_state(name, state_dir, params)
+
+    if state is None:
+        table = contribute(frames)
+        if verbose:
+            print(f"🆕 {name}: full build over {sum(len(df) for df in frames.values())} rows")
+    else:
+        meta, tables = state
+        reopened, after, late = set(), 0, 0
+        for source, df in frames.items():
+            patients, n_after, n_late = _reopened_patients(df, hashes[source], time_cols[source],
+                                                           meta["sources"][source]["watermark"], tables["rows_" + source])
+            reopened |= patients
+            after, late = after + n_after, late + n_late
+        subset = {source: df[df["PatientPseudoKey"].isin(reopened)] for source, df in frames.items()}
+        kept = tables["contributions"]
+        table = pd.concat([kept[~kept["PatientPseudoKey"].isin(reopened)], contribute(subset)], ignore_index=True)
+        if verbose:
+            print(f"🔁 {name}: {after} rows after the watermark, {late} earlier rows added or edited, "
+                  f"{len(reopened)} patients re-opened")
+
+    sources = {source: {"watermark": _watermark(df[time_cols[source]])} for source, df in frames.items()}
+    tables = {"contributions": table}
+    for source, df in frames.items():
+        tables["rows_" + source] = pd.DataFrame({"RowHash": hashes[source], "PatientPseudoKey": df["PatientPseudoKey"].to_numpy()})
+    _save_state(name, state_dir, params, sources, tables)
+    return table
+
+def _day_statistics(daily):
+    return cube_statistics(pd.Index(["All"]), daily.to_numpy()[None, :]).iloc[0]
+
+### --- Daily Counts --- ###
+
+# Each analysis below is split into the rows it uses, a per-patient contribution and a report
+# on the contributions of all patients, so it can also run partition by partition (Oya_partitions.py).
+
+def death_rows(df):
+    df = df.loc[df["PatientPseudoKey"] != 2384]
+    return df.assign(DeathDate=pd.to_datetime(df["DeathDate"], dayfirst=True, errors="coerce"))
+
+def death_days(frames):
+    # First valid death date per patient, in file order (as analyze_daily_deaths)
+    df = frames["hospital"]
+    df = df[df["DeathDate"].notna()].drop_duplicates(subset=["PatientPseudoKey"])
+    return pd.DataFrame({"PatientPseudoKey": df["PatientPseudoKey"].to_numpy(),
+                         "DeathDay": df["DeathDate"].dt.normalize().to_numpy()})
+
+def report_daily_deaths(deaths):
+    # Same output as Hospital_encounters.analyze_daily_deaths
+    print(f"✅ Parsed valid death dates (unique patients): {len(deaths)}")
+
+    daily_deaths = deaths.groupby("DeathDay").size()
+    daily_deaths = pd.Series(daily_deaths.to_numpy(), index=pd.Index(daily_deaths.index.date, name="DeathDateOnly"), name="count")
+    if daily_deaths.empty:
+        print("\n💀 Deaths per day:\nNo valid death dates found.")
+        return daily_deaths
+
+    print_day_statistics("\n💀 Deaths per day (unique patients):", _day_statistics(daily_deaths))
+    return daily_deaths
+
+def incremental_daily_deaths(file_path="Øya_2_hospitalencounters.csv", state_dir=STATE_DIR):
+    # Same output as Hospital_encounters.analyze_daily_deaths, refreshed from the saved state
+    deaths = refresh_contributions("daily_deaths", {"hospital": death_rows(read_export(file_path))}, {"hospital": "EncounterStart"},
+                                   death_days, {"file_path": os.path.abspath(file_path)}, state_dir)
+    return report_daily_deaths(deaths)
+
+def admission_rows(df):
+    df = df.loc[(df["PatientPseudoKey"] != 2384) & (df["AdmissionSource"] == "Bosted/arbeidsted")]
+    return df.assign(EncounterStart=pd.to_datetime(df["EncounterStart"], format="%Y-%m-%d %H:%M:%S", errors="coerce"))
+
+def admission_days(frames):
+    # Distinct (patient, admission day) pairs
+    df = frames["hospital"]
+    days = pd.DataFrame({"PatientPseudoKey": df["PatientPseudoKey"].to_numpy(),
+                         "AdmissionDay": df["EncounterStart"].dt.normalize().to_numpy()})
+    return days.dropna(subset=["AdmissionDay"]).drop_duplicates()
+
+def report_daily_admissions(admissions):
+    # Same output as Hospital_encounters.analyze_daily_admissions (without strata)
+    daily_counts = admissions.groupby("AdmissionDay").size()
+    daily_counts = pd.Series(daily_counts.to_numpy(), index=pd.Index(daily_counts.index.date, name="AdmissionDate"), name="count")
+    print_day_statistics("📆 Admissions from home per day:", _day_statistics(daily_counts))
+    return daily_counts
+
+def incremental_daily_admissions(file_path="Øya_2_hospitalencounters.csv", state_dir=STATE_DIR):
+    # Same output as Hospital_encounters.analyze_daily_admissions (without strata), refreshed from the saved state
+    admissions = refresh_contributions("daily_admissions", {"hospital": admission_rows(read_export(file_path))}, {"hospital": "EncounterStart"},
+                                       admission_days, {"file_path": os.path.abspath(file_path)}, state_dir)
+    return report_daily_admissions(admissions)
+
+### --- Department Summary --- ###
+
+DISPOSITION_COLUMNS = {
+    "Deaths": "Som død - Ingen melding går",
+    "SentHome": "Ut til hjemmet - Ingen melding går",
+    "SentToInstitution": "Til annen enhet - Ingen melding går",
+}
+
+def department_patients(frames):
+    # Visits, length-of-stay sum/count and disposition counts per (department, patient)
+    df = frames["encounters"]
+    df = df.assign(
+        Department=df["Department"].astype(object),
+        HasDisposition=df["DischargeDisposition"].notna(),
+        **{col: df["DischargeDisposition"] == label for col, label in DISPOSITION_COLUMNS.items()},
+    )
+    grouped = df.groupby(["Department", "PatientPseudoKey"])
+    table = grouped.agg(
+        Visits=("PatientPseudoKey", "size"),
+        LosSum=("LengthOfStay", "sum"),
+        LosCount=("LengthOfStay", "count"),
+        DispositionRows=("HasDisposition", "sum"),
+        **{col: (col, "sum") for col in DISPOSITION_COLUMNS},
+    )
+    return table.reset_index()
+
+def encounter_summary(table, department_dtype=None):
+    # Same table as Oya_encounters.analyze_encounters, from the (department, patient) contributions;
+    # department_dtype: the export's categorical Department dtype, which analyze_encounters keeps
+    by_department = table.groupby("Department")
+    summary = pd.DataFrame({
+        "TotalVisits": by_department["Visits"].sum(),
+        "UniquePatientCount": by_department.size(),
+        "AverageLengthOfStay": by_department["LosSum"].sum() / by_department["LosCount"].sum().replace(0, np.nan),
+        **{col: by_department[col].sum() for col in DISPOSITION_COLUMNS},
+    })
+    # Departments without any recorded disposition are left out, as in analyze_encounters
+    summary = summary[by_department["DispositionRows"].sum() > 0].reset_index()
+    if department_dtype is not None:
+        summary["Department"] = summary["Department"].astype(department_dtype)
+    return summary.sort_values(by="Department").reset_index(drop=True)
+
+def incremental_encounter_summary(file_path="Øya_encounters.csv", state_dir=STATE_DIR):
+    # Same table as Oya_encounters.analyze_encounters, refreshed from the saved state
+    encounters = load_and_filter_encounters(file_path)
+    table = refresh_contributions("encounter_summary", {"encounters": encounters}, {"encounters": "EncounterStart"},
+                                  department_patients, {"file_path": os.path.abspath(file_path)}, state_dir)
+    return encounter_summary(table, encounters["Department"].dtype)
+
+### --- ADL Transition Matrix --- ###
+
+def transition_stays(hospital_df):
+    # Stays from home with a discharge time (as load_adl_transition_pairs)
+    df = hospital_df.loc[(hospital_df["PatientPseudoKey"] != 2384) & (hospital_df["AdmissionSource"] == "Bosted/arbeidsted")]
+    return df.assign(EncounterEnd=pd.to_datetime(df["EncounterEnd"], errors="coerce")).dropna(subset=["EncounterEnd"])
+
+def transition_pairs(frames, window_days=30):
+    # Stay-to-next-stay pairs per patient; From/To are -1 for skipped pairs.
+    # frames: "hospital" (transition_stays), "adl" (binned measurement rows), "decisions" (export rows)
+    stays = exclude_long_term_stays(frames["hospital"], "EncounterEnd", build_decision_index(frames["decisions"]))
+    from_decile, to_decile, pair_patients, _ = pair_consecutive_stays(stays, frames["adl"], window_days)
+    return pd.DataFrame({"PatientPseudoKey": pair_patients, "From": from_decile, "To": to_decile})
+
+def report_transition_pairs(pairs, n_bins):
+    # Same output as CFS_Outcomes.analyze_adl_development_matrix
+    valid = pairs[pairs["From"] >= 0]
+    matrix = np.zeros((n_bins, n_bins), dtype=int)
+    np.add.at(matrix, (valid["From"].to_numpy(), valid["To"].to_numpy()), 1)
+    return report_adl_development_matrix(matrix, len(pairs) - len(valid))
+
+def incremental_adl_development_matrix(
+    adl_path="Øya_2_ADL.csv",
+    hospital_path="Øya_2_hospitalencounters.csv",
+    decisions_path="Øya_decisions.csv",
+    measurement_name="R HP COCM IPLOS/ADL TOTAL VANLIG GJENNOMSNITT",
+    window_days=30,
+    binning=None,
+    state_dir=STATE_DIR,
+):
+    # Same output as CFS_Outcomes.analyze_adl_development_matrix, refreshed from the saved state.
+    # Bin edges come from all values, so new values that move them (e.g. a new minimum with
+    # equal-width bins) mean a full build; a fixed binning avoids that.
+    adl_df = load_adl_measurements(adl_path, measurement_name)[measurement_name]
+    enc_df = transition_stays(read_export(hospital_path))
+    decisions_df = read_export(decisions_path)
+    decisions_df = decisions_df[decisions_df["PatientPseudoKey"] != 2384]
+
+    spec = resolve_bin_spec(binning, adl_df["Value"], measurement_name)
+    adl_df = apply_bins(adl_df, spec, label_col=None)
+
+    params = {"adl_path": os.path.abspath(adl_path), "hospital_path": os.path.abspath(hospital_path),
+              "decisions_path": os.path.abspath(decisions_path), "measurement_name": measurement_name,
+              "window_days": window_days, "edges": spec["edges"]}
+    pairs = refresh_contributions(
+        "adl_development_matrix",
+        {"hospital": enc_df, "adl": adl_df, "decisions": decisions_df},
+        {"hospital": "EncounterStart", "adl": "MeasurementTime", "decisions": "DecisionValidDate"},
+        lambda frames: transition_pairs(frames, window_days), params, state_dir,
+    )
+    return report_transition_pairs(pairs, n_bins_of(spec))
+
+
+### --- Decision Itemsets --- ###
+
+DECISION_COLUMNS = ["PatientPseudoKey", "DecisionTemplate", "DecisionStatus", "DecisionValidDate"]
+
+def patient_templates(frames, all_templates=True):
+    # Each patient's distinct templates, sorted. all_templates: every template of the patients with
+    # at least one valid template (as analyze_all_templates_for_valid_patients), otherwise only the
+    # valid ones (as analyze_decision_patterns)
+    df = frames["decisions"].dropna(subset=["PatientPseudoKey", "DecisionTemplate"])
+    if all_templates:
+        df = df[df["PatientPseudoKey"].isin(df.loc[df["DecisionTemplate"].isin(VALID_DECISION_TEMPLATES), "PatientPseudoKey"])]
+    pairs = pd.DataFrame({"PatientPseudoKey": df["PatientPseudoKey"].to_numpy(),
+                          "DecisionTemplate": df["DecisionTemplate"].astype(object).to_numpy()}).drop_duplicates()
+    templates = pairs.sort_values(["PatientPseudoKey", "DecisionTemplate"]).groupby("PatientPseudoKey")["DecisionTemplate"].agg(list)
+    return pd.DataFrame({"PatientPseudoKey": templates.index.to_numpy(), "Templates": templates.to_list()})
+
+def _itemset_state_params(file_path, all_templates, support_floor):
+    return {"file_path": os.path.abspath(file_path), "all_templates": all_templates, "support_floor": support_floor}
+
+def _itemset_state_names(all_templates):
+    # (per-patient templates, itemset counts)
+    kind = "all" if all_templates else "valid"
+    return f"decision_transactions_{kind}", f"decision_itemsets_{kind}"
+
+def _counts_of(table, column="Items"):
+    # {sorted tuple of templates: count} from a saved table of template lists and counts
+    return {tuple(items): int(count) for items, count in zip(table[column], table["Count"])}
+
+def refresh_decision_itemsets(file_path="Øya_decisions.csv", all_templates=True, support_floor=0.05, state_dir=STATE_DIR,
+                              verbose=True):
+    # Itemset counts at support_floor ({frozenset of templates: patients}) and the number of
+    # patients, refreshed from the saved state
+    source = {"file_path": os.path.abspath(file_path), "all_templates": all_templates}
+    cohort = REAL_PATIENTS.where("DecisionStatus", "in", VALID_DECISION_STATUSES) if all_templates else VALID_DECISIONS
+    rows = read_export(file_path, cohort=cohort.select(DECISION_COLUMNS))
+    transactions_name, name = _itemset_state_names(all_templates)
+    table = refresh_contributions(transactions_name, {"decisions": rows},
+                                  {"decisions": "DecisionValidDate"}, lambda frames: patient_templates(frames, all_templates),
+                                  source, state_dir, verbose)
+    transactions = Counter(tuple(templates) for templates in table["Templates"])
+    n_patients = len(table)
+
+    params = _itemset_state_params(file_path, all_templates, support_floor)
+    state = _load_state(name, state_dir, params)
+    if state is None:
+        itemsets = mine_at_count(transactions, min_count(n_patients, support_floor)) if n_patients else {}
+        if verbose:
+            print(f"🆕 {name}: {len(itemsets)} itemsets mined at support {support_floor}")
+    else:
+        _, tables = state
+        saved = {frozenset(items): count for items, count in _counts_of(tables["itemsets"]).items()}
+        itemsets, counted = maintain_itemsets(saved, _counts_of(tables["transactions"]), transactions, support_floor)
+        if verbose:
+            print(f"🔁 {name}: {len(itemsets)} itemsets at support {support_floor}, {counted} new candidates counted")
+
+    _save_state(name, state_dir, params, {"patients": n_patients}, {
+        "itemsets": pd.DataFrame({"Items": [sorted(itemset) for itemset in itemsets], "Count": list(itemsets.values())},
+                                 columns=["Items", "Count"]),
+        "transactions": pd.DataFrame({"Items": [list(items) for items in transactions], "Count": list(transactions.values())},
+                                     columns=["Items", "Count"]),
+    })
+    return itemsets, n_patients
+
+def incremental_decision_patterns(file_path="Øya_decisions.csv", min_support=0.1, all_templates=True, support_floor=0.05,
+                                  state_dir=STATE_DIR):
+    # Same itemsets as analyze_all_templates_for_valid_patients (analyze_decision_patterns with
+    # all_templates=False), refreshed from the saved state; min_support must be at or above the floor
+    if min_support < support_floor:
+        raise ValueError(f"min_support {min_support} is below the maintained support floor {support_floor}")
+    itemsets, n_patients = refresh_decision_itemsets(file_path, all_templates, support_floor, state_dir)
+    return maintained_table(itemsets, n_patients, min_support)
+
+def saved_decision_patterns(min_support=0.1, file_path="Øya_decisions.csv", all_templates=True, support_floor=0.05,
+                            state_dir=STATE_DIR):
+    # The itemsets of the last refresh at any support at or above the floor, without reading the export
+    if min_support < support_floor:
+        raise ValueError(f"min_support {min_support} is below the maintained support floor {support_floor}")
+    state = _load_state(_itemset_state_names(all_templates)[1], state_dir, _itemset_state_params(file_path, all_templates, support_floor))
+    if state is None:
+        raise ValueError("No saved decision itemsets for these settings; run incremental_decision_patterns first")
+    meta, tables = state
+    itemsets = {frozenset(items): count for items, count in _counts_of(tables["itemsets"]).items()}
+    return maintained_table(itemsets, meta["sources"]["patients"], min_support)
+
+
+if __name__ == "__main__":
+    # Run after each monthly export; the first run builds the state
+    incremental_daily_deaths()
+    incremental_daily_admissions()
+    print(incremental_encounter_summary())
+    incremental_adl_development_matrix()
+    print(incremental_decision_patterns())
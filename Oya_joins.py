@@ -0,0 +1,176 @@
+import numpy as np
+import pandas as pd
+from Oya_kernels import COMPILED, enclosing_positions, nearest_positions
+
+### --- Sorted Per-Patient Arrays --- ###
+
+def _dense_codes(left_keys, right_keys):
+    # Shared integer codes for the patient keys of both frames
+    _, codes = np.unique(np.concatenate([left_keys, right_keys]), return_inverse=True)
+    return codes[:len(left_keys)], codes[len(left_keys):]
+
+def _time_ranks(left_times, right_times):
+    # Dense ranks of all timestamps, so (patient, time) packs exactly into one int64
+    _, ranks = np.unique(np.concatenate([left_times, right_times]), return_inverse=True)
+    return ranks[:len(left_times)], ranks[len(left_times):], ranks.max() + 2 if len(ranks) else 1
+
+def _as_ns(series):
+    return pd.to_datetime(series).to_numpy(dtype="datetime64[ns]").astype(np.int64)
+
+def _sorted_by_patient(left, right, left_on, right_on, by):
+    # Right rows sorted by (patient, time, original position) as one packed int64 array,
+    # and each valid left row packed the same way with the bounds of its patient segment.
+    # Returns None if nothing can match.
+    if len(left) == 0 or len(right) == 0:
+        return None
+    left_time = _as_ns(left[left_on])
+    right_time = _as_ns(right[right_on])
+    nat = np.iinfo(np.int64).min
+    left_idx = np.flatnonzero(left_time != nat)
+    right_pos = np.flatnonzero(right_time != nat)
+    if len(left_idx) == 0 or len(right_pos) == 0:
+        return None
+
+    left_code, right_code = _dense_codes(left[by].to_numpy()[left_idx], right[by].to_numpy()[right_pos])
+    left_rank, right_rank, span = _time_ranks(left_time[left_idx], right_time[right_pos])
+    left_code = left_code.astype(np.int64)
+    right_packed = right_code.astype(np.int64) * span + right_rank
+    order = np.argsort(right_packed, kind="stable")
+    sorted_packed = right_packed[order]
+    sorted_pos = right_pos[order]
+
+    left_packed = left_code * span + left_rank
+    seg_start = np.searchsorted(sorted_packed, left_code * span, side="left")
+    seg_end = np.searchsorted(sorted_packed, (left_code + 1) * span, side="left")
+    return left_idx, left_time[left_idx], left_packed, sorted_packed, sorted_pos, right_time[sorted_pos], seg_start, seg_end
+
+
+### --- Nearest-in-time Join --- ###
+
+def nearest_in_time(left, right, left_on, right_on, by="PatientPseudoKey", direction="nearest", tolerance=None,
+                    allow_exact_matches=True, kernels=COMPILED):
+    # For every row in `left`, the position (iloc) of the row in `right` with the same `by` key
+    # that is closest in time, or -1 if there is none.
+    #   direction="nearest":  closest before or after
+    #   direction="backward": latest at or before the left time (right_on <= left_on)
+    #   direction="forward":  earliest at or after the left time (right_on >= left_on)
+    #   tolerance:            optional pd.Timedelta, matches further away than this are dropped
+    #   allow_exact_matches:  if False, only strictly earlier/later rows are matched
+    #   kernels:              walk each patient's rows in Oya_kernels.py (the default when numba is installed)
+    # Ties (equal distance before/after, or repeated measurement times) go to the row that
+    # comes first in `right`.
+    if direction not in {"nearest", "backward", "forward"}:
+        raise ValueError(f"Unknown direction: {direction}")
+    if kernels:
+        return nearest_positions(left[by].to_numpy(), left[left_on], right[by].to_numpy(), right[right_on],
+                                 direction, tolerance, allow_exact_matches)
+
+    match = np.full(len(left), -1, dtype=np.int64)
+    prepared = _sorted_by_patient(left, right, left_on, right_on, by)
+    if prepared is None:
+        return match
+    left_idx, left_time, left_packed, sorted_packed, sorted_pos, sorted_time, seg_start, seg_end = prepared
+
+    # Backward: last row at (or strictly) before t, moved to the first row with that same timestamp
+    after = np.searchsorted(sorted_packed, left_packed, side="right" if allow_exact_matches else "left")
+    back = after - 1
+    has_back = back >= seg_start
+    back_safe = np.where(has_back, back, 0)
+    back = np.where(has_back, np.searchsorted(sorted_packed, sorted_packed[back_safe], side="left"), -1)
+
+    # Forward: first row at (or strictly) after t
+    fwd = np.searchsorted(sorted_packed, left_packed, side="left" if allow_exact_matches else "right")
+    has_fwd = fwd < seg_end
+    fwd = np.where(has_fwd, fwd, -1)
+
+    back_diff = np.where(has_back, left_time - sorted_time[np.where(has_back, back, 0)], np.iinfo(np.int64).max)
+    fwd_diff = np.where(has_fwd, sorted_time[np.where(has_fwd, fwd, 0)] - left_time, np.iinfo(np.int64).max)
+
+    if direction == "backward":
+        chosen, diff = back, back_diff
+    elif direction == "forward":
+        chosen, diff = fwd, fwd_diff
+    else:
+        back_first = sorted_pos[np.where(has_back, back, 0)] < sorted_pos[np.where(has_fwd, fwd, 0)]
+        use_back = has_back & (~has_fwd | (back_diff < fwd_diff) | ((back_diff == fwd_diff) & back_first))
+        chosen = np.where(use_back, back, fwd)
+        diff = np.where(use_back, back_diff, fwd_diff)
+
+    found = chosen >= 0
+    if tolerance is not None:
+        found &= diff <= pd.Timedelta(tolerance).value
+
+    match[left_idx[found]] = sorted_pos[chosen[found]]
+    return match
+
+def join_nearest(left, right, left_on, right_on, columns, by="PatientPseudoKey", direction="nearest", tolerance=None,
+                 allow_exact_matches=True):
+    # Left frame with `columns` from the matched right row (NaN/NaT where no match)
+    match = nearest_in_time(left, right, left_on, right_on, by=by, direction=direction, tolerance=tolerance,
+                            allow_exact_matches=allow_exact_matches)
+    found = match >= 0
+    result = left.copy()
+    for col in columns:
+        if len(right) == 0:
+            result[col] = np.nan
+            continue
+        taken = right[col].iloc[np.where(found, match, 0)]
+        taken.index = left.index
+        result[col] = taken.where(found)
+    return result
+
+
+### --- Interval Join --- ###
+
+def enclosing_interval(events, starts, event_on, start_on, by="PatientPseudoKey", kernels=COMPILED):
+    # For every row in `events`, the position (iloc) of the row in `starts` whose interval
+    # [start_i, start_i+1) contains the event time, or -1. Intervals are formed per `by` key
+    # from consecutive start times, the last one is open-ended. Rows with equal start times
+    # keep their order in `starts` and the last of them owns the interval. kernels: as in nearest_in_time.
+    if kernels:
+        return enclosing_positions(events[by].to_numpy(), events[event_on], starts[by].to_numpy(), starts[start_on])
+    match = np.full(len(events), -1, dtype=np.int64)
+    prepared = _sorted_by_patient(events, starts, event_on, start_on, by)
+    if prepared is None:
+        return match
+    event_idx, _, event_packed, sorted_packed, sorted_pos, _, seg_start, _ = prepared
+
+    owner = np.searchsorted(sorted_packed, event_packed, side="right") - 1
+    found = owner >= seg_start
+    match[event_idx[found]] = sorted_pos[owner[found]]
+    return match
+
+def next_event(scores, events, score_on, event_on, by="PatientPseudoKey"):
+    # For every score, the position of the patient's first event at or after the score time
+    return nearest_in_time(scores, events, score_on, event_on, by=by, direction="forward")
+
+
+### --- Decision State at Time --- ###
+
+LONG_TERM_TEMPLATE = "Vedtak om langtidsopphold i institusjon"
+
+def build_decision_index(decisions_df):
+    # First valid date per (patient, template, status), sorted by patient
+    decisions_df = decisions_df.dropna(subset=["PatientPseudoKey", "DecisionValidDate"])
+    return (
+        decisions_df.groupby(["PatientPseudoKey", "DecisionTemplate", "DecisionStatus"], observed=True)["DecisionValidDate"]
+        .min()
+        .sort_index()
+    )
+
+def held_decision_at(decision_index, patient_keys, times, template, statuses=("Signert",)):
+    # Vectorized "did patient P hold `template` (in one of `statuses`) at time t": True where the
+    # first valid date of such a decision falls on or before the calendar day of t.
+    templates = decision_index.index.get_level_values("DecisionTemplate")
+    decision_statuses = decision_index.index.get_level_values("DecisionStatus")
+    selected = decision_index[(templates == template) & decision_statuses.isin(statuses)]
+    first_valid = selected.groupby(level="PatientPseudoKey").min()
+
+    first_dates = pd.Series(pd.Series(patient_keys).map(first_valid).to_numpy(), dtype="datetime64[ns]")
+    days = pd.Series(pd.to_datetime(pd.Series(times).to_numpy()))
+    return (first_dates.dt.normalize() <= days.dt.normalize()).to_numpy()
+
+def exclude_long_term_stays(df, time_col, decision_index, statuses=("Signert",)):
+    # Drop encounters where the patient already held a long-term institution decision
+    held = held_decision_at(decision_index, df["PatientPseudoKey"], df[time_col], LONG_TERM_TEMPLATE, statuses)
+    return df[~held]
@@ -0,0 +1,199 @@
+import numpy as np
+import pandas as pd
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# Per-patient sequential kernels (pip install numba). The joins that walk each patient's events in
+# time order (nearest measurement, enclosing CFS interval, last earlier discharge, consecutive-stay
+# pairing) run as loops over patient-grouped arrays: values sorted by (patient, time, position) and
+# offsets, where rows offsets[g]:offsets[g + 1] are patient g. With numba the loops are compiled and
+# Oya_joins, classify_readmissions and pair_consecutive_stays use them; without it the kernels are
+# plain Python and the analyses keep their vectorized NumPy path. Both give the same results
+# (tests/test_kernels.py checks the kernels against the NumPy path).
+COMPILED = njit is not None
+
+NAT = np.iinfo(np.int64).min
+DIRECTIONS = {"nearest": 0, "backward": 1, "forward": 2}
+
+def kernel(func):
+    # Compiled on first call when numba is installed (and cached next to this file), else as written
+    return njit(cache=True, nogil=True)(func) if COMPILED else func
+
+### --- Patient-grouped Arrays --- ###
+
+def patient_segments(left_keys, left_times, right_keys, right_times):
+    # Both sides grouped by shared patient codes, each sorted by (patient, time, position) with NaT
+    # times left out. Segment g of the left side is the same patient as segment g of the right side.
+    # Returns (left_order, left_offsets, right_order, right_offsets); the orders are positions.
+    left_valid = np.flatnonzero(left_times != NAT)
+    right_valid = np.flatnonzero(right_times != NAT)
+    _, codes = np.unique(np.concatenate([np.asarray(left_keys)[left_valid], np.asarray(right_keys)[right_valid]]),
+                         return_inverse=True)
+    n_groups = int(codes.max()) + 1 if len(codes) else 0
+    segments = []
+    for valid, group_codes, times in ((left_valid, codes[:len(left_valid)], left_times),
+                                      (right_valid, codes[len(left_valid):], right_times)):
+        order = np.lexsort((times[valid], group_codes))
+        offsets = np.searchsorted(group_codes[order], np.arange(n_groups + 1)).astype(np.int64)
+        segments += [valid[order].astype(np.int64), offsets]
+    return tuple(segments)
+
+### --- Kernels --- ###
+
+@kernel
+def nearest_kernel(left_offsets, left_times, right_offsets, right_times, right_positions, direction, tolerance,
+                   has_tolerance, allow_exact):
+    # Index (into the right arrays) of each left row's match as in Oya_joins.nearest_in_time, or -1.
+    # Two pointers per patient: the first right row at or after t and the first one after t.
+    match = np.full(len(left_times), -1, np.int64)
+    for g in range(len(left_offsets) - 1):
+        start, end = right_offsets[g], right_offsets[g + 1]
+        at_or_after, after = start, start
+        for i in range(left_offsets[g], left_offsets[g + 1]):
+            t = left_times[i]
+            while at_or_after < end and right_times[at_or_after] < t:
+                at_or_after += 1
+            if after < at_or_after:
+                after = at_or_after
+            while after < end and right_times[after] <= t:
+                after += 1
+
+            # Backward: last row at (or strictly) before t, moved to the first row with that timestamp
+            back = (after if allow_exact else at_or_after) - 1
+            if back < start:
+                back = -1
+            else:
+                while back > start and right_times[back - 1] == right_times[back]:
+                    back -= 1
+            # Forward: first row at (or strictly) after t
+            fwd = at_or_after if allow_exact else after
+            if fwd >= end:
+                fwd = -1
+
+            if direction == 1 or fwd < 0:
+                chosen = back if direction != 2 else -1
+            elif direction == 2 or back < 0:
+                chosen = fwd
+            else:
+                back_diff, fwd_diff = t - right_times[back], right_times[fwd] - t
+                if back_diff < fwd_diff or (back_diff == fwd_diff and right_positions[back] < right_positions[fwd]):
+                    chosen = back
+                else:
+                    chosen = fwd
+            if chosen >= 0 and has_tolerance and abs(right_times[chosen] - t) > tolerance:
+                chosen = -1
+            match[i] = chosen
+    return match
+
+@kernel
+def interval_kernel(event_offsets, event_times, start_offsets, start_times):
+    # Index (into the start arrays) of the interval [start_i, start_i+1) holding each event, or -1;
+    # the last of equal start times owns the interval, as in Oya_joins.enclosing_interval
+    match = np.full(len(event_times), -1, np.int64)
+    for g in range(len(event_offsets) - 1):
+        start, end = start_offsets[g], start_offsets[g + 1]
+        p = start
+        for i in range(event_offsets[g], event_offsets[g + 1]):
+            while p < end and start_times[p] <= event_times[i]:
+                p += 1
+            if p > start:
+                match[i] = p - 1
+    return match
+
+@kernel
+def previous_gap_kernel(left_offsets, left_days, right_offsets, right_days):
+    # Days from each left day back to the patient's latest right day strictly before it, or -1
+    gaps = np.full(len(left_days), -1, np.int64)
+    for g in range(len(left_offsets) - 1):
+        start, end = right_offsets[g], right_offsets[g + 1]
+        p = start
+        for i in range(left_offsets[g], left_offsets[g + 1]):
+            while p < end and right_days[p] < left_days[i]:
+                p += 1
+            if p > start:
+                gaps[i] = left_days[i] - right_days[p - 1]
+    return gaps
+
+@kernel
+def consecutive_pairs_kernel(offsets, match, measurement_times):
+    # Every stay with the patient's next one: (first stay, its match, next stay's match, valid).
+    # A pair is valid when both stays have a measurement and they are not the same measurement time.
+    n_pairs = 0
+    for g in range(len(offsets) - 1):
+        n_pairs += max(offsets[g + 1] - offsets[g] - 1, 0)
+    first = np.empty(n_pairs, np.int64)
+    from_match = np.full(n_pairs, -1, np.int64)
+    to_match = np.full(n_pairs, -1, np.int64)
+    valid = np.zeros(n_pairs, np.bool_)
+    k = 0
+    for g in range(len(offsets) - 1):
+        for i in range(offsets[g], offsets[g + 1] - 1):
+            a, b = match[i], match[i + 1]
+            first[k] = i
+            if a >= 0 and b >= 0 and measurement_times[a] != measurement_times[b]:
+                from_match[k], to_match[k], valid[k] = a, b, True
+            k += 1
+    return first, from_match, to_match, valid
+
+### --- Joins on Kernels --- ###
+
+def _nanoseconds(times):
+    # Datetime values (Series or array) as int64 nanoseconds, NaT as NAT
+    return pd.to_datetime(pd.Series(times)).to_numpy(dtype="datetime64[ns]").astype(np.int64)
+
+def _positions(found, order):
+    # Kernel indices into sorted arrays as positions in the original rows (-1 stays -1)
+    positions = np.full(len(found), -1, dtype=np.int64)
+    positions[found >= 0] = order[found[found >= 0]]
+    return positions
+
+def nearest_positions(left_keys, left_times, right_keys, right_times, direction="nearest", tolerance=None,
+                      allow_exact_matches=True):
+    # Oya_joins.nearest_in_time on key and datetime arrays
+    left_times, right_times = _nanoseconds(left_times), _nanoseconds(right_times)
+    left_order, left_offsets, right_order, right_offsets = patient_segments(left_keys, left_times, right_keys, right_times)
+    found = nearest_kernel(left_offsets, left_times[left_order], right_offsets, right_times[right_order], right_order,
+                           DIRECTIONS[direction], 0 if tolerance is None else pd.Timedelta(tolerance).value,
+                           tolerance is not None, allow_exact_matches)
+    match = np.full(len(left_times), -1, dtype=np.int64)
+    match[left_order] = _positions(found, right_order)
+    return match
+
+def enclosing_positions(event_keys, event_times, start_keys, start_times):
+    # Oya_joins.enclosing_interval on key and datetime arrays
+    event_times, start_times = _nanoseconds(event_times), _nanoseconds(start_times)
+    event_order, event_offsets, start_order, start_offsets = patient_segments(event_keys, event_times, start_keys, start_times)
+    found = interval_kernel(event_offsets, event_times[event_order], start_offsets, start_times[start_order])
+    match = np.full(len(event_times), -1, dtype=np.int64)
+    match[event_order] = _positions(found, start_order)
+    return match
+
+def days_since_previous(left_keys, left_times, right_keys, right_times):
+    # Calendar days from each left time back to the patient's latest right time on an earlier day
+    # (NaN where there is none), as in Hospital_encounters.classify_readmissions
+    day = pd.Timedelta(days=1).value
+    left_times, right_times = _nanoseconds(left_times), _nanoseconds(right_times)
+    left_days = np.where(left_times != NAT, left_times // day, NAT)
+    right_days = np.where(right_times != NAT, right_times // day, NAT)
+    left_order, left_offsets, right_order, right_offsets = patient_segments(left_keys, left_days, right_keys, right_days)
+    found = previous_gap_kernel(left_offsets, left_days[left_order], right_offsets, right_days[right_order])
+    gaps = np.full(len(left_times), np.nan)
+    gaps[left_order] = np.where(found >= 0, found, np.nan)
+    return gaps
+
+def consecutive_stay_pairs(stay_keys, stay_times, measurement_keys, measurement_times, tolerance):
+    # The closest measurement within tolerance of every stay, paired with the patient's next stay,
+    # as in CFS_Outcomes.pair_consecutive_stays. Returns (from_match, to_match, pair_keys, valid),
+    # matches as positions of the measurements; stays are expected without NaT times.
+    stay_times, measurement_times = _nanoseconds(stay_times), _nanoseconds(measurement_times)
+    stay_order, stay_offsets, measurement_order, measurement_offsets = patient_segments(
+        stay_keys, stay_times, measurement_keys, measurement_times)
+    sorted_times = measurement_times[measurement_order]
+    found = nearest_kernel(stay_offsets, stay_times[stay_order], measurement_offsets, sorted_times, measurement_order,
+                           0, pd.Timedelta(tolerance).value, True, True)
+    first, from_found, to_found, valid = consecutive_pairs_kernel(stay_offsets, found, sorted_times)
+    pair_keys = np.asarray(stay_keys)[stay_order[first]]
+    return _positions(from_found, measurement_order), _positions(to_found, measurement_order), pair_keys, valid
@@ -0,0 +1,92 @@
+import os
+import numpy as np
+import pandas as pd
+from Oya_loader import ROW_COLUMN, TABLE_SCHEMAS, cached_parquet, missing_as_nan, table_for
+from Oya_sql import BACKENDS
+
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
+# Optional lazy backend (pip install polars). With backend="polars" the shared preprocessing
+# (test-patient and cohort filters, date parsing, destination/disposition grouping, deduplication)
+# is built as one polars LazyFrame plan over the export and only the prepared rows are turned
+# into a pandas frame, at the point where the analysis itself starts. Polars optimizes the plan
+# (filters and column selection move into the scan) and runs it multi-threaded, without the
+# intermediate pandas copies. The pandas path stays the reference (python Oya_sql.py compares them).
+
+# Tried after a timestamp column's expected format, like the day-first fallback in Oya_loader.parse_timestamps
+DAYFIRST_FORMATS = ["%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%d/%m/%Y", "%d.%m.%Y %H:%M:%S", "%d.%m.%Y",
+                    "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M:%S%.f", "%Y-%m-%d"]
+
+def use_lazy(backend):
+    # True for the polars backend; unknown or unavailable backends raise
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend: {backend} (expected one of {', '.join(BACKENDS)})")
+    if backend == "polars" and pl is None:
+        raise ImportError("The polars backend needs the polars package: pip install polars")
+    return backend == "polars"
+
+### --- Scans --- ###
+
+def _parse_timestamps(values, formats):
+    # Like Oya_loader.parse_timestamps: each later format is only tried on the values still missed
+    parsed = values.str.strptime(pl.Datetime("ns"), formats[0], strict=False)
+    for fmt in formats[1:]:
+        missed = parsed.is_null() & values.is_not_null()
+        if not missed.any():
+            break
+        parsed = parsed.scatter(missed.arg_true(), values.filter(missed).str.strptime(pl.Datetime("ns"), fmt, strict=False))
+    return parsed
+
+def _parse_timestamp(column, fmt):
+    formats = ([fmt] if fmt else []) + DAYFIRST_FORMATS
+    return pl.col(column).map_batches(lambda values: _parse_timestamps(values, formats), return_dtype=pl.Datetime("ns"))
+
+def _scan_csv(file_path):
+    # The CSV typed like Oya_loader.read_with_schema, with each row's position as ROW_COLUMN
+    table = table_for(file_path)
+    if table is None:
+        lf = pl.scan_csv(file_path)
+    else:
+        schema = TABLE_SCHEMAS[table]
+        header = pd.read_csv(file_path, nrows=0).columns
+        typed = set(schema["categorical"]) | set(schema["keys"]) | set(schema["numeric"]) | set(schema["timestamps"])
+        lf = pl.scan_csv(file_path, schema_overrides={col: pl.String for col in header if col in typed})
+        lf = lf.with_columns(
+            [pl.col(col).cast(pl.Int64, strict=False) for col in schema["keys"] if col in header]
+            + [pl.col(col).cast(pl.Float64, strict=False) for col in schema["numeric"] if col in header]
+            + [_parse_timestamp(col, fmt).alias(col) for col, fmt in schema["timestamps"].items() if col in header]
+            + [pl.col(col).cast(pl.Categorical) for col in schema["categorical"] if col in header]
+        )
+    return lf.with_row_index(ROW_COLUMN).with_columns(pl.col(ROW_COLUMN).cast(pl.Int64))
+
+def scan_export(file_path, cohort=None, df=None):
+    # LazyFrame over an export (its parquet cache when current, else the CSV), or over an already
+    # loaded frame (e.g. a pipeline stage), restricted to the cohort. ROW_COLUMN holds the row's
+    # position in the export (index label for frames). Categorical columns stay categorical, as
+    # in a pandas read, so cast them to strings before string operations.
+    if df is not None:
+        rows = df.index.to_numpy() if pd.api.types.is_integer_dtype(df.index) else np.arange(len(df))
+        lf = pl.from_pandas(df.assign(**{ROW_COLUMN: rows})).lazy()
+    else:
+        parquet = cached_parquet(file_path)
+        lf = pl.scan_parquet(parquet) if parquet else _scan_csv(os.path.abspath(file_path))
+    if cohort is None:
+        return lf
+    lf = lf.filter(cohort.polars())
+    if cohort.columns is not None:
+        lf = lf.select([col for col in lf.collect_schema().names() if col in cohort.columns or col == ROW_COLUMN])
+    return lf
+
+def collect(lf):
+    # Run the plan; the result is a pandas frame indexed like a cohort read of the export
+    df = lf.collect().to_pandas()
+    if ROW_COLUMN in df.columns:
+        df.index = pd.Index(df.pop(ROW_COLUMN).to_numpy())
+    for col in df.columns:
+        # Polars orders categories by first appearance, a pandas read sorts them (group order)
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].cat.reorder_categories(sorted(df[col].cat.categories))
+    return missing_as_nan(df)
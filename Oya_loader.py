@@ -0,0 +1,310 @@
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+
+# Parsed exports are cached next to the source CSV, e.g. data/.oya_cache/Øya_2_ADL.parquet
+CACHE_DIR = ".oya_cache"
+
+# Parquet caches keep each row's position in the export, so a cohort read (see Oya_cohort.py)
+# returns the same index labels as filtering the whole frame. Bump CACHE_LAYOUT when the
+# layout changes, existing caches are then rebuilt.
+ROW_COLUMN = "__row"
+CACHE_LAYOUT = 2
+
+# In-process cache: absolute path -> (size, mtime_ns, DataFrame)
+_parsed_exports = {}
+
+# Declared schema per source table. Categorical columns are read as pandas categoricals,
+# keys are downcast to int32 and timestamps are parsed to datetime64 once, at read time.
+# "timestamps" maps column -> expected format; rows that do not match the expected format
+# are retried day-first (the exports mix "%d/%m/%Y" and ISO dates).
+TABLE_SCHEMAS = {
+    "encounters": {
+        "categorical": ["EncounterType", "Department", "AdmittingDepartment", "HospitalService",
+                        "DischargeDisposition", "DischargeDestination", "AdmissionSource"],
+        "keys": ["PatientPseudoKey", "EncounterPseudoKey"],
+        "numeric": ["LengthOfStay"],
+        "timestamps": {"EncounterStart": "%Y-%m-%d %H:%M:%S",
+                       "EncounterEnd": "%Y-%m-%d %H:%M:%S",
+                       "DischargeInstant": "%Y-%m-%d %H:%M:%S"},
+    },
+    "hospital_encounters": {
+        "categorical": ["AdmissionSource", "DischargeDestination", "DischargeDisposition", "Department"],
+        "keys": ["PatientPseudoKey", "EncounterPseudoKey"],
+        "numeric": [],
+        "timestamps": {"EncounterStart": "%Y-%m-%d %H:%M:%S",
+                       "EncounterEnd": "%Y-%m-%d %H:%M:%S",
+                       "DeathDate": None},
+    },
+    "adl": {
+        "categorical": ["MeasurementName"],
+        "keys": ["PatientPseudoKey"],
+        "numeric": ["Value"],
+        "timestamps": {"MeasurementTime": "%Y-%m-%d %H:%M:%S"},
+    },
+    "decisions": {
+        "categorical": ["DecisionTemplate", "DecisionStatus"],
+        "keys": ["PatientPseudoKey"],
+        "numeric": [],
+        "timestamps": {"DecisionValidDate": "%d/%m/%Y"},
+    },
+    "cfs": {
+        "categorical": [],
+        "keys": ["PatientPseudoKey"],
+        "numeric": [],
+        "timestamps": {"TakenInstant": "%Y-%m-%d %H:%M:%S"},
+    },
+}
+
+# Default export file names -> table schema
+EXPORT_TABLES = {
+    "Øya_encounters.csv": "encounters",
+    "Øya_2_hospitalencounters.csv": "hospital_encounters",
+    "Øya_2_ADL.csv": "adl",
+    "Øya_decisions.csv": "decisions",
+    "Øya_CFS.csv": "cfs",
+}
+
+
+### --- Cache Helpers --- ###
+
+def file_hash(file_path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def export_fingerprint(file_path):
+    # SHA-256 of a source file, taken from the parse cache metadata while size and mtime still match
+    abs_path = os.path.abspath(file_path)
+    stat = os.stat(abs_path)
+    meta = _load_meta(_cache_paths(abs_path)[2])
+    if meta is not None and meta["size"] == stat.st_size and meta["mtime_ns"] == stat.st_mtime_ns:
+        return meta["sha256"]
+    return file_hash(abs_path)
+
+def _cache_paths(file_path):
+    folder, name = os.path.split(os.path.abspath(file_path))
+    stem = os.path.splitext(name)[0]
+    cache_folder = os.path.join(folder, CACHE_DIR)
+    return cache_folder, os.path.join(cache_folder, stem + ".parquet"), os.path.join(cache_folder, stem + ".json")
+
+def _replace(path, write):
+    # write(temporary path) in the same folder, then rename it over path, so processes or threads
+    # building the same cache at once never read (or leave behind) a partly written file
+    fd, tmp_path = tempfile.mkstemp(prefix="." + os.path.basename(path) + ".", suffix=".tmp", dir=os.path.dirname(path))
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def _write_frame(df, data_path):
+    try:
+        frame = df.assign(**{ROW_COLUMN: np.arange(len(df), dtype=np.int64)})
+        _replace(data_path, lambda path: frame.to_parquet(path, index=False))
+        return "parquet"
+    except (ImportError, TypeError, ValueError):
+        # No parquet engine, or mixed-type columns it cannot store: fall back to pickle
+        _replace(data_path + ".pkl", df.to_pickle)
+        return "pickle"
+
+def _read_frame(data_path, fmt, cohort=None):
+    # cohort: filters and columns applied while scanning the parquet file
+    if fmt == "pickle":
+        df = pd.read_pickle(data_path + ".pkl")
+        return cohort.apply(df) if cohort is not None else df
+    if cohort is None:
+        df = pd.read_parquet(data_path).drop(columns=[ROW_COLUMN], errors="ignore")
+    else:
+        import pyarrow.parquet as pq
+        names = pq.read_schema(data_path).names
+        if ROW_COLUMN not in names:
+            return cohort.apply(_read_frame(data_path, fmt))
+        columns = [col for col in names if cohort.columns is None or col in cohort.columns or col == ROW_COLUMN]
+        df = pd.read_parquet(data_path, columns=columns, filters=cohort.expression())
+        df.index = pd.Index(df.pop(ROW_COLUMN).to_numpy())
+    return missing_as_nan(df)
+
+def missing_as_nan(df):
+    # Parquet (and SQL results) give None for missing strings, pd.read_csv gives NaN; keep the CSV behaviour
+    for col in df.columns[df.dtypes == object]:
+        values = df[col].to_numpy(dtype=object, copy=True)
+        values[pd.isna(values)] = np.nan
+        df[col] = values
+    return df
+
+def _load_meta(meta_path):
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _save_meta(meta_path, meta):
+    # Written after the data file, so a meta file always describes a complete cache
+    def write(path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+    _replace(meta_path, write)
+
+
+### --- Schema Helpers --- ###
+
+def parse_timestamps(series, fmt=None):
+    if fmt is None:
+        return pd.to_datetime(series, format="mixed", dayfirst=True, errors="coerce")
+    parsed = pd.to_datetime(series, format=fmt, errors="coerce")
+    missed = parsed.isna() & series.notna()
+    if missed.any():
+        parsed[missed] = pd.to_datetime(series[missed], format="mixed", dayfirst=True, errors="coerce")
+    return parsed
+
+def downcast_key(series):
+    # int32 covers the pseudo keys; keep the column as-is if it has gaps or does not fit
+    if series.isna().any() or not pd.api.types.is_integer_dtype(series):
+        return series
+    info = np.iinfo(np.int32)
+    if series.empty or (series.min() >= info.min and series.max() <= info.max):
+        return series.astype(np.int32)
+    return series
+
+def table_for(file_path):
+    return EXPORT_TABLES.get(os.path.basename(file_path))
+
+def read_with_schema(file_path, table):
+    schema = TABLE_SCHEMAS[table]
+    header = pd.read_csv(file_path, nrows=0).columns
+    dtypes = {col: "category" for col in schema["categorical"] if col in header}
+    df = pd.read_csv(file_path, dtype=dtypes)
+
+    for col in schema["keys"]:
+        if col in df.columns:
+            df[col] = downcast_key(df[col])
+    for col in schema["numeric"]:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+    for col, fmt in schema["timestamps"].items():
+        if col in df.columns:
+            df[col] = parse_timestamps(df[col], fmt)
+    return df
+
+def _schema_version(table):
+    if table is None:
+        return None
+    versioned = {"schema": TABLE_SCHEMAS[table], "layout": CACHE_LAYOUT}
+    return hashlib.sha256(json.dumps(versioned, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+### --- Public Loader --- ###
+
+def read_export(file_path, use_cache=True, table=None, cohort=None):
+    # Parse an Øya CSV export once and serve every later call from the cache.
+    # The source is considered unchanged if size and mtime match the cached metadata,
+    # otherwise its SHA-256 is compared before the CSV is parsed again.
+    # Known exports (see EXPORT_TABLES) are typed with their schema; pass table= for renamed files.
+    # cohort: an Oya_cohort.Cohort; with a valid on-disk cache only its rows and columns are read,
+    # otherwise the export is parsed (and cached) whole and then filtered.
+    abs_path = os.path.abspath(file_path)
+    stat = os.stat(abs_path)
+    table = table or table_for(abs_path)
+
+    def parse():
+        return read_with_schema(abs_path, table) if table else pd.read_csv(abs_path)
+
+    def select(df):
+        return cohort.apply(df).copy() if cohort is not None else df.copy()
+
+    if not use_cache:
+        return select(parse())
+
+    cached = _parsed_exports.get(abs_path)
+    if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+        return select(cached[2])
+
+    cache_folder, data_path, meta_path = _cache_paths(abs_path)
+    meta = _load_meta(meta_path)
+    df = None
+
+    if meta is not None and meta.get("schema") != _schema_version(table):
+        meta = None  # Schema changed since the cache was written
+
+    if meta is not None:
+        unchanged = meta["size"] == stat.st_size and meta["mtime_ns"] == stat.st_mtime_ns
+        if not unchanged and meta["size"] == stat.st_size:
+            # Touched but possibly identical (e.g. re-copied export): fall back to the hash
+            unchanged = meta["sha256"] == file_hash(abs_path)
+            if unchanged:
+                meta["mtime_ns"] = stat.st_mtime_ns
+                _save_meta(meta_path, meta)
+        if unchanged:
+            try:
+                if cohort is not None:
+                    return _read_frame(data_path, meta.get("format", "parquet"), cohort)
+                df = _read_frame(data_path, meta.get("format", "parquet"))
+            except (OSError, ValueError):
+                df = None  # Corrupt or missing cache file, rebuild below
+
+    if df is None:
+        df = parse()
+        os.makedirs(cache_folder, exist_ok=True)
+        fmt = _write_frame(df, data_path)
+        _save_meta(meta_path, {
+            "source": os.path.basename(abs_path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": file_hash(abs_path),
+            "format": fmt,
+            "schema": _schema_version(table),
+        })
+
+    _parsed_exports[abs_path] = (stat.st_size, stat.st_mtime_ns, df)
+    return select(df)
+
+def cached_parquet(file_path, table=None):
+    # Path of the export's on-disk parquet cache if it is current, otherwise None. Nothing is
+    # parsed or rebuilt, so other readers (e.g. the SQL backend) can scan the cache directly.
+    abs_path = os.path.abspath(file_path)
+    stat = os.stat(abs_path)
+    _, data_path, meta_path = _cache_paths(abs_path)
+    meta = _load_meta(meta_path)
+    if (meta is None or meta.get("format", "parquet") != "parquet" or not os.path.exists(data_path)
+            or meta.get("schema") != _schema_version(table or table_for(abs_path))
+            or meta["size"] != stat.st_size or meta["mtime_ns"] != stat.st_mtime_ns):
+        return None
+    import pyarrow.parquet as pq
+    return data_path if ROW_COLUMN in pq.read_schema(data_path).names else None
+
+def frame_or_read(df, file_path, cohort=None):
+    # Analyses take an already loaded frame (e.g. a pipeline stage) instead of a path; work on a copy.
+    # cohort: filters and columns to apply, pushed down into the read when there is no frame
+    if df is not None:
+        return cohort.apply(df).copy() if cohort is not None else df.copy()
+    return read_export(file_path, cohort=cohort)
+
+def memory_report(deep=True):
+    # Memory use per table currently held in the in-process cache
+    rows = []
+    for path, (_, _, df) in _parsed_exports.items():
+        rows.append({
+            "Table": table_for(path) or os.path.basename(path),
+            "Rows": len(df),
+            "Columns": df.shape[1],
+            "MemoryMB": round(df.memory_usage(deep=deep).sum() / 1024 ** 2, 2),
+        })
+    report = pd.DataFrame(rows, columns=["Table", "Rows", "Columns", "MemoryMB"])
+    print("\n🧮 Memory use per loaded table:")
+    print(report.to_string(index=False))
+    return report
+
+def clear_cache(file_path=None):
+    # Drop in-process entries (all, or only for one export). On-disk files are kept and revalidated.
+    if file_path is None:
+        _parsed_exports.clear()
+    else:
+        _parsed_exports.pop(os.path.abspath(file_path), None)
@@ -0,0 +1,190 @@
+import json
+import math
+import os
+import re
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+from Oya_adl import apply_bins, clean_adl_measurements, n_bins_of, resolve_bin_spec
+from Oya_cohort import VALID_DECISIONS
+from Oya_encounters import get_revisiting_patients, load_and_filter_encounters, remove_zero_length_stays
+from Oya_incremental import (admission_days, admission_rows, death_days, death_rows, department_patients,
+                             encounter_summary, report_daily_admissions, report_daily_deaths,
+                             report_transition_pairs, transition_pairs, transition_stays)
+from Oya_loader import export_fingerprint, read_export, table_for
+from Oya_patterns import encode_transactions, frequent_itemsets
+
+# Out-of-core mode for exports larger than memory. Each export is streamed once, in chunks, into
+# partition files by a hash of PatientPseudoKey, so every patient's rows (in their original order)
+# end up in the same partition of every export. Per-patient logic (first death date, closest ADL,
+# stay-to-next-stay pairs, revisits) then runs one partition at a time and the per-patient results
+# are combined; the results are the same as the in-memory analyses.
+# Partitions are kept next to the export, e.g. data/.oya_partitions/Øya_2_ADL-16/part-0003.csv,
+# and reused until the export changes. Analyses that use an export together with different other
+# exports need different partition counts, so every count is kept while the export is unchanged;
+# partitionings of an older version of the export are removed when a new one is written. Each
+# partitioning is written into a temporary folder and renamed into place when complete.
+PARTITION_DIR = ".oya_partitions"
+DEFAULT_MEMORY_MB = 1024
+
+# Parsed frames take a few times the bytes of their CSV rows
+MEMORY_PER_CSV_BYTE = 4
+
+### --- Partitioning --- ###
+
+def partition_of(keys, n_partitions):
+    # Partition number per PatientPseudoKey; the same key gets the same partition in every export
+    keys = pd.to_numeric(pd.Series(keys), errors="coerce").fillna(-1).astype(np.int64).to_numpy()
+    return (pd.util.hash_array(keys) % np.uint64(n_partitions)).astype(np.int64)
+
+def partition_count(file_paths, memory_mb=DEFAULT_MEMORY_MB):
+    # Enough partitions for one partition of every export used together to fit the budget
+    total = sum(os.path.getsize(path) for path in file_paths)
+    return max(1, math.ceil(total * MEMORY_PER_CSV_BYTE / (memory_mb * 1024 * 1024)))
+
+def _rows_per_chunk(file_path, memory_mb):
+    # Chunk size from the average row length in the first 1 MB of the export
+    with open(file_path, "rb") as f:
+        sample = f.read(1 << 20)
+    row_bytes = max(len(sample) / max(sample.count(b"\n"), 1), 1)
+    return max(1000, int(memory_mb * 1024 * 1024 / (2 * MEMORY_PER_CSV_BYTE * row_bytes)))
+
+def _partitioned_fingerprint(out_dir):
+    # SHA-256 of the export a complete partitioning was written from, None otherwise
+    try:
+        with open(os.path.join(out_dir, "partitions.json"), "r", encoding="utf-8") as f:
+            return json.load(f)["sha256"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+def partition_export(file_path, n_partitions, memory_mb=DEFAULT_MEMORY_MB):
+    # Split the export into n_partitions CSV files without reading it whole; returns their paths
+    abs_path = os.path.abspath(file_path)
+    folder, name = os.path.split(abs_path)
+    stem = os.path.splitext(name)[0]
+    root = os.path.join(folder, PARTITION_DIR)
+    out_dir = os.path.join(root, f"{stem}-{n_partitions}")
+    parts = [os.path.join(out_dir, f"part-{i:04d}.csv") for i in range(n_partitions)]
+
+    fingerprint = export_fingerprint(abs_path)
+    if _partitioned_fingerprint(out_dir) == fingerprint:
+        return parts
+
+    # Partitionings of an older version of the export, for any partition count, are out of date
+    os.makedirs(root, exist_ok=True)
+    for entry in os.listdir(root):
+        if re.fullmatch(re.escape(stem) + r"-\d+", entry) and _partitioned_fingerprint(os.path.join(root, entry)) != fingerprint:
+            shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
+
+    tmp_dir = tempfile.mkdtemp(prefix=f".{stem}-{n_partitions}-", dir=root)
+    try:
+        tmp_parts = [os.path.join(tmp_dir, os.path.basename(part)) for part in parts]
+        header = pd.read_csv(abs_path, nrows=0)
+        for part in tmp_parts:
+            header.to_csv(part, index=False)
+        # Values are copied as text, so a partition parses exactly like the rows of the whole export
+        for chunk in pd.read_csv(abs_path, dtype=str, keep_default_na=False, chunksize=_rows_per_chunk(abs_path, memory_mb)):
+            partition = partition_of(chunk["PatientPseudoKey"], n_partitions)
+            for i, rows in chunk.groupby(partition, sort=False):
+                rows.to_csv(tmp_parts[i], mode="a", header=False, index=False)
+
+        # The meta file last: a folder without it is never read
+        with open(os.path.join(tmp_dir, "partitions.json"), "w", encoding="utf-8") as f:
+            json.dump({"source": abs_path, "sha256": fingerprint, "partitions": n_partitions}, f, indent=2, ensure_ascii=False)
+        try:
+            os.replace(tmp_dir, out_dir)
+        except OSError:
+            # Another process put a partitioning in place first; use it if it is for this export
+            if _partitioned_fingerprint(out_dir) != fingerprint:
+                raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return parts
+
+def each_partition(paths, memory_mb=DEFAULT_MEMORY_MB, n_partitions=None):
+    # paths: {source: export path}. Yields {source: rows of one partition}, typed by the export's schema.
+    n_partitions = n_partitions or partition_count(paths.values(), memory_mb)
+    parts = {source: partition_export(path, n_partitions, memory_mb) for source, path in paths.items()}
+    for i in range(n_partitions):
+        yield {source: read_export(parts[source][i], use_cache=False, table=table_for(path))
+               for source, path in paths.items()}
+
+def _combined(tables):
+    tables = [table for table in tables if len(table)] or tables[:1]
+    return pd.concat(tables, ignore_index=True)
+
+### --- Analyses --- ###
+
+def partitioned_daily_deaths(file_path="Øya_2_hospitalencounters.csv", memory_mb=DEFAULT_MEMORY_MB):
+    # Same output as Hospital_encounters.analyze_daily_deaths
+    deaths = [death_days({"hospital": death_rows(frames["hospital"])})
+              for frames in each_partition({"hospital": file_path}, memory_mb)]
+    return report_daily_deaths(_combined(deaths))
+
+def partitioned_daily_admissions(file_path="Øya_2_hospitalencounters.csv", memory_mb=DEFAULT_MEMORY_MB):
+    # Same output as Hospital_encounters.analyze_daily_admissions (without strata)
+    admissions = [admission_days({"hospital": admission_rows(frames["hospital"])})
+                  for frames in each_partition({"hospital": file_path}, memory_mb)]
+    return report_daily_admissions(_combined(admissions))
+
+def partitioned_encounter_summary(file_path="Øya_encounters.csv", memory_mb=DEFAULT_MEMORY_MB):
+    # Same table as Oya_encounters.analyze_encounters
+    tables, departments = [], set()
+    for frames in each_partition({"encounters": file_path}, memory_mb):
+        df = load_and_filter_encounters(None, frames["encounters"])
+        tables.append(department_patients({"encounters": df}))
+        departments.update(df["Department"].cat.categories)
+    # The export's Department categories are those of all partitions together (sorted, as read_csv does)
+    return encounter_summary(_combined(tables), pd.CategoricalDtype(sorted(departments)))
+
+def partitioned_revisit_details(file_path="Øya_encounters.csv", memory_mb=DEFAULT_MEMORY_MB):
+    # Same table as Oya_encounters.get_revisit_details
+    cols = ["PatientPseudoKey", "EncounterPseudoKey", "EncounterStart", "EncounterEnd", "LengthOfStay", "AdmittingDepartment", "AdmissionSource", "DischargeDisposition"]
+    revisits = []
+    for frames in each_partition({"encounters": file_path}, memory_mb):
+        df = remove_zero_length_stays(load_and_filter_encounters(None, frames["encounters"]))
+        revisits.append(df[df["PatientPseudoKey"].isin(get_revisiting_patients(df))][cols].astype({
+            col: object for col in cols if isinstance(df[col].dtype, pd.CategoricalDtype)}))
+    return _combined(revisits).sort_values(by=["PatientPseudoKey", "EncounterStart"]).reset_index(drop=True)
+
+def partitioned_decision_patterns(file_path="Øya_decisions.csv", min_support=0.1, memory_mb=DEFAULT_MEMORY_MB):
+    # Same itemsets as Oya_Decition_Filtering.analyze_decision_patterns. Only each patient's
+    # distinct templates are combined, FP-Growth runs once over all of them.
+    pairs = []
+    for frames in each_partition({"decisions": file_path}, memory_mb):
+        df = VALID_DECISIONS.apply(frames["decisions"])
+        pairs.append(df[["PatientPseudoKey", "DecisionTemplate"]].drop_duplicates())
+    return frequent_itemsets(encode_transactions(_combined(pairs)), min_support)
+
+def partitioned_adl_development_matrix(
+    adl_path="Øya_2_ADL.csv",
+    hospital_path="Øya_2_hospitalencounters.csv",
+    decisions_path="Øya_decisions.csv",
+    measurement_name="R HP COCM IPLOS/ADL TOTAL VANLIG GJENNOMSNITT",
+    window_days=30,
+    binning=None,
+    memory_mb=DEFAULT_MEMORY_MB,
+):
+    # Same output as CFS_Outcomes.analyze_adl_development_matrix, in two passes: the bin edges
+    # need every value of the measurement (one float column), the pairs are found per partition.
+    paths = {"hospital": hospital_path, "adl": adl_path, "decisions": decisions_path}
+    n_partitions = partition_count(paths.values(), memory_mb)
+    values = [clean_adl_measurements(frames["adl"], measurement_name)[measurement_name]["Value"]
+              for frames in each_partition({"adl": adl_path}, memory_mb, n_partitions)]
+    spec = resolve_bin_spec(binning, pd.concat(values, ignore_index=True), measurement_name)
+
+    pairs = []
+    for frames in each_partition(paths, memory_mb, n_partitions):
+        adl_df = apply_bins(clean_adl_measurements(frames["adl"], measurement_name)[measurement_name], spec, label_col=None)
+        pairs.append(transition_pairs({"hospital": transition_stays(frames["hospital"]), "adl": adl_df,
+                                       "decisions": frames["decisions"]}, window_days))
+    return report_transition_pairs(_combined(pairs), n_bins_of(spec))
+
+
+if __name__ == "__main__":
+    partitioned_daily_deaths()
+    partitioned_daily_admissions()
+    print(partitioned_encounter_summary())
+    partitioned_adl_development_matrix()
@@ -0,0 +1,433 @@
+import math
+import os
+from collections import Counter
+from itertools import combinations
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# Frequent itemset mining over decision templates without a dense patient x template table.
+# The rows are encoded straight from their codes into a sparse patient x item matrix (one entry
+# per patient and template), and patients with the same set of templates are mined as one
+# transaction with a count. The itemsets and supports are the ones mlxtend's fpgrowth finds on
+# the TransactionEncoder table (whose fpgrowth densifies even a sparse DataFrame).
+# Encodings of an export are kept in-process until the export changes, and a support sweep mines
+# once at its lowest support; the tables for the higher supports are filtered from that one.
+# Association rules are derived from an itemset table through a hashed support index, one
+# antecedent/consequent split at a time for all itemsets of a size, so only the rules that pass
+# the confidence/lift/leverage filters are ever turned into frozensets.
+# Sequential patterns keep the order the sets throw away: each patient's decisions ordered by date
+# are held as flat code and time arrays, and patterns grow one step at a time over projections that
+# only point into them (patient, positions where the pattern can end), patient by patient, with
+# templates too rare to be in any frequent sequence pruned first (PrefixSpan). An optional maximum
+# gap limits the days between consecutive steps.
+# For exports that grow every day the itemset counts above a support floor can be maintained
+# instead of re-mined: only the transactions of added or changed patients are counted, and
+# itemsets that newly reach the floor are found among the added transactions alone (FUP).
+
+### --- Encoding --- ###
+
+_encodings = {}  # (selection, abs path, encoder) -> (size, mtime_ns, encoding)
+
+def encode_transactions(df, item_col="DecisionTemplate", by="PatientPseudoKey"):
+    # {"matrix": scipy CSR (patients x items, True where the patient has the item),
+    #  "items": item names, sorted like TransactionEncoder.columns_, "patients": keys of the rows}
+    # Rows without a key or an item are left out.
+    rows = df[[by, item_col]].dropna()
+    patient_codes, patients = pd.factorize(rows[by].to_numpy(), sort=True)
+    values = rows[item_col]
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.astype("category")
+    values = values.cat.remove_unused_categories()
+    items = sorted(values.cat.categories)
+    item_codes = values.cat.reorder_categories(items).cat.codes.to_numpy().astype(np.int64)
+
+    # Each (patient, item) once, however many rows the patient has with the item
+    width = max(len(items), 1)
+    cells = np.sort(pd.unique(patient_codes.astype(np.int64) * width + item_codes))
+    matrix = sparse.csr_matrix((np.ones(len(cells), dtype=bool), (cells // width, cells % width)),
+                               shape=(len(patients), len(items)))
+    return {"matrix": matrix, "items": items, "patients": patients}
+
+def cached_encoding(name, file_path, load, encode=encode_transactions):
+    # encode(load()) for the selection `name` of the export at file_path, reused until the
+    # export's size or mtime changes, like the parsed exports in Oya_loader
+    abs_path = os.path.abspath(file_path)
+    stat = os.stat(abs_path)
+    key = (name, abs_path, encode.__name__)
+    cached = _encodings.get(key)
+    if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+        return cached[2]
+    encoded = encode(load())
+    _encodings[key] = (stat.st_size, stat.st_mtime_ns, encoded)
+    return encoded
+
+def clear_encodings(file_path=None):
+    # Drop cached encodings (all, or only those of one export)
+    if file_path is None:
+        _encodings.clear()
+        return
+    abs_path = os.path.abspath(file_path)
+    for key in [key for key in _encodings if key[1] == abs_path]:
+        del _encodings[key]
+
+def transaction_counts(encoded):
+    # {item positions of a patient (sorted tuple): patients with exactly those items}. Rows are
+    # counted by their bytes, only the distinct ones are turned into tuples.
+    matrix = encoded["matrix"]
+    data = matrix.indices.astype(np.int32).tobytes()
+    bounds = (matrix.indptr * 4).tolist()
+    rows = Counter(data[start:stop] for start, stop in zip(bounds[:-1], bounds[1:]))
+    return Counter({tuple(np.frombuffer(row, dtype=np.int32).tolist()): n for row, n in rows.items()})
+
+### --- Mining --- ###
+
+def _grow(transactions, is_frequent, prefix, found):
+    # Pattern growth: every frequent item extends prefix, and the transactions containing it (only
+    # their later frequent items) are mined for longer itemsets. All projections are built in one
+    # pass over the transactions.
+    counts = Counter()
+    for items, n in transactions.items():
+        for item in items:
+            counts[item] += n
+    frequent = {item for item, count in counts.items() if is_frequent(count)}
+    projected = {item: Counter() for item in frequent}
+    for items, n in transactions.items():
+        kept = [item for item in items if item in frequent]
+        for position in range(len(kept) - 1):
+            projected[kept[position]][tuple(kept[position + 1:])] += n
+    for item in sorted(frequent):
+        itemset = prefix + (item,)
+        found[frozenset(itemset)] = counts[item]
+        if projected[item]:
+            _grow(projected[item], is_frequent, itemset, found)
+
+def min_count(n_transactions, min_support):
+    # Smallest count with count / n_transactions >= min_support
+    count = max(math.ceil(min_support * n_transactions), 0)
+    while count > 0 and (count - 1) / n_transactions >= min_support:
+        count -= 1
+    while count / n_transactions < min_support:
+        count += 1
+    return count
+
+def mine_counts(transactions, n_transactions, min_support):
+    # {frozenset of item positions: transactions containing it} for every itemset with
+    # count / n_transactions >= min_support (the comparison mlxtend makes)
+    found = {}
+    if n_transactions:
+        _grow(transactions, lambda count: count / n_transactions >= min_support, (), found)
+    return found
+
+def mine_at_count(transactions, count):
+    # {frozenset of items: transactions containing it} for every itemset in at least count transactions
+    found = {}
+    _grow(transactions, lambda n: n >= count, (), found)
+    return found
+
+def itemsets_table(found, items, n_transactions):
+    # The mined counts as mlxtend's table: support, itemsets (frozensets of names), itemset_size,
+    # sorted by support (ties: smaller itemsets first, then by name)
+    # The number of transactions is kept in table.attrs, so rules can be computed from whole counts
+    rows = sorted(((count / n_transactions, sorted(items[i] for i in itemset)) for itemset, count in found.items()),
+                  key=lambda row: (-row[0], len(row[1]), row[1]))
+    table = pd.DataFrame({
+        "support": [support for support, _ in rows],
+        "itemsets": [frozenset(names) for _, names in rows],
+        "itemset_size": [len(names) for _, names in rows],
+    }, columns=["support", "itemsets", "itemset_size"])
+    table.attrs["n_transactions"] = n_transactions
+    return table
+
+def frequent_itemsets(encoded, min_support=0.1):
+    # Same itemsets and supports as fpgrowth(TransactionEncoder table, min_support, use_colnames=True)
+    n_transactions = encoded["matrix"].shape[0]
+    found = mine_counts(transaction_counts(encoded), n_transactions, min_support)
+    return itemsets_table(found, encoded["items"], n_transactions)
+
+def support_sweep(encoded, supports):
+    # {min_support: frequent_itemsets(encoded, min_support)} for every support, mined once at the lowest
+    supports = sorted(set(supports))
+    if not supports:
+        return {}
+    table = frequent_itemsets(encoded, supports[0])
+    return {support: table[table["support"] >= support].reset_index(drop=True) for support in supports}
+
+### --- Association Rules --- ###
+
+RULE_COLUMNS = ["antecedents", "consequents", "antecedent support", "consequent support", "support",
+                "confidence", "lift", "leverage", "conviction"]
+
+def support_index(itemsets):
+    # Hashed index of an itemset table, {sorted tuple of item positions: support}, and the item names
+    names = sorted(set().union(*itemsets["itemsets"])) if len(itemsets) else []
+    position = {name: i for i, name in enumerate(names)}
+    index = {tuple(sorted(position[name] for name in itemset)): support
+             for itemset, support in zip(itemsets["itemsets"], itemsets["support"])}
+    return index, names
+
+def _supports(index, keys):
+    # Index value (support or count) of every row of keys (n x k item positions); each must be in the index
+    try:
+        return np.array([index[key] for key in map(tuple, keys.tolist())], dtype=float)
+    except KeyError as missing:
+        raise ValueError(f"Itemset {missing} is not in the itemset table; rules need the full "
+                         "frequent_itemsets output (every subset of a frequent itemset)") from None
+
+def association_rules(itemsets, min_confidence=0.5, min_lift=None, min_leverage=None):
+    # Rules antecedents -> consequents from every split of a frequent itemset in two, with
+    # mlxtend's metrics, kept when they pass every given threshold; sorted by lift, then confidence.
+    # Tables from frequent_itemsets carry their number of transactions, and the metrics are then
+    # ratios of whole counts, so e.g. 36 of 45 patients is exactly a confidence of 0.8.
+    index, names = support_index(itemsets)
+    n = itemsets.attrs.get("n_transactions")
+    if n:
+        index = {key: round(support * n) for key, support in index.items()}
+    else:
+        n = 1  # Supports as they are
+    by_size = {}
+    for key in sorted(index):
+        by_size.setdefault(len(key), []).append(key)
+
+    parts = []
+    for size, keys in sorted(by_size.items()):
+        if size < 2:
+            continue
+        members = np.array(keys, dtype=np.int64)  # One itemset per row, positions sorted
+        both = _supports(index, members)
+        for n_antecedent in range(1, size):
+            for chosen in combinations(range(size), n_antecedent):
+                rest = [col for col in range(size) if col not in chosen]
+                antecedents, consequents = members[:, list(chosen)], members[:, rest]
+                antecedent = _supports(index, antecedents)
+                consequent = _supports(index, consequents)
+                confidence = both / antecedent
+                lift = both * n / (antecedent * consequent)
+                leverage = (both * n - antecedent * consequent) / (n * n)
+                keep = confidence >= min_confidence
+                if min_lift is not None:
+                    keep &= lift >= min_lift
+                if min_leverage is not None:
+                    keep &= leverage >= min_leverage
+                if keep.any():
+                    parts.append((antecedents[keep], consequents[keep], antecedent[keep] / n, consequent[keep] / n,
+                                  both[keep] / n, confidence[keep], lift[keep], leverage[keep]))
+
+    if not parts:
+        return pd.DataFrame(columns=RULE_COLUMNS)
+    columns = {}
+    columns["antecedents"] = [frozenset(names[i] for i in row) for part in parts for row in part[0].tolist()]
+    columns["consequents"] = [frozenset(names[i] for i in row) for part in parts for row in part[1].tolist()]
+    for name, values in zip(RULE_COLUMNS[2:8], zip(*[part[2:] for part in parts])):
+        columns[name] = np.concatenate(values)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        columns["conviction"] = np.where(columns["confidence"] < 1,
+                                         (1 - columns["consequent support"]) / (1 - columns["confidence"]), np.inf)
+    rules = pd.DataFrame(columns, columns=RULE_COLUMNS)
+    return rules.sort_values(["lift", "confidence"], ascending=False, kind="stable").reset_index(drop=True)
+
+def readable_rules(rules):
+    # Rules with the item sets written out ("A, B"), for spreadsheets
+    return rules.assign(**{col: rules[col].map(lambda items: ", ".join(sorted(items))) for col in ["antecedents", "consequents"]})
+
+### --- Sequential Patterns --- ###
+
+DAY_NS = 24 * 60 * 60 * 10 ** 9
+
+def encode_sequences(df, item_col="DecisionTemplate", by="PatientPseudoKey", time_col="DecisionValidDate",
+                     collapse_repeats=True):
+    # {"codes": item position of every event, "times": its time in ns, "offsets": first event of each
+    #  patient (and the end), "items": item names, "patients": keys}. Events are ordered by time per
+    # patient (same time: row order); rows without a key, item or time are left out. collapse_repeats
+    # keeps only the first of consecutive events with the same item (e.g. a renewed decision).
+    rows = df[[by, item_col, time_col]].dropna()
+    patient_codes, patients = pd.factorize(rows[by].to_numpy(), sort=True)
+    values = rows[item_col]
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.astype("category")
+    values = values.cat.remove_unused_categories()
+    items = sorted(values.cat.categories)
+    codes = values.cat.reorder_categories(items).cat.codes.to_numpy().astype(np.int64)
+    times = pd.to_datetime(rows[time_col]).to_numpy().astype("datetime64[ns]").astype(np.int64)
+
+    order = np.lexsort((np.arange(len(rows)), times, patient_codes))
+    patient_codes, codes, times = patient_codes[order], codes[order], times[order]
+    if collapse_repeats and len(codes):
+        keep = np.ones(len(codes), dtype=bool)
+        keep[1:] = (patient_codes[1:] != patient_codes[:-1]) | (codes[1:] != codes[:-1])
+        patient_codes, codes, times = patient_codes[keep], codes[keep], times[keep]
+    offsets = np.searchsorted(patient_codes, np.arange(len(patients) + 1))
+    return {"codes": codes, "times": times, "offsets": offsets, "items": items, "patients": patients}
+
+def _ranges(starts, lengths):
+    # np.arange(start, start + length) for every start, concatenated
+    total = np.cumsum(lengths)
+    return np.repeat(starts - (total - lengths), lengths) + np.arange(total[-1] if len(total) else 0)
+
+def _split_by_item(codes, patient_of, n_patients, positions, gaps, is_frequent, once_per_patient):
+    # {item: (positions, gaps)} of the items at positions (ascending) that enough patients have;
+    # once_per_patient: no patient has an item at more than one of the positions
+    items = codes[positions]
+    if not once_per_patient:
+        items_of_patients = np.unique(items * n_patients + patient_of[positions]) // n_patients
+    counts = np.bincount(items if once_per_patient else items_of_patients)
+    frequent = [item for item, count in enumerate(counts.tolist()) if count and is_frequent(count)]
+    order = np.argsort(items, kind="stable")
+    starts, stops = np.searchsorted(items[order], frequent, "left"), np.searchsorted(items[order], frequent, "right")
+    return {item: (positions[order[start:stop]], gaps[order[start:stop]]) for item, start, stop in zip(frequent, starts, stops)}
+
+def _first_per_patient(codes, patient_of, width, positions):
+    # The first of positions (ascending) with each item for every patient
+    return positions[~pd.Series(patient_of[positions] * width + codes[positions]).duplicated().to_numpy()]
+
+def _next_steps(codes, times, patient_of, stops, width, ends, gaps, max_gap, is_frequent):
+    # One-step extensions of a pattern that can end at the (ascending) positions ends. The events
+    # after each patient's first end are scanned together; a step is measured from the latest end
+    # before it, whose gaps are carried over. Without a maximum gap only the first occurrence of
+    # each item per patient is kept (it leaves the most room for later steps).
+    first = ends[np.r_[True, patient_of[ends[1:]] != patient_of[ends[:-1]]]]
+    positions = _ranges(first + 1, stops[patient_of[first]] - first - 1)
+    if max_gap is None:
+        positions = _first_per_patient(codes, patient_of, width, positions)
+    previous = np.searchsorted(ends, positions) - 1  # Always an end of the same patient
+    gap = times[positions] - times[ends[previous]]
+    if max_gap is not None:
+        within = gap <= max_gap
+        positions, previous, gap = positions[within], previous[within], gap[within]
+    return _split_by_item(codes, patient_of, len(stops), positions, np.column_stack([gaps[previous], gap]), is_frequent,
+                          max_gap is None)
+
+def mine_sequences(encoded, min_support=0.1, max_gap_days=None, max_length=None):
+    # {item positions (tuple): (patients, median days of each step)} for every sequence contained in
+    # at least min_support of the patients (count / patients >= min_support), with at most
+    # max_gap_days between consecutive steps and at most max_length steps. The days are those of
+    # each patient's first occurrence of the sequence.
+    codes, times, offsets = encoded["codes"], encoded["times"], encoded["offsets"]
+    n_patients = len(offsets) - 1
+    found = {}
+    if not len(codes):
+        return found
+
+    def is_frequent(count):
+        return count / n_patients >= min_support
+
+    # Events of templates too rare for any frequent sequence are dropped before mining
+    patient_of = np.repeat(np.arange(n_patients), np.diff(offsets))
+    width = codes.max() + 1
+    items, counts = np.unique(np.unique(patient_of * width + codes) % width, return_counts=True)
+    keep = np.isin(codes, [item for item, count in zip(items, counts) if is_frequent(count)])
+    codes, times, patient_of = codes[keep], times[keep], patient_of[keep]
+    stops = np.searchsorted(patient_of, np.arange(1, n_patients + 1))
+    max_gap = None if max_gap_days is None else max_gap_days * DAY_NS
+
+    def grow(prefix, children):
+        for item, (ends, gaps) in sorted(children.items()):
+            pattern = prefix + (item,)
+            first = np.r_[True, patient_of[ends[1:]] != patient_of[ends[:-1]]]
+            found[pattern] = (int(first.sum()), tuple(np.median(gaps[first], axis=0) / DAY_NS) if gaps.shape[1] else ())
+            if max_length is None or len(pattern) < max_length:
+                grow(pattern, _next_steps(codes, times, patient_of, stops, width, ends, gaps, max_gap, is_frequent))
+
+    positions = np.arange(len(codes))
+    if max_gap is None:
+        positions = _first_per_patient(codes, patient_of, width, positions)
+    grow((), _split_by_item(codes, patient_of, n_patients, positions, np.zeros((len(positions), 0), dtype=np.int64), is_frequent,
+                            max_gap is None))
+    return found
+
+def sequences_table(found, items, n_patients):
+    # One row per sequence: the templates in order, its length, support, patients and the median
+    # days of each step; sorted by support (ties: shorter sequences first, then by name)
+    rows = [(tuple(items[i] for i in pattern), count, tuple(round(float(days), 1) for days in step_days))
+            for pattern, (count, step_days) in found.items()]
+    rows.sort(key=lambda row: (-row[1], len(row[0]), row[0]))
+    return pd.DataFrame({
+        "sequence": [sequence for sequence, _, _ in rows],
+        "length": [len(sequence) for sequence, _, _ in rows],
+        "support": [count / n_patients for _, count, _ in rows],
+        "patients": [count for _, count, _ in rows],
+        "median_days": [days for _, _, days in rows],
+    }, columns=["sequence", "length", "support", "patients", "median_days"])
+
+def frequent_sequences(encoded, min_support=0.1, max_gap_days=None, max_length=None):
+    n_patients = len(encoded["offsets"]) - 1
+    return sequences_table(mine_sequences(encoded, min_support, max_gap_days, max_length), encoded["items"], n_patients)
+
+### --- Maintained Itemsets --- ###
+
+def containment_counter(transactions):
+    # Function itemsets (list of frozensets) -> transactions ({sorted tuple of items: count}) that
+    # contain each itemset. The distinct transactions x items table is built once, column by column
+    # (there are far fewer distinct transactions than patients). Itemsets with an item no
+    # transaction has are in none.
+    names = sorted(set().union(*transactions)) if transactions else []
+    position = {name: i for i, name in enumerate(names)}
+    keys = list(transactions)
+    weights = np.array([transactions[key] for key in keys], dtype=np.int64)
+    rows = np.repeat(np.arange(len(keys)), [len(items) for items in keys])
+    cols = np.fromiter((position[name] for items in keys for name in items), dtype=np.int64, count=len(rows))
+    table = np.zeros((len(keys), len(names)), dtype=bool, order="F")
+    table[rows, cols] = True
+
+    def count(itemsets):
+        return np.array([weights[table[:, [position[name] for name in itemset]].all(axis=1)].sum()
+                         if all(name in position for name in itemset) else 0 for itemset in itemsets], dtype=np.int64)
+    return count
+
+def contained_counts(transactions, itemsets):
+    # Transactions ({sorted tuple of items: count}) containing each itemset (list of frozensets)
+    return containment_counter(transactions)(itemsets)
+
+def maintain_itemsets(itemsets, old_transactions, new_transactions, support_floor):
+    # Itemset counts at support_floor after the transactions changed from old to new
+    # ({sorted tuple of items: count} each); itemsets: the counts at the floor for old_transactions.
+    # Returns (counts for new_transactions, number of itemsets counted from scratch).
+    n_old, n_new = sum(old_transactions.values()), sum(new_transactions.values())
+    if not n_new:
+        return {}, 0
+    threshold = min_count(n_new, support_floor)
+    # An itemset below the old floor was in at most min_count(old) - 1 transactions, so it reaches
+    # the new floor only if the added transactions hold it at least `needed` times
+    needed = threshold - (min_count(n_old, support_floor) - 1 if n_old else 0)
+    if needed <= 0:
+        # The floor went down (e.g. patients left the export): mine the transaction counts again
+        found = mine_at_count(new_transactions, threshold)
+        return found, len(found)
+
+    delta = Counter(new_transactions)
+    delta.subtract(old_transactions)
+    added = Counter({items: n for items, n in delta.items() if n > 0})
+    removed = Counter({items: -n for items, n in delta.items() if n < 0})
+
+    # Every maintained itemset changes by what the added and removed transactions hold of it
+    current = list(itemsets)
+    counts = (np.array([itemsets[itemset] for itemset in current], dtype=np.int64)
+              + contained_counts(added, current) - contained_counts(removed, current))
+    updated = {itemset: int(count) for itemset, count in zip(current, counts) if count >= threshold}
+
+    # Candidates are counted size by size, and only when every subset one item smaller is
+    # frequent now (no frequent itemset has an infrequent subset)
+    by_size = {}
+    for itemset in mine_at_count(added, needed):
+        if itemset not in itemsets:
+            by_size.setdefault(len(itemset), []).append(itemset)
+    count, counted = None, 0
+    for size in sorted(by_size):
+        candidates = [itemset for itemset in by_size[size]
+                      if size == 1 or all(itemset - {item} in updated for item in itemset)]
+        if not candidates:
+            continue
+        count = count or containment_counter(new_transactions)
+        counted += len(candidates)
+        for itemset, n in zip(candidates, count(candidates)):
+            if n >= threshold:
+                updated[itemset] = int(n)
+    return updated, counted
+
+def maintained_table(itemsets, n_transactions, min_support):
+    # The maintained counts as frequent_itemsets' table, for a support at or above the floor
+    found = {itemset: count for itemset, count in itemsets.items() if n_transactions and count / n_transactions >= min_support}
+    names = sorted(set().union(*found)) if found else []
+    position = {name: i for i, name in enumerate(names)}
+    return itemsets_table({frozenset(position[name] for name in itemset): count for itemset, count in found.items()},
+                          names, n_transactions)
@@ -0,0 +1,307 @@
+import inspect
+import io
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import CFS_Outcomes as cfs
+import Hospital_encounters as hospital
+import Oya_Decition_Filtering as decisions
+import Oya_encounters as encounters
+from Oya_adl import ALL_MEASUREMENTS, is_single_measurement, load_adl_measurements
+from Oya_joins import build_decision_index
+from Oya_loader import read_export
+from Oya_results import DEFAULT_BUDGET_MB, PLOTTING, is_cacheable, lookup, result_key, store
+
+DEFAULT_PATHS = {
+    "encounters_path": "Øya_encounters.csv",
+    "hospital_path": "Øya_2_hospitalencounters.csv",
+    "adl_path": "Øya_2_ADL.csv",
+    "cfs_path": "Øya_CFS.csv",
+    "decisions_path": "Øya_decisions.csv",
+}
+
+### --- Stages --- ###
+
+def _export_without_test_patient(path_key):
+    # Typed export (timestamps parsed by the loader schema) without the test patient
+    def stage(config):
+        df = read_export(config[path_key])
+        return df[df["PatientPseudoKey"] != 2384]
+    return stage
+
+def _sykehus_encounters(config, encounters_export):
+    return encounters.load_and_filter_encounters(config["encounters_path"], encounters_export)
+
+def _home_admissions(config, hospital_export):
+    return hospital_export[hospital_export["AdmissionSource"] == "Bosted/arbeidsted"]
+
+def _decision_index(config, decisions_export):
+    return build_decision_index(decisions_export)
+
+def _adl(config):
+    return load_adl_measurements(config["adl_path"], ALL_MEASUREMENTS)
+
+# Stage name -> (function(config, *inputs), input stage names)
+STAGES = {
+    "encounters_export": (_export_without_test_patient("encounters_path"), []),
+    "hospital_export": (_export_without_test_patient("hospital_path"), []),
+    "cfs_export": (_export_without_test_patient("cfs_path"), []),
+    "decisions_export": (_export_without_test_patient("decisions_path"), []),
+    "encounters": (_sykehus_encounters, ["encounters_export"]),
+    "hospital_home": (_home_admissions, ["hospital_export"]),
+    "decision_index": (_decision_index, ["decisions_export"]),
+    "adl": (_adl, []),
+}
+
+# Stage name -> path of the export it reads, for the result cache keys
+STAGE_SOURCES = {
+    "encounters_export": "encounters_path",
+    "hospital_export": "hospital_path",
+    "cfs_export": "cfs_path",
+    "decisions_export": "decisions_path",
+    "adl": "adl_path",
+}
+
+### --- Analyses --- ###
+
+# Analysis name -> (function, {keyword argument: stage})
+ANALYSES = {
+    # Oya_encounters.py
+    "analyze_encounters": (encounters.analyze_encounters, {"encounters_df": "encounters"}),
+    "analyze_dispositions_by_service": (encounters.analyze_dispositions_by_service, {"encounters_df": "encounters"}),
+    "count_admissions_by_source": (encounters.count_admissions_by_source, {"encounters_df": "encounters"}),
+    "get_revisit_details": (encounters.get_revisit_details, {"encounters_df": "encounters"}),
+    "count_revisits": (encounters.count_revisits, {"encounters_df": "encounters"}),
+    "count_last_dispositions_from_revisit_list": (encounters.count_last_dispositions_from_revisit_list, {"encounters_df": "encounters"}),
+    "inflow_analysis": (encounters.inflow_analysis, {"encounters_df": "encounters"}),
+    "flow_visualization": (encounters.flow_visualization, {"encounters_df": "encounters"}),
+    "flow_visualization_simplified_with_colors": (encounters.flow_visualization_simplified_with_colors, {"encounters_df": "encounters"}),
+    "one_unit_visualization": (encounters.one_unit_visualization, {"encounters_df": "encounters"}),
+    # Hospital_encounters.py
+    "analyze_daily_deaths": (hospital.analyze_daily_deaths, {"hospital_df": "hospital_export"}),
+    "analyze_daily_admissions": (hospital.analyze_daily_admissions, {"hospital_df": "hospital_home"}),
+    "count_unique_patients": (hospital.count_unique_patients, {"hospital_df": "hospital_export"}),
+    "analyze_daily_admissions_byCFS": (hospital.analyze_daily_admissions_byCFS, {
+        "hospital_df": "hospital_home", "encounters_df": "encounters_export", "adl_frames": "adl", "decision_index": "decision_index"}),
+    "analyze_initial_adl_distribution": (hospital.analyze_initial_adl_distribution, {"adl_frames": "adl"}),
+    # CFS_Outcomes.py
+    "analyze_cfs_outcomes": (cfs.analyze_cfs_outcomes, {"cfs_df": "cfs_export", "encounters_df": "encounters"}),
+    "analyze_cfs_destinations_by_intervals": (cfs.analyze_cfs_destinations_by_intervals, {"cfs_df": "cfs_export", "encounters_df": "encounters"}),
+    "plot_cfs_vs_adl": (cfs.plot_cfs_vs_adl, {"cfs_df": "cfs_export", "adl_frames": "adl", "encounters_df": "encounters"}),
+    "analyze_adl_outcomes_by_decile": (cfs.analyze_adl_outcomes_by_decile, {
+        "adl_frames": "adl", "encounters_df": "encounters", "decisions_df": "decisions_export"}),
+    "analyze_hospital_outcomes_by_decile": (cfs.analyze_hospital_outcomes_by_decile, {
+        "adl_frames": "adl", "hospital_df": "hospital_home", "decision_index": "decision_index"}),
+    "analyze_adl_development_matrix": (cfs.analyze_adl_development_matrix, {
+        "adl_frames": "adl", "hospital_df": "hospital_home", "decision_index": "decision_index"}),
+    "bootstrap_adl_development_matrix": (cfs.bootstrap_adl_development_matrix, {
+        "adl_frames": "adl", "hospital_df": "hospital_home", "decision_index": "decision_index"}),
+    # Oya_Decition_Filtering.py
+    "load_and_filter_decisions": (decisions.load_and_filter_decisions, {"decisions_df": "decisions_export"}),
+    "analyze_decision_patterns": (decisions.analyze_decision_patterns, {"decisions_df": "decisions_export"}),
+    "analyze_all_templates_for_valid_patients": (decisions.analyze_all_templates_for_valid_patients, {"decisions_df": "decisions_export"}),
+    "decision_pattern_sweep": (decisions.decision_pattern_sweep, {"decisions_df": "decisions_export"}),
+    "analyze_decision_rules": (decisions.analyze_decision_rules, {"decisions_df": "decisions_export"}),
+    "analyze_decision_sequences": (decisions.analyze_decision_sequences, {"decisions_df": "decisions_export"}),
+    "analyze_outcomes_for_longterm_decision": (decisions.analyze_outcomes_for_longterm_decision, {
+        "decisions_df": "decisions_export", "encounters_df": "encounters"}),
+}
+
+# Analyses that bin a single ADL measurement; a list or "all" falls back to their own default
+SINGLE_MEASUREMENT = {"analyze_daily_admissions_byCFS", "analyze_adl_development_matrix", "bootstrap_adl_development_matrix"}
+
+### --- Per-thread Output --- ###
+
+_output = threading.local()
+
+class _ThreadStdout(io.TextIOBase):
+    # Sends print() from pipeline threads to that thread's buffer, everything else to the real stdout
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        buffer = getattr(_output, "buffer", None)
+        return (buffer if buffer is not None else self.stream).write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+### --- Runner --- ###
+
+def _stages_for(analysis_names):
+    # Every stage the analyses depend on, directly or through other stages
+    needed, todo = set(), [stage for name in analysis_names for stage in ANALYSES[name][1].values()]
+    while todo:
+        stage = todo.pop()
+        if stage not in needed:
+            needed.add(stage)
+            todo.extend(STAGES[stage][1])
+    return needed
+
+def analysis_params(name, params):
+    # The parameters the analysis' signature accepts
+    accepted = inspect.signature(ANALYSES[name][0]).parameters
+    kwargs = {key: value for key, value in params.items() if key in accepted}
+    if name in SINGLE_MEASUREMENT and not is_single_measurement(kwargs.get("measurement_name", "")):
+        kwargs.pop("measurement_name")
+    return kwargs
+
+def analysis_kwargs(name, stage_results, params, config):
+    # Stage outputs for the analysis, plus the export paths and parameters its signature accepts
+    # (an analysis that reads an export itself then reads the configured one)
+    accepted = inspect.signature(ANALYSES[name][0]).parameters
+    kwargs = {key: config[key] for key in DEFAULT_PATHS if key in accepted}
+    kwargs.update(analysis_params(name, params))
+    kwargs.update({arg: stage_results[stage] for arg, stage in ANALYSES[name][1].items()})
+    return kwargs
+
+def analysis_key(name, config, params):
+    # Result cache key: the analysis, its parameters and the exports behind its stages,
+    # or None when the result must not be cached
+    func = ANALYSES[name][0]
+    kwargs = analysis_params(name, params)
+    if not is_cacheable(func, kwargs):
+        return None
+    sources = sorted({config[STAGE_SOURCES[stage]] for stage in _stages_for([name]) if stage in STAGE_SOURCES})
+    return result_key(f"{func.__module__}.{func.__qualname__}", kwargs, sources)
+
+def _timed(func, *args, **kwargs):
+    _output.buffer = io.StringIO()
+    start = time.perf_counter()
+    try:
+        return func(*args, **kwargs), None, time.perf_counter() - start, _output.buffer.getvalue()
+    except Exception as exc:
+        return None, exc, time.perf_counter() - start, _output.buffer.getvalue()
+    finally:
+        _output.buffer = None
+
+def run_pipeline(analyses=None, params=None, workers=None, verbose=True, show_timings=None, stage_cache=None,
+                 result_cache=None, cache_budget_mb=DEFAULT_BUDGET_MB, **paths):
+    # Run analyses (default: all) over shared stages. Each stage is computed once, as soon as its
+    # inputs are ready; analyses start as soon as their stages are ready and run side by side.
+    #   params:       keyword arguments handed to every analysis that accepts them,
+    #                 e.g. {"measurement_name": "ADL", "min_support": 0.05}
+    #   stage_cache:  dict that keeps stage outputs between calls with the same paths
+    #   result_cache: folder for the on-disk result cache (see Oya_results.py), e.g. ".oya_results";
+    #                 analyses found there are not run again and their stages are not computed
+    #   cache_budget_mb: size budget of that folder, least recently used results are evicted
+    #   paths:        encounters_path=, hospital_path=, adl_path=, cfs_path=, decisions_path=
+    # Returns ({analysis: result}, {stage or analysis: seconds}). Failed analyses are reported
+    # and left out of the results.
+    analysis_names = list(analyses) if analyses is not None else list(ANALYSES)
+    unknown = [name for name in analysis_names if name not in ANALYSES]
+    if unknown:
+        raise ValueError(f"Unknown analyses: {', '.join(unknown)}")
+    config = {**DEFAULT_PATHS, **paths}
+    params = params or {}
+
+    stage_results = stage_cache if stage_cache is not None else {}
+    results, timings, failed = {}, {}, {}
+    pending_analyses = [name for name in analysis_names if name not in PLOTTING]
+
+    def report(name, seconds, output, error):
+        timings[name] = seconds
+        if not verbose:
+            return
+        if output:
+            print(f"\n### --- {name} --- ###")
+            print(output, end="")
+        if error is not None:
+            print(f"❌ {name} failed after {seconds:.2f} s: {error!r}")
+
+    cache_keys = {}
+    if result_cache is not None:
+        for name in list(pending_analyses):
+            start = time.perf_counter()
+            key = analysis_key(name, config, params)
+            if key is None:
+                continue
+            hit, result, output = lookup(key, result_cache)
+            if hit:
+                report(name, time.perf_counter() - start, output, None)
+                results[name] = result
+                pending_analyses.remove(name)
+            else:
+                cache_keys[name] = key
+    needed = [name for name in analysis_names if name in PLOTTING or name in pending_analyses]
+    pending_stages = _stages_for(needed) - set(stage_results)
+
+    real_stdout = sys.stdout
+    sys.stdout = _ThreadStdout(real_stdout)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            running = {}
+            while pending_stages or pending_analyses or running:
+                for stage in sorted(pending_stages):
+                    func, inputs = STAGES[stage]
+                    if any(dep in failed for dep in inputs):
+                        failed[stage] = failed[next(dep for dep in inputs if dep in failed)]
+                        pending_stages.discard(stage)
+                    elif all(dep in stage_results for dep in inputs):
+                        running[pool.submit(_timed, func, config, *(stage_results[dep] for dep in inputs))] = ("stage", stage)
+                        pending_stages.discard(stage)
+                for name in list(pending_analyses):
+                    stages = ANALYSES[name][1].values()
+                    if any(stage in failed for stage in stages):
+                        failed[name] = next(failed[stage] for stage in stages if stage in failed)
+                        report(name, 0.0, "", failed[name])
+                        pending_analyses.remove(name)
+                    elif all(stage in stage_results for stage in stages):
+                        kwargs = analysis_kwargs(name, stage_results, params, config)
+                        running[pool.submit(_timed, ANALYSES[name][0], **kwargs)] = ("analysis", name)
+                        pending_analyses.remove(name)
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind, name = running.pop(future)
+                    result, error, seconds, output = future.result()
+                    if kind == "stage":
+                        timings[name] = seconds
+                        if error is None:
+                            stage_results[name] = result
+                        else:
+                            failed[name] = error
+                    else:
+                        report(name, seconds, output, error)
+                        if error is None:
+                            results[name] = result
+                            if name in cache_keys:
+                                store(cache_keys[name], result, output, name=name,
+                                      cache_dir=result_cache, budget_mb=cache_budget_mb)
+                        else:
+                            failed[name] = error
+    finally:
+        sys.stdout = real_stdout
+
+    # Figures on the main thread
+    for name in analysis_names:
+        if name not in PLOTTING:
+            continue
+        stages = ANALYSES[name][1].values()
+        if any(stage in failed for stage in stages):
+            failed[name] = next(failed[stage] for stage in stages if stage in failed)
+            report(name, 0.0, "", failed[name])
+            continue
+        start = time.perf_counter()
+        try:
+            results[name] = ANALYSES[name][0](**analysis_kwargs(name, stage_results, params, config))
+            report(name, time.perf_counter() - start, "", None)
+        except Exception as exc:
+            failed[name] = exc
+            report(name, time.perf_counter() - start, "", exc)
+
+    if verbose if show_timings is None else show_timings:
+        print_timings(timings)
+    return results, timings
+
+def print_timings(timings, title="Wall time per stage and analysis"):
+    print(f"\n⏱️ {title}:")
+    for name, seconds in sorted(timings.items(), key=lambda item: -item[1]):
+        print(f"  {name}: {seconds:.2f} s")
+
+
+if __name__ == "__main__":
+    run_pipeline()
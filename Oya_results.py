@@ -0,0 +1,165 @@
+import contextlib
+import glob
+import hashlib
+import inspect
+import io
+import json
+import os
+import pickle
+import time
+import numpy as np
+import pandas as pd
+from Oya_loader import EXPORT_TABLES, export_fingerprint
+
+# Analysis results are cached on disk, addressed by a hash of
+#   function name + parameter values + SHA-256 of every input export + hash of the analysis code,
+# so a changed export, parameter or script never returns a stale result. DataFrames are stored
+# as parquet, anything else (tuples, dicts, Series, ...) as pickle, each with a small JSON entry
+# holding the printed output. When the folder outgrows its budget the least recently used
+# entries are removed.
+RESULT_DIR = ".oya_results"
+DEFAULT_BUDGET_MB = 512
+
+# Analyses that draw figures (Oya_pipeline and Oya_batch draw them on the main thread)
+PLOTTING = {"plot_cfs_vs_adl", "flow_visualization", "flow_visualization_simplified_with_colors", "one_unit_visualization"}
+
+# Analyses that write files or draw figures; returning a cached result would skip that
+SIDE_EFFECTS = {"inflow_analysis", "analyze_all_templates_for_valid_patients", "analyze_decision_rules"} | PLOTTING
+
+_code_version = None
+
+### --- Keys --- ###
+
+def code_version():
+    # Hash of every analysis script next to this module; editing any of them invalidates all entries
+    global _code_version
+    if _code_version is None:
+        h = hashlib.sha256()
+        for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*.py"))):
+            with open(path, "rb") as f:
+                h.update(os.path.basename(path).encode("utf-8") + b"\0" + f.read())
+        _code_version = h.hexdigest()
+    return _code_version
+
+def result_key(name, params, input_files):
+    # name: qualified function name, params: {argument: value}, input_files: paths the result depends on
+    fingerprints = {os.path.abspath(path): export_fingerprint(path) for path in input_files}
+    payload = json.dumps({"function": name, "params": params, "inputs": sorted(fingerprints.values()),
+                          "code": code_version()}, sort_keys=True, default=repr)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def is_cacheable(func, params):
+    # Unseeded random results (e.g. the bootstrap without random_state) are never cached
+    accepted = inspect.signature(func).parameters
+    return func.__name__ not in SIDE_EFFECTS and not ("random_state" in accepted and params.get("random_state") is None)
+
+### --- Store --- ###
+
+def _entry_paths(key, cache_dir):
+    base = os.path.join(cache_dir, key)
+    return base + ".json", base + ".parquet", base + ".pkl"
+
+def _write_result(result, parquet_path, pickle_path):
+    # Parquet only when the frame reads back identical (index, dtypes, missing values); pickle otherwise
+    if isinstance(result, pd.DataFrame):
+        try:
+            result.to_parquet(parquet_path)
+            if pd.read_parquet(parquet_path).equals(result):
+                return "parquet", os.path.getsize(parquet_path)
+        except (ImportError, TypeError, ValueError):
+            pass
+        if os.path.exists(parquet_path):
+            os.remove(parquet_path)
+    pd.to_pickle(result, pickle_path)
+    return "pickle", os.path.getsize(pickle_path)
+
+def lookup(key, cache_dir=RESULT_DIR):
+    # (True, result, printed output) on a hit, (False, None, "") otherwise
+    meta_path, parquet_path, pickle_path = _entry_paths(key, cache_dir)
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        result = pd.read_parquet(parquet_path) if meta["format"] == "parquet" else pd.read_pickle(pickle_path)
+    except (OSError, ValueError, KeyError, EOFError, pickle.UnpicklingError):
+        return False, None, ""
+    os.utime(meta_path)  # Last access time, used for LRU eviction
+    return True, result, meta["output"]
+
+def store(key, result, output="", name=None, cache_dir=RESULT_DIR, budget_mb=DEFAULT_BUDGET_MB):
+    os.makedirs(cache_dir, exist_ok=True)
+    meta_path, parquet_path, pickle_path = _entry_paths(key, cache_dir)
+    fmt, size = _write_result(result, parquet_path, pickle_path)
+    meta = {"function": name, "format": fmt, "size": size, "output": output, "created": time.time()}
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    evict(cache_dir, budget_mb)
+
+def _entries(cache_dir):
+    # [(last access, key, bytes on disk)]
+    entries = []
+    for meta_path in glob.glob(os.path.join(cache_dir, "*.json")):
+        key = os.path.splitext(os.path.basename(meta_path))[0]
+        try:
+            paths = _entry_paths(key, cache_dir)
+            size = sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+            entries.append((os.path.getmtime(meta_path), key, size))
+        except OSError:
+            continue  # Removed by another process in the meantime
+    return entries
+
+def evict(cache_dir=RESULT_DIR, budget_mb=DEFAULT_BUDGET_MB):
+    # Remove least recently used entries until the folder fits the budget; returns the removed keys
+    entries = sorted(_entries(cache_dir))
+    total, budget = sum(size for _, _, size in entries), budget_mb * 1024 * 1024
+    removed = []
+    for _, key, size in entries:
+        if total <= budget:
+            break
+        for path in _entry_paths(key, cache_dir):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+        total -= size
+        removed.append(key)
+    return removed
+
+def cache_size_mb(cache_dir=RESULT_DIR):
+    return sum(size for _, _, size in _entries(cache_dir)) / (1024 * 1024)
+
+def clear_results(cache_dir=RESULT_DIR):
+    return evict(cache_dir, budget_mb=0)
+
+### --- Calls --- ###
+
+def _holds_frames(value):
+    if isinstance(value, dict):
+        return any(_holds_frames(item) for item in value.values())
+    return isinstance(value, (pd.DataFrame, pd.Series, np.ndarray))
+
+def cached_call(func, *args, cache_dir=RESULT_DIR, budget_mb=DEFAULT_BUDGET_MB, input_files=None, **kwargs):
+    # Call an analysis through the cache, e.g. from a notebook:
+    #   cached_call(analyze_adl_outcomes_by_decile, adl_path="Øya_2_ADL.csv", encounters_path="Øya_encounters.csv",
+    #               measurement_name="ADL")
+    # The key covers every path argument, the default exports in the working folder (some
+    # analyses read those directly) and input_files. Calls with DataFrame arguments, or an
+    # unseeded random_state, run uncached. The printed output is replayed on a hit.
+    bound = inspect.signature(func).bind(*args, **kwargs)
+    bound.apply_defaults()
+    params = dict(bound.arguments)
+    if any(_holds_frames(value) for value in params.values()) or not is_cacheable(func, params):
+        return func(*args, **kwargs)
+
+    files = {value for value in params.values() if isinstance(value, str) and os.path.isfile(value)}
+    files |= {name for name in EXPORT_TABLES if os.path.isfile(name)}
+    files |= set(input_files or ())
+    key = result_key(f"{func.__module__}.{func.__qualname__}", params, sorted(files))
+
+    hit, result, output = lookup(key, cache_dir)
+    if hit:
+        print(output, end="")
+        return result
+    buffer = io.StringIO()
+    with contextlib.redirect_stdout(buffer):
+        result = func(*args, **kwargs)
+    print(buffer.getvalue(), end="")
+    store(key, result, buffer.getvalue(), name=func.__qualname__, cache_dir=cache_dir, budget_mb=budget_mb)
+    return result
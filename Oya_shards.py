@@ -0,0 +1,212 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+import pandas as pd
+
+from CFS_Outcomes import (cfs_destination_counts, load_cfs_scores, load_grouped_discharges, report_adl_development_matrix,
+                          report_cfs_destinations)
+from Oya_adl import apply_bins, load_adl_measurements, n_bins_of, resolve_bin_spec
+from Oya_cohort import REAL_PATIENTS
+from Oya_incremental import transition_pairs, transition_stays
+from Oya_loader import read_export
+
+# Per-patient analyses on worker processes. The patient keys are split into shards of about the
+# same number of rows (summed over every frame the analysis uses), each shard's rows of every frame
+# go to one worker, and the partial results are merged: count matrices and numbers are summed,
+# tables and lists concatenated. Numeric, datetime and categorical columns are handed over in one
+# shared memory block that every worker maps, instead of being pickled to it shard by shard; other
+# columns (text), and an index that is not numeric or datetime, are pickled with their shard.
+# Since every patient's rows stay together and in their original order, the merged results are the
+# same as the single-process analyses.
+
+# Shards per worker, so the pool can even out shards that take longer than their row count suggests
+SHARDS_PER_WORKER = 4
+
+### --- Sharding --- ###
+
+def shard_bounds(frames, n_shards, by="PatientPseudoKey"):
+    # Sorted patient keys and the shard of each: contiguous key ranges with about the same number
+    # of rows over all frames. Rows without a key go to shard 0.
+    keys = np.concatenate([frame[by].dropna().to_numpy() for frame in frames.values()])
+    keys, rows = np.unique(keys, return_counts=True)
+    first_row = np.cumsum(rows) - rows
+    shards = np.minimum(first_row * n_shards // max(rows.sum(), 1), n_shards - 1)
+    return keys, shards
+
+def shard_of(frame, keys, shards, by="PatientPseudoKey"):
+    # Shard of every row of the frame (keys and shards from shard_bounds)
+    values = frame[by].to_numpy()
+    if len(keys) == 0:
+        return np.zeros(len(values), dtype=np.int64)
+    position = np.minimum(np.searchsorted(keys, values), len(keys) - 1)
+    return np.where(pd.notna(values), shards[position], 0)
+
+### --- Shared Memory --- ###
+
+_block = None  # Worker side: the attached block, its array views and the frame layouts
+_arrays = []
+_layouts = {}
+
+def _share(frames, shard_rows, n_shards):
+    # Rows of each frame grouped by shard, their shareable columns copied into one shared block.
+    # Returns (block, array specs, layouts, offsets, text); a layout is ([(column, kind, payload)],
+    # (index kind, payload, index name)), text[name] the (text columns, text index or None) and
+    # offsets[name][s] the first row of shard s.
+    arrays, layouts, offsets, text = [], {}, {}, {}
+    for name, frame in frames.items():
+        order = np.argsort(shard_rows[name], kind="stable")
+        frame = frame.iloc[order]
+        offsets[name] = np.searchsorted(shard_rows[name][order], np.arange(n_shards + 1))
+        columns, text[name] = [], {}
+        for col in frame.columns:
+            dtype = frame[col].dtype
+            if isinstance(dtype, pd.CategoricalDtype):
+                arrays.append(frame[col].cat.codes.to_numpy())
+                columns.append((col, "categorical", (len(arrays) - 1, dtype.categories, dtype.ordered)))
+            elif isinstance(dtype, np.dtype) and dtype.kind in "biufmM":
+                arrays.append(frame[col].to_numpy())
+                columns.append((col, "array", len(arrays) - 1))
+            else:
+                text[name][col] = frame[col].array
+                columns.append((col, "text", None))
+        if isinstance(frame.index.dtype, np.dtype) and frame.index.dtype.kind in "biufmM":
+            arrays.append(frame.index.to_numpy())
+            index = ("array", len(arrays) - 1, frame.index.name)
+        else:
+            index = ("text", None, frame.index.name)
+        text[name] = (text[name], frame.index if index[0] == "text" else None)
+        layouts[name] = (columns, index)
+
+    specs, size = [], 0
+    for values in arrays:
+        specs.append((size, values.dtype.str, len(values)))
+        size += -(-values.nbytes // 64) * 64  # 64-byte aligned
+    block = SharedMemory(create=True, size=max(size, 1))
+    for (offset, dtype, length), values in zip(specs, arrays):
+        np.ndarray(length, dtype, buffer=block.buf, offset=offset)[:] = values
+    return block, specs, layouts, offsets, text
+
+def _attach(name, specs, layouts):
+    # Worker initializer. The block stays registered with the parent's resource tracker, which
+    # the workers share; the parent unlinks it when the pool is done.
+    global _block, _arrays, _layouts
+    _block = SharedMemory(name=name)
+    _arrays = [np.ndarray(length, dtype, buffer=_block.buf, offset=offset) for offset, dtype, length in specs]
+    _layouts = layouts
+
+def _shard_frames(rows, text):
+    # The shard's frames over the shared arrays; rows: {frame: (start, stop)}, text: the shard's slice of it
+    frames = {}
+    for name, (columns, (index_kind, index, index_name)) in _layouts.items():
+        start, stop = rows[name]
+        text_columns, text_index = text[name]
+        data = {}
+        for col, kind, payload in columns:
+            if kind == "array":
+                data[col] = _arrays[payload][start:stop]
+            elif kind == "categorical":
+                codes, categories, ordered = payload
+                data[col] = pd.Categorical.from_codes(_arrays[codes][start:stop], categories, ordered)
+            else:
+                data[col] = text_columns[col]
+        labels = pd.Index(_arrays[index][start:stop] if index_kind == "array" else text_index, name=index_name)
+        frames[name] = pd.DataFrame(data, index=labels, columns=[col for col, _, _ in columns])
+    return frames
+
+def _run_shard(func, args, rows, text):
+    return func(_shard_frames(rows, text), *args)
+
+### --- Executor --- ###
+
+def combine_partials(parts):
+    # Merge per-shard results: arrays and numbers summed, tables and lists concatenated,
+    # tuples and dicts merged element by element
+    first = parts[0]
+    if isinstance(first, tuple):
+        return tuple(combine_partials([part[i] for part in parts]) for i in range(len(first)))
+    if isinstance(first, dict):
+        return {key: combine_partials([part[key] for part in parts]) for key in first}
+    if isinstance(first, (pd.DataFrame, pd.Series)):
+        return pd.concat(parts)
+    if isinstance(first, list):
+        return [item for part in parts for item in part]
+    return sum(parts[1:], start=first)
+
+def run_sharded(func, frames, args=(), workers=None, n_shards=None, combine=combine_partials, by="PatientPseudoKey"):
+    # func(shard frames, *args) for every shard of patients, on `workers` processes (default: all
+    # cores), merged in shard order by combine. func must be a module-level function (it is
+    # pickled to the workers) and must only relate rows of the same patient.
+    workers = workers or os.cpu_count() or 1
+    n_shards = n_shards or workers * SHARDS_PER_WORKER
+    if workers == 1:
+        return combine([func(frames, *args)])
+    keys, shards = shard_bounds(frames, n_shards, by)
+    shard_rows = {name: shard_of(frame, keys, shards, by) for name, frame in frames.items()}
+
+    block, specs, layouts, offsets, text = _share(frames, shard_rows, n_shards)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach, initargs=(block.name, specs, layouts)) as pool:
+            futures = []
+            for s in range(n_shards):
+                rows = {name: (offsets[name][s], offsets[name][s + 1]) for name in frames}
+                shard_text = {name: ({col: values[slice(*rows[name])] for col, values in text[name][0].items()},
+                                     None if text[name][1] is None else text[name][1][slice(*rows[name])])
+                              for name in frames}
+                futures.append(pool.submit(_run_shard, func, args, rows, shard_text))
+            parts = [future.result() for future in futures]
+    finally:
+        block.close()
+        block.unlink()
+    return combine(parts)
+
+### --- Analyses --- ###
+
+def _transition_counts(frames, window_days, n_bins):
+    # Stay-to-next-stay counts and skipped pairs of one shard
+    pairs = transition_pairs(frames, window_days)
+    valid = pairs[pairs["From"] >= 0]
+    matrix = np.zeros((n_bins, n_bins), dtype=int)
+    np.add.at(matrix, (valid["From"].to_numpy(), valid["To"].to_numpy()), 1)
+    return matrix, len(pairs) - len(valid)
+
+def sharded_adl_development_matrix(
+    adl_path="Øya_2_ADL.csv",
+    hospital_path="Øya_2_hospitalencounters.csv",
+    decisions_path="Øya_decisions.csv",
+    measurement_name="R HP COCM IPLOS/ADL TOTAL VANLIG GJENNOMSNITT",
+    window_days=30,
+    binning=None,
+    workers=None,
+):
+    # Same output as CFS_Outcomes.analyze_adl_development_matrix. The bin edges need every value,
+    # so the measurements are binned first; the stays are paired per shard.
+    adl_df = load_adl_measurements(adl_path, measurement_name)[measurement_name]
+    spec = resolve_bin_spec(binning, adl_df["Value"], measurement_name)
+    decision_columns = ["PatientPseudoKey", "DecisionTemplate", "DecisionStatus", "DecisionValidDate"]
+    frames = {
+        "hospital": transition_stays(read_export(hospital_path)),
+        "adl": apply_bins(adl_df, spec, label_col=None),
+        "decisions": read_export(decisions_path, cohort=REAL_PATIENTS.select(decision_columns)),
+    }
+    matrix, skipped = run_sharded(_transition_counts, frames, (window_days, n_bins_of(spec)), workers)
+    return report_adl_development_matrix(matrix, skipped)
+
+def _destination_counts(frames):
+    return cfs_destination_counts(frames["cfs"], frames["encounters"])
+
+def sharded_cfs_destinations_by_intervals(cfs_path="Øya_CFS.csv", encounters_path="Øya_encounters.csv", workers=None,
+                                          backend="pandas"):
+    # Same table as CFS_Outcomes.analyze_cfs_destinations_by_intervals, with the interval walk per shard
+    cfs_df = load_cfs_scores(cfs_path, backend=backend)
+    encounters_df = load_grouped_discharges(encounters_path, backend=backend)
+    destinations = encounters_df["DischargeDestGroup"].dropna().unique().tolist()
+    frames = {"cfs": cfs_df[["PatientPseudoKey", "TakenInstant", "CFS"]],
+              "encounters": encounters_df[["PatientPseudoKey", "DischargeInstant", "DischargeDestGroup"]]}
+    counts, date_diffs = run_sharded(_destination_counts, frames, workers=workers)
+    return report_cfs_destinations(counts, date_diffs, destinations)
+
+
+if __name__ == "__main__":
+    sharded_adl_development_matrix()
+    print(sharded_cfs_destinations_by_intervals())
@@ -0,0 +1,192 @@
+import contextlib
+import importlib.util
+import io
+import os
+import numpy as np
+import pandas as pd
+from Oya_loader import ROW_COLUMN, TABLE_SCHEMAS, cached_parquet, missing_as_nan, table_for
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+# Optional SQL backend (pip install duckdb). Analyses that are plain filters, group-bys and joins
+# take backend="duckdb" and run in DuckDB, an in-process analytical database with multi-threaded
+# vectorized execution, directly over the CSV export (or its parquet cache when that is current).
+# Only the aggregated result comes back as a DataFrame, so the standard tables can be computed
+# over exports that do not fit in pandas. The pandas path stays the reference:
+#   python Oya_sql.py [data folder]
+# runs the installed backends and reports where they disagree with pandas.
+# Backends: "pandas" (reference), "duckdb" (this module), "polars" (lazy preprocessing, Oya_lazy.py).
+# An analysis without an implementation for the chosen backend runs its pandas code.
+BACKENDS = ("pandas", "duckdb", "polars")
+
+# Tried after a timestamp column's expected format, like the day-first fallback in Oya_loader.parse_timestamps
+DAYFIRST_FORMATS = ["%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%d/%m/%Y", "%d.%m.%Y %H:%M:%S", "%d.%m.%Y",
+                    "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d"]
+
+def use_sql(backend):
+    # True for the SQL backend; unknown or unavailable backends raise
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend: {backend} (expected one of {', '.join(BACKENDS)})")
+    if backend == "duckdb" and duckdb is None:
+        raise ImportError("The duckdb backend needs the duckdb package: pip install duckdb")
+    return backend == "duckdb"
+
+def quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def _literal(text):
+    return "'" + text.replace("'", "''") + "'"
+
+### --- Sources --- ###
+
+def _csv_source(file_path):
+    # The CSV typed like Oya_loader.read_with_schema, with each row's position as ROW_COLUMN
+    table = table_for(file_path)
+    if table is None:
+        return f"(SELECT row_number() OVER () - 1 AS {ROW_COLUMN}, * FROM read_csv({_literal(file_path)}, header = true))"
+
+    schema = TABLE_SCHEMAS[table]
+    header = pd.read_csv(file_path, nrows=0).columns
+    typed = set(schema["categorical"]) | set(schema["keys"]) | set(schema["numeric"]) | set(schema["timestamps"])
+    text_types = ", ".join(f"{_literal(col)}: 'VARCHAR'" for col in header if col in typed)
+    columns = [f"row_number() OVER () - 1 AS {ROW_COLUMN}"]
+    for col in header:
+        field = quote(col)
+        if col in schema["keys"]:
+            expr = f"TRY_CAST({field} AS BIGINT)"
+        elif col in schema["numeric"]:
+            expr = f"TRY_CAST({field} AS DOUBLE)"
+        elif col in schema["timestamps"]:
+            formats = [schema["timestamps"][col]] if schema["timestamps"][col] else []
+            expr = f"try_strptime({field}, [{', '.join(_literal(fmt) for fmt in formats + DAYFIRST_FORMATS)}])"
+        else:
+            expr = field
+        columns.append(f"{expr} AS {field}")
+    return f"(SELECT {', '.join(columns)} FROM read_csv({_literal(file_path)}, header = true, types = {{{text_types}}}))"
+
+def register_source(con, name, file_path=None, df=None, cohort=None):
+    # View `name` over an export, or over an already loaded frame (e.g. a pipeline stage), with
+    # only the cohort's rows. ROW_COLUMN holds the row's position in the export (index label for frames).
+    if df is not None:
+        rows = df.index.to_numpy() if pd.api.types.is_integer_dtype(df.index) else np.arange(len(df))
+        con.register(f"{name}_frame", df.assign(**{ROW_COLUMN: rows}))
+        source = quote(f"{name}_frame")
+    else:
+        parquet = cached_parquet(file_path)
+        source = f"read_parquet({_literal(parquet)})" if parquet else _csv_source(os.path.abspath(file_path))
+    condition = cohort.sql() if cohort is not None else "TRUE"
+    con.execute(f"CREATE VIEW {quote(name)} AS SELECT * FROM {source} WHERE {condition}")
+
+### --- Queries --- ###
+
+def connect(threads=None):
+    # In-memory database; DuckDB uses every core unless threads says otherwise
+    con = duckdb.connect()
+    if threads:
+        con.execute(f"SET threads TO {int(threads)}")
+    return con
+
+def run_query(query, sources, params=None, threads=None):
+    # query:   SQL over the views in sources, {view name: (file_path, df, cohort)}
+    # params:  values for the ? placeholders in query
+    # Returns a DataFrame; a ROW_COLUMN in the result becomes its index, as in a cohort read
+    con = connect(threads)
+    try:
+        for name, (file_path, df, cohort) in sources.items():
+            register_source(con, name, file_path, df, cohort)
+        result = con.execute(query, params or []).df()
+    finally:
+        con.close()
+    if ROW_COLUMN in result.columns:
+        result.index = pd.Index(result.pop(ROW_COLUMN).to_numpy())
+    return missing_as_nan(result)
+
+### --- Backend Comparison --- ###
+
+def _comparable(result):
+    # Tables compared by content: categoricals as plain values, timestamps in nanoseconds
+    df = result.to_frame() if isinstance(result, pd.Series) else result.copy()
+    df.columns = [str(col) for col in df.columns]
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype) or df[col].dtype == object:
+            df[col] = df[col].astype(object).where(df[col].notna(), None)
+        elif pd.api.types.is_datetime64_dtype(df[col]):
+            df[col] = df[col].astype("datetime64[ns]")
+    return df
+
+def _same(expected, actual, ordered):
+    if isinstance(expected, tuple):
+        return len(expected) == len(actual) and all(_same(e, a, ordered) for e, a in zip(expected, actual))
+    if not isinstance(expected, (pd.DataFrame, pd.Series)):
+        return expected == actual
+    expected, actual = _comparable(expected), _comparable(actual)
+    if list(expected.columns) != list(actual.columns):
+        return False
+    if not ordered:
+        columns = list(expected.columns)
+        expected = expected.sort_values(columns, kind="stable").reset_index(drop=True)
+        actual = actual.sort_values(columns, kind="stable").reset_index(drop=True)
+    try:
+        pd.testing.assert_frame_equal(expected, actual, check_dtype=False, check_index_type=False,
+                                      check_column_type=False, check_datetimelike_compat=True)
+    except AssertionError:
+        return False
+    return True
+
+def installed_backends():
+    # The optional backends whose package is installed (each is named after its package)
+    return [backend for backend in BACKENDS[1:] if importlib.util.find_spec(backend) is not None]
+
+def compare_backends(data_dir=".", backends=None):
+    # Run every analysis with a backend option in data_dir (default export names), on pandas and on
+    # each of backends (default: the installed ones); returns {(analysis, backend): agrees}.
+    # Tables whose row order is only defined up to ties are compared as sorted tables, the row
+    # selections by index label; printed output has to match as well.
+    import CFS_Outcomes as cfs
+    import Hospital_encounters as hospital
+    import Oya_encounters as encounters
+
+    # Analysis -> (function, rows in a defined order)
+    checks = {
+        "analyze_encounters": (encounters.analyze_encounters, True),
+        "analyze_dispositions_by_service": (encounters.analyze_dispositions_by_service, False),
+        "count_admissions_by_source": (encounters.count_admissions_by_source, True),
+        "get_revisit_details": (encounters.get_revisit_details, True),
+        "count_revisits": (encounters.count_revisits, False),
+        "count_last_dispositions_from_revisit_list": (encounters.count_last_dispositions_from_revisit_list, True),
+        "flow_tables": (encounters.flow_tables, True),
+        "analyze_daily_deaths": (hospital.analyze_daily_deaths, True),
+        "analyze_daily_admissions": (hospital.analyze_daily_admissions, True),
+        "count_unique_patients": (hospital.count_unique_patients, True),
+        "analyze_cfs_outcomes": (cfs.analyze_cfs_outcomes, True),
+        "analyze_cfs_destinations_by_intervals": (cfs.analyze_cfs_destinations_by_intervals, True),
+        "analyze_adl_outcomes_by_decile": (cfs.analyze_adl_outcomes_by_decile, True),
+        "load_home_admissions": (cfs.load_home_admissions, True),
+        "analyze_hospital_outcomes_by_decile": (cfs.analyze_hospital_outcomes_by_decile, True),
+        "analyze_adl_development_matrix": (cfs.analyze_adl_development_matrix, True),
+    }
+
+    agrees = {}
+    with contextlib.chdir(data_dir):
+        for name, (func, ordered) in checks.items():
+            outputs = {}
+            for backend in ["pandas"] + list(installed_backends() if backends is None else backends):
+                buffer = io.StringIO()
+                with contextlib.redirect_stdout(buffer):
+                    outputs[backend] = func(backend=backend), buffer.getvalue()
+            expected, expected_text = outputs.pop("pandas")
+            for backend, (actual, actual_text) in outputs.items():
+                agrees[name, backend] = _same(expected, actual, ordered) and expected_text == actual_text
+                print(f"{'✅' if agrees[name, backend] else '❌'} {name} ({backend})")
+    return agrees
+
+if __name__ == "__main__":
+    import sys
+    if not installed_backends():
+        print("⚠️ Neither duckdb nor polars is installed, only the pandas backend is available.")
+        raise SystemExit(1)
+    results = compare_backends(sys.argv[1] if len(sys.argv) > 1 else ".")
+    raise SystemExit(0 if all(results.values()) else 1)
@@ -1,55 +1,241 @@
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.stats import norm
 
-# Simulation parameters
-n_simulations = 10000
+# Monte Carlo engine behind the split comparisons below: how the total of many small draws (e.g.
+# arrivals split over departments) compares with one draw of the same mean. A total is a list of
+# terms (distribution spec, number of draws), e.g.
+#   [({"dist": "poisson", "lam": 0.1}, 200)]                                  200 x Poisson(0.1)
+#   [({"dist": "triangular", "left": 1, "mode": 3, "right": 10}, 100)]        100 x Triangular(1, 3, 10)
+#   [({"dist": "discrete", "values": [0, 1], "p": [0.5, 0.5]}, 1)]            one coin flip
+# with the distributions used in Master.alp (drawPoisson, generateTriangular, the Math.random()
+# tables) plus uniform. Replications are generated in chunks of CHUNK_SIZE, each chunk from its own
+# stream spawned from one SeedSequence, on worker processes; only the moments and a histogram of
+# every chunk are kept and merged in chunk order. Memory stays bounded for 10^8+ replications,
+# and a seed gives the same result for any number of workers.
+CHUNK_SIZE = 1 << 20
+MAX_DRAWS = 1 << 22  # Draws held in memory at once per worker
 
-# === Poisson comparison ===
+# Distribution -> parameters (numpy Generator arguments)
+DISTRIBUTIONS = {
+    "poisson": ("lam",),
+    "triangular": ("left", "mode", "right"),
+    "uniform": ("low", "high"),
+    "discrete": ("values", "p"),
+}
 
-# Case 1: Single Poisson draw with lambda = 20
-single_draws = np.random.poisson(lam=20, size=n_simulations)
+### --- Distributions --- ###
 
-# Case 2: Sum of 200 Poisson draws with lambda = 0.1
-split_draws = np.random.poisson(lam=0.1, size=(n_simulations, 200)).sum(axis=1)
+def check_spec(spec):
+    dist = spec.get("dist")
+    if dist not in DISTRIBUTIONS:
+        raise ValueError(f"Unknown distribution: {dist} (expected one of {', '.join(DISTRIBUTIONS)})")
+    missing = [param for param in DISTRIBUTIONS[dist] if param not in spec]
+    extra = [param for param in spec if param != "dist" and param not in DISTRIBUTIONS[dist]]
+    if missing or extra:
+        raise ValueError(f"{dist} takes {', '.join(DISTRIBUTIONS[dist])} (missing: {missing}, unknown: {extra})")
 
-# Normal distribution parameters
-mean = 20
-std = np.sqrt(20)
-x = np.linspace(5, 35, 300)
-normal_pdf = norm.pdf(x, loc=mean, scale=std) * n_simulations * (x[1] - x[0])  # scale to histogram
+def draw(rng, spec, size):
+    dist = spec["dist"]
+    if dist == "poisson":
+        return rng.poisson(spec["lam"], size)
+    if dist == "triangular":
+        return rng.triangular(spec["left"], spec["mode"], spec["right"], size)
+    if dist == "uniform":
+        return rng.uniform(spec["low"], spec["high"], size)
+    return rng.choice(np.asarray(spec["values"]), size, p=spec["p"])
 
-# Plot Poisson comparison
-plt.figure(figsize=(12, 6))
-plt.hist(single_draws, bins=range(5, 36), alpha=0.6, label='Poisson(λ=20)', color='blue', edgecolor='black')
-plt.hist(split_draws, bins=range(5, 36), alpha=0.6, label='Sum of 200×Poisson(λ=0.1)', color='orange', edgecolor='black')
-plt.plot(x, normal_pdf, label='Normal Approximation', color='green', linewidth=2)
+def moments(spec):
+    # (mean, variance) of one draw
+    dist = spec["dist"]
+    if dist == "poisson":
+        return spec["lam"], spec["lam"]
+    if dist == "triangular":
+        a, c, b = spec["left"], spec["mode"], spec["right"]
+        return (a + b + c) / 3, (a * a + b * b + c * c - a * b - a * c - b * c) / 18
+    if dist == "uniform":
+        return (spec["low"] + spec["high"]) / 2, (spec["high"] - spec["low"]) ** 2 / 12
+    values, p = np.asarray(spec["values"], dtype=float), np.asarray(spec["p"], dtype=float)
+    mean = float(values @ p)
+    return mean, float((values - mean) ** 2 @ p)
 
-plt.title('Comparison of Poisson Variants and Normal Approximation')
-plt.xlabel('Total Daily Admissions')
-plt.ylabel('Frequency (out of 10,000 simulations)')
-plt.legend()
-plt.grid(True)
-plt.tight_layout()
+def expected_moments(terms):
+    # (mean, variance) of the total; draws are independent, so both add up over the draws
+    mean = sum(moments(spec)[0] * count for spec, count in terms)
+    variance = sum(moments(spec)[1] * count for spec, count in terms)
+    return mean, variance
 
-# === Triangular distribution comparison ===
+def default_edges(terms, bins=50):
+    # Histogram edges over the expected mean +- 5 standard deviations, within the total's support;
+    # totals of whole numbers get one bin per value
+    mean, variance = expected_moments(terms)
+    low, high = mean - 5 * np.sqrt(variance), mean + 5 * np.sqrt(variance)
+    lower = sum(min(_support(spec)) * count for spec, count in terms)
+    upper = sum(max(_support(spec)) * count for spec, count in terms)
+    low, high = max(low, lower), min(high, upper)
+    if all(_whole(spec) for spec, _ in terms):
+        return np.arange(np.floor(low), np.ceil(high) + 2) - 0.5
+    return np.linspace(low, high, bins + 1)
 
-# Case 1: Single draw from triangular (100, 300, 1000)
-tri_single = np.random.triangular(left=100, mode=300, right=1000, size=n_simulations)
+def _support(spec):
+    dist = spec["dist"]
+    if dist == "poisson":
+        return 0, np.inf
+    if dist == "triangular":
+        return spec["left"], spec["right"]
+    if dist == "uniform":
+        return spec["low"], spec["high"]
+    return min(spec["values"]), max(spec["values"])
 
-# Case 2: Sum of 100 draws from triangular (1, 3, 10)
-tri_split = np.random.triangular(left=1, mode=3, right=10, size=(n_simulations, 100)).sum(axis=1)
+def _whole(spec):
+    return spec["dist"] == "poisson" or (spec["dist"] == "discrete" and all(float(v).is_integer() for v in spec["values"]))
 
-# Plot Triangular comparison
-plt.figure(figsize=(12, 6))
-plt.hist(tri_single, bins=50, alpha=0.6, label='Triangular(100, 300, 1000)', color='red', edgecolor='black')
-plt.hist(tri_split, bins=50, alpha=0.6, label='Sum of 100×Triangular(1, 3, 10)', color='blue', edgecolor='black')
+### --- Chunks --- ###
 
-plt.title('Comparison of Triangular Distributions')
-plt.xlabel('Total Sum')
-plt.ylabel('Frequency (out of 10,000 simulations)')
-plt.legend()
-plt.grid(True)
-plt.tight_layout()
+def _chunk_totals(terms, seed, rows):
+    # Totals of `rows` replications from the chunk's own stream, at most MAX_DRAWS draws at a time
+    rng = np.random.default_rng(seed)
+    totals = np.zeros(rows)
+    for spec, count in terms:
+        done = 0
+        while done < count:
+            cols = min(count - done, max(1, MAX_DRAWS // rows))
+            totals += draw(rng, spec, (rows, cols)).sum(axis=1)
+            done += cols
+    return totals
 
-plt.show()
\ No newline at end of file
+def _chunk_summary(terms, seed, rows, edges):
+    totals = _chunk_totals(terms, seed, rows)
+    mean = totals.mean()
+    return {
+        "replications": rows,
+        "mean": mean,
+        "m2": float(((totals - mean) ** 2).sum()),
+        "min": totals.min(),
+        "max": totals.max(),
+        "histogram": np.histogram(totals, edges)[0],
+        "below": int((totals < edges[0]).sum()),
+        "above": int((totals > edges[-1]).sum()),
+    }
+
+def _merge(a, b):
+    # Chan et al.'s pairwise update of count, mean and sum of squared deviations
+    n = a["replications"] + b["replications"]
+    delta = b["mean"] - a["mean"]
+    return {
+        "replications": n,
+        "mean": a["mean"] + delta * b["replications"] / n,
+        "m2": a["m2"] + b["m2"] + delta * delta * a["replications"] * b["replications"] / n,
+        "min": min(a["min"], b["min"]),
+        "max": max(a["max"], b["max"]),
+        "histogram": a["histogram"] + b["histogram"],
+        "below": a["below"] + b["below"],
+        "above": a["above"] + b["above"],
+    }
+
+### --- Engine --- ###
+
+def simulate_totals(terms, replications, seed=0, workers=None, edges=None, chunk_size=CHUNK_SIZE):
+    # Moments and histogram of the total over `replications` runs:
+    #   {"replications", "mean", "variance", "std", "min", "max", "histogram", "edges",
+    #    "below", "above" (totals outside the edges), "expected_mean", "expected_variance"}
+    # The same seed and chunk_size give the same result for any number of workers (default: all cores).
+    if not isinstance(replications, (int, np.integer)) or replications < 1:
+        raise ValueError(f"Need a whole number of replications, at least 1, got {replications!r}")
+    if not isinstance(chunk_size, (int, np.integer)) or chunk_size < 1:
+        raise ValueError(f"Need a whole chunk size, at least 1, got {chunk_size!r}")
+    for spec, count in terms:
+        check_spec(spec)
+        if not isinstance(count, (int, np.integer)) or count < 1:
+            raise ValueError(f"Each term needs a whole number of draws, at least 1, got {count!r}")
+    edges = default_edges(terms) if edges is None else np.asarray(edges, dtype=float)
+    sizes = [chunk_size] * (replications // chunk_size) + ([replications % chunk_size] if replications % chunk_size else [])
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = [(terms, chunk_seed, rows, edges) for chunk_seed, rows in zip(seeds, sizes)]
+
+    workers = min(workers or os.cpu_count() or 1, len(args))
+    if workers == 1:
+        parts = [_chunk_summary(*arg) for arg in args]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(_chunk_summary, *zip(*args)))
+
+    summary = parts[0]
+    for part in parts[1:]:
+        summary = _merge(summary, part)
+    expected_mean, expected_variance = expected_moments(terms)
+    variance = summary.pop("m2") / max(replications - 1, 1)
+    return {**summary, "variance": variance, "std": np.sqrt(variance), "edges": edges,
+            "expected_mean": expected_mean, "expected_variance": expected_variance}
+
+def print_summary(label, result):
+    print(f"\n🎲 {label}: {result['replications']:,} replications")
+    print(f"   Mean {result['mean']:.4f} (expected {result['expected_mean']:.4f}), "
+          f"variance {result['variance']:.4f} (expected {result['expected_variance']:.4f})")
+    print(f"   Range {result['min']:g} to {result['max']:g}, outside the histogram: {result['below'] + result['above']}")
+
+def plot_histogram(result, **kwargs):
+    import matplotlib.pyplot as plt
+    plt.stairs(result["histogram"], result["edges"], fill=True, alpha=0.6, edgecolor="black", **kwargs)
+
+
+if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+    from scipy.stats import norm
+
+    # Simulation parameters: python poisson_variance.py [replications] [seed]
+    n_simulations = int(float(sys.argv[1])) if len(sys.argv) > 1 else 10000
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 2025
+
+    # === Poisson comparison ===
+
+    # Case 1: Single Poisson draw with lambda = 20
+    # Case 2: Sum of 200 Poisson draws with lambda = 0.1
+    poisson_edges = np.arange(5, 36)
+    single_draws = simulate_totals([({"dist": "poisson", "lam": 20}, 1)], n_simulations, seed, edges=poisson_edges)
+    split_draws = simulate_totals([({"dist": "poisson", "lam": 0.1}, 200)], n_simulations, seed + 1, edges=poisson_edges)
+    print_summary("Poisson(λ=20)", single_draws)
+    print_summary("Sum of 200×Poisson(λ=0.1)", split_draws)
+
+    # Normal distribution parameters
+    mean = 20
+    std = np.sqrt(20)
+    x = np.linspace(5, 35, 300)
+    normal_pdf = norm.pdf(x, loc=mean, scale=std) * n_simulations * (x[1] - x[0])  # scale to histogram
+
+    # Plot Poisson comparison
+    plt.figure(figsize=(12, 6))
+    plot_histogram(single_draws, label='Poisson(λ=20)', color='blue')
+    plot_histogram(split_draws, label='Sum of 200×Poisson(λ=0.1)', color='orange')
+    plt.plot(x, normal_pdf, label='Normal Approximation', color='green', linewidth=2)
+
+    plt.title('Comparison of Poisson Variants and Normal Approximation')
+    plt.xlabel('Total Daily Admissions')
+    plt.ylabel(f'Frequency (out of {n_simulations:,} simulations)')
+    plt.legend()
+    plt.grid(True)
+    plt.tight_layout()
+
+    # === Triangular distribution comparison ===
+
+    # Case 1: Single draw from triangular (100, 300, 1000)
+    # Case 2: Sum of 100 draws from triangular (1, 3, 10)
+    tri_single = simulate_totals([({"dist": "triangular", "left": 100, "mode": 300, "right": 1000}, 1)], n_simulations, seed + 2)
+    tri_split = simulate_totals([({"dist": "triangular", "left": 1, "mode": 3, "right": 10}, 100)], n_simulations, seed + 3)
+    print_summary("Triangular(100, 300, 1000)", tri_single)
+    print_summary("Sum of 100×Triangular(1, 3, 10)", tri_split)
+
+    # Plot Triangular comparison
+    plt.figure(figsize=(12, 6))
+    plot_histogram(tri_single, label='Triangular(100, 300, 1000)', color='red')
+    plot_histogram(tri_split, label='Sum of 100×Triangular(1, 3, 10)', color='blue')
+
+    plt.title('Comparison of Triangular Distributions')
+    plt.xlabel('Total Sum')
+    plt.ylabel(f'Frequency (out of {n_simulations:,} simulations)')
+    plt.legend()
+    plt.grid(True)
+    plt.tight_layout()
+
+    plt.show()
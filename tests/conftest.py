@@ -0,0 +1,122 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+# The analyses are top-level modules of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Small synthetic exports with the columns and formats of the real ones (including the test
+# patient 2384, missing values and the mixed date formats), written to a temporary directory
+DISPOSITIONS = ["Som død - Ingen melding går", "Ut til hjemmet - Ingen melding går", "Til annen enhet - Ingen melding går",
+                "Som død - Melding går til sykepleietjeneste", "Ut til hjemmet (N/A)", "*Unspecified", "Feilregistrert", None]
+DESTINATIONS = ["Bosted/arbeidsted", "Somatisk sykehus STO", "Sykehjem", "Langtidsopphold i sykehjem",
+                "Kommunale institusjoner i HP", "Som død", "Annet", "*Unspecified",
+                "Annen (somatisk) enhet ved egen helseinstitusjon", None]
+SOURCES = ["Bosted/arbeidsted", "Somatisk sykehus STO", "Annet", "Psykiatrisk sykehus STO", None]
+DEPARTMENTS = ["TRD H ØYA HELSEHUS 4. ET. AVD. B", "TRD H ØYA HELSEHUS 5. ET. AVD. B", "TRD H ØYA HELSEHUS 3. ET. AVD. A",
+               "TRD H ØYA HELSEHUS 6. ET. AVD. A"]
+TEMPLATES = ["Vedtak om helsetjenester i hjemmet - Tjenester i hjemmet", "Vedtak om tidsbegrenset opphold",
+             "Vedtak om langtidsopphold i institusjon", "Vedtak om praktisk bistand daglige gjøremål - Tjenester i hjemmet",
+             "Vedtak om trygghetsalarm", "Vedtak om matombringing"]
+ISO = "%Y-%m-%d %H:%M:%S"
+
+def write_exports(out, n_patients=120, seed=0):
+    rng = np.random.default_rng(seed)
+    patients = np.arange(1000, 1000 + n_patients)
+    patients[5] = 2384
+    t0 = pd.Timestamp("2021-01-01")
+
+    def instants(n, span_days=900):
+        return t0 + pd.to_timedelta(rng.integers(0, span_days * 24 * 60, n), unit="min")
+
+    def choice(values, n, p=None):
+        return rng.choice(np.array(values, dtype=object), n, p=p)
+
+    n = n_patients * 3
+    start = instants(n)
+    los = rng.integers(0, 30, n)
+    end = start + pd.to_timedelta(los, unit="D") + pd.to_timedelta(rng.integers(0, 600, n), unit="min")
+    encounters = pd.DataFrame({
+        "PatientPseudoKey": rng.choice(patients, n), "EncounterPseudoKey": rng.permutation(n) + 50000,
+        "EncounterType": choice(["Sykehuskontakt", "Telefon"], n, [.85, .15]),
+        "LengthOfStay": [str(x) if rng.random() > .03 else "" for x in los],
+        "Department": choice(DEPARTMENTS, n), "AdmittingDepartment": choice(DEPARTMENTS, n),
+        "HospitalService": choice(["Geriatri", "Rehab", "Palliasjon"], n),
+        "DischargeDisposition": choice(DISPOSITIONS, n), "AdmissionSource": choice(SOURCES, n),
+        "DischargeDestination": choice(DESTINATIONS, n),
+        "EncounterStart": start.strftime(ISO), "EncounterEnd": end.strftime(ISO), "DischargeInstant": end.strftime(ISO),
+    })
+    encounters.loc[rng.random(n) < .05, "DischargeInstant"] = None
+    encounters.to_csv(os.path.join(out, "Øya_encounters.csv"), index=False)
+
+    n = n_patients * 4
+    start = instants(n)
+    end = start + pd.to_timedelta(rng.integers(0, 15 * 24 * 60, n), unit="min")
+    hospital = pd.DataFrame({
+        "PatientPseudoKey": rng.choice(patients, n), "AdmissionSource": choice(SOURCES, n, [.6, .1, .1, .1, .1]),
+        "DischargeDestination": choice(DESTINATIONS, n), "EncounterStart": start.strftime(ISO), "EncounterEnd": end.strftime(ISO),
+    })
+    deaths = {p: (t0 + pd.Timedelta(days=int(rng.integers(100, 1000)))).strftime("%d.%m.%Y") for p in patients if rng.random() < .3}
+    hospital["DeathDate"] = hospital["PatientPseudoKey"].map(deaths)
+    hospital = pd.concat([hospital, hospital.sample(10, random_state=1)])
+    hospital.to_csv(os.path.join(out, "Øya_2_hospitalencounters.csv"), index=False)
+
+    n = n_patients * 8
+    names = ["R HP COCM IPLOS/ADL TOTAL VANLIG GJENNOMSNITT", "ADL", "Total score ADL", "Other measure", "Blodtrykk"]
+    measurement = rng.choice(names, n, p=[.35, .2, .15, .15, .15])
+    value = np.where(measurement == "ADL", rng.integers(0, 30, n).astype(float), np.round(rng.uniform(1, 5, n), 2))
+    adl = pd.DataFrame({"PatientPseudoKey": rng.choice(patients, n), "MeasurementName": measurement,
+                        "MeasurementTime": instants(n).strftime(ISO),
+                        "Value": [str(v) if rng.random() > .02 else "" for v in value]})
+    adl.to_csv(os.path.join(out, "Øya_2_ADL.csv"), index=False)
+
+    n = n_patients * 3
+    decisions = pd.DataFrame({"PatientPseudoKey": rng.choice(patients, n),
+                              "DecisionTemplate": choice(TEMPLATES, n, [.3, .2, .1, .2, .1, .1]),
+                              "DecisionStatus": choice(["Signert", "Omgjort", "Inaktiv", "Utkast"], n, [.6, .15, .15, .1]),
+                              "DecisionValidDate": instants(n).strftime("%d/%m/%Y")})
+    decisions.to_csv(os.path.join(out, "Øya_decisions.csv"), index=False)
+
+    n = n_patients * 2
+    cfs = pd.DataFrame({"PatientPseudoKey": rng.choice(patients, n), "CFS": rng.integers(1, 10, n),
+                        "TakenInstant": instants(n).strftime(ISO)})
+    cfs.to_csv(os.path.join(out, "Øya_CFS.csv"), index=False)
+
+@pytest.fixture
+def exports(tmp_path, monkeypatch):
+    # Synthetic exports under their default names in the working directory (caches go there too)
+    write_exports(tmp_path)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+def _by_value(table, ordered):
+    # Categoricals as their values; without ordered, the rows in a canonical order
+    frame = table.to_frame() if isinstance(table, pd.Series) else table.copy()
+    for col in frame.columns:
+        if isinstance(frame[col].dtype, pd.CategoricalDtype):
+            frame[col] = frame[col].astype(object)
+    frame.columns = [str(col) for col in frame.columns]
+    if ordered:
+        return frame
+    return frame.sort_values(list(frame.columns), key=lambda col: col.astype(str)).reset_index(drop=True)
+
+def assert_same(a, b, ordered=True):
+    # Results of two implementations of an analysis: tables compared by value (with ordered=False
+    # regardless of row order), dicts, tuples and lists element by element
+    if isinstance(a, (pd.DataFrame, pd.Series)):
+        pd.testing.assert_frame_equal(_by_value(a, ordered), _by_value(b, ordered), check_dtype=False,
+                                      check_index_type=False, check_column_type=False)
+    elif isinstance(a, dict):
+        assert set(a) == set(b)
+        for key in a:
+            assert_same(a[key], b[key], ordered)
+    elif isinstance(a, (tuple, list)):
+        assert len(a) == len(b)
+        for x, y in zip(a, b):
+            assert_same(x, y, ordered)
+    elif isinstance(a, np.ndarray):
+        np.testing.assert_array_equal(a, b)
+    else:
+        assert a == b
@@ -0,0 +1,44 @@
+import contextlib
+import io
+import numpy as np
+import pandas as pd
+
+from CFS_Outcomes import analyze_adl_development_matrix, bootstrap_adl_development_matrix
+from Oya_adl import assign_bins, n_bins_of, resolve_bin_spec
+from Oya_incremental import incremental_adl_development_matrix
+from Oya_partitions import partitioned_adl_development_matrix
+from Oya_shards import sharded_adl_development_matrix
+
+VALUES = np.arange(1, 1001, dtype=float)
+NARROW = [2.0, 3.0, 4.0]  # Cut points inside the 1-5 range of the synthetic measurements
+
+def test_quantile_bins_are_deciles():
+    spec = resolve_bin_spec("quantile", VALUES)
+    assert n_bins_of(spec) == 10
+    assert (np.bincount(assign_bins(VALUES, spec)) == 100).all()
+    assert n_bins_of(resolve_bin_spec({"method": "quantile", "n_bins": 4}, VALUES)) == 4
+
+def test_default_binning_keeps_nine_equal_width_bins():
+    assert n_bins_of(resolve_bin_spec(None, VALUES)) == 9
+    assert n_bins_of(resolve_bin_spec("equal_width", VALUES)) == 9
+    assert resolve_bin_spec([0, 500, 1000], VALUES)["edges"] == [0.0, 500.0, 1000.0]
+
+def _matrix_and_skipped(**kwargs):
+    buffer = io.StringIO()
+    with contextlib.redirect_stdout(buffer):
+        matrix = analyze_adl_development_matrix(**kwargs)
+    return matrix, int(buffer.getvalue().rsplit(":", 1)[1])
+
+def test_transition_matrix_with_cut_points_narrower_than_the_data(exports):
+    # Pairs with a measurement outside every bin are skipped, in every implementation of the matrix
+    matrix, skipped = _matrix_and_skipped(binning=NARROW)
+    all_bins, all_skipped = _matrix_and_skipped()
+    assert matrix.shape == (2, 2)
+    assert 0 < matrix.to_numpy().sum() < all_bins.to_numpy().sum()
+    assert matrix.to_numpy().sum() + skipped == all_bins.to_numpy().sum() + all_skipped
+
+    pd.testing.assert_frame_equal(incremental_adl_development_matrix(binning=NARROW), matrix)
+    pd.testing.assert_frame_equal(partitioned_adl_development_matrix(binning=NARROW), matrix)
+    pd.testing.assert_frame_equal(sharded_adl_development_matrix(binning=NARROW, workers=2), matrix)
+    bootstrap = bootstrap_adl_development_matrix(binning=NARROW, n_bootstrap=20, random_state=0)
+    pd.testing.assert_frame_equal(bootstrap["counts"], matrix)
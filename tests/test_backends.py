@@ -0,0 +1,57 @@
+import contextlib
+import io
+import pandas as pd
+import pytest
+
+import CFS_Outcomes as cfs
+import Hospital_encounters as hospital
+import Oya_encounters as encounters
+from Oya_sql import _same
+
+# The optional backends against the pandas implementations, on the synthetic exports: results and
+# printed output have to match. Each backend is skipped when its package is not installed.
+BACKENDS = ["duckdb", "polars"]
+
+# Analysis -> rows in a defined order (otherwise compared as sorted tables)
+ANALYSES = {
+    encounters.analyze_encounters: True,
+    encounters.analyze_dispositions_by_service: False,
+    encounters.count_admissions_by_source: True,
+    encounters.get_revisit_details: True,
+    encounters.count_revisits: False,
+    encounters.count_last_dispositions_from_revisit_list: True,
+    encounters.flow_tables: True,
+    hospital.analyze_daily_deaths: True,
+    hospital.analyze_daily_admissions: True,
+    hospital.count_unique_patients: True,
+    cfs.analyze_cfs_outcomes: True,
+    cfs.analyze_cfs_destinations_by_intervals: True,
+    cfs.analyze_adl_outcomes_by_decile: True,
+    cfs.load_home_admissions: True,
+    cfs.analyze_hospital_outcomes_by_decile: True,
+    cfs.analyze_adl_development_matrix: True,
+}
+
+def _run(func, **kwargs):
+    buffer = io.StringIO()
+    with contextlib.redirect_stdout(buffer):
+        result = func(**kwargs)
+    return result, buffer.getvalue()
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("func", list(ANALYSES), ids=lambda func: func.__name__)
+def test_backend_matches_pandas(exports, backend, func):
+    pytest.importorskip(backend)
+    expected, expected_text = _run(func, backend="pandas")
+    actual, actual_text = _run(func, backend=backend)
+    assert _same(expected, actual, ANALYSES[func])
+    assert actual_text == expected_text
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_inflow_workbook_matches_pandas(exports, backend):
+    pytest.importorskip(backend)
+    encounters.inflow_analysis(output_file="pandas.xlsx", backend="pandas")
+    encounters.inflow_analysis(output_file=f"{backend}.xlsx", backend=backend)
+    for sheet in ["Inflow", "Outflow"]:
+        pd.testing.assert_frame_equal(pd.read_excel(f"{backend}.xlsx", sheet_name=sheet),
+                                      pd.read_excel("pandas.xlsx", sheet_name=sheet))
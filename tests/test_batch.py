@@ -0,0 +1,21 @@
+import collections
+
+import Oya_batch
+
+_run_in_worker = Oya_batch._run_in_worker
+
+def _recorded_run(name, *args):
+    # Runs in the worker processes; appends of one short line do not interleave
+    with open("runs.txt", "a", encoding="utf-8") as f:
+        f.write(name + "\n")
+    return _run_in_worker(name, *args)
+
+def test_batch_runs_each_analysis_once(exports, monkeypatch, capsys):
+    monkeypatch.setattr(Oya_batch, "_run_in_worker", _recorded_run)
+    assert Oya_batch.main(["analyze_encounters", "analyze_daily_deaths", "--workers", "2", "--no-cache"]) == 0
+    with open("runs.txt", encoding="utf-8") as f:
+        assert collections.Counter(f.read().split()) == {"analyze_encounters": 1, "analyze_daily_deaths": 1}
+    assert "✅ 2 of 2 analyses finished" in capsys.readouterr().out
+
+def test_batch_rejects_unknown_analyses(exports):
+    assert Oya_batch.main(["analyze_encounters", "no_such_analysis"]) == 2
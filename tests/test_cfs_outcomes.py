@@ -0,0 +1,33 @@
+import numpy as np
+
+from CFS_Outcomes import _k_step_probabilities, _transition_probabilities, bootstrap_adl_development_matrix
+
+def test_rows_without_transitions_are_unknown():
+    # State 2 has no transitions: its row is unknown, and so is every k-step row that can reach it
+    # before the last step
+    counts = np.array([[3, 1, 0], [0, 2, 2], [0, 0, 0]])
+    probs = _transition_probabilities(counts)
+    assert np.isnan(probs[2]).all()
+    np.testing.assert_allclose(probs[:2], [[0.75, 0.25, 0], [0, 0.5, 0.5]])
+
+    two_step = _k_step_probabilities(probs, 2)
+    np.testing.assert_allclose(two_step[0], [0.5625, 0.3125, 0.125])
+    assert np.isnan(two_step[1:]).all()
+    assert np.isnan(_k_step_probabilities(probs, 3)).all()
+
+    # Without a way into state 2 the k-step rows stay known
+    counts = np.array([[3, 1, 0], [1, 1, 0], [0, 0, 0]])
+    two_step = _k_step_probabilities(_transition_probabilities(counts), 2)
+    np.testing.assert_allclose(two_step[:2, :2], np.linalg.matrix_power([[0.75, 0.25], [0.5, 0.5]], 2))
+    assert np.isnan(two_step[2]).all()
+
+def test_bootstrap_intervals_cover_only_known_rows(exports):
+    n_bootstrap = 50
+    results = bootstrap_adl_development_matrix(n_bootstrap=n_bootstrap, random_state=0)
+    for bands in results["k_step"].values():
+        covered = bands["replicates"].to_numpy()
+        assert ((covered >= 0) & (covered <= n_bootstrap)).all()
+        lower, upper = bands["lower"].to_numpy(), bands["upper"].to_numpy()
+        assert np.isnan(lower[covered == 0]).all() and np.isnan(upper[covered == 0]).all()
+        assert (lower[covered > 0] <= upper[covered > 0]).all()
+        assert (upper[covered > 0] <= 1 + 1e-12).all()
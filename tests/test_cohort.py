@@ -0,0 +1,48 @@
+import pandas as pd
+import pytest
+
+from Oya_cohort import (HOME_ADMISSIONS, SYKEHUS_ENCOUNTERS, VALID_DECISION_STATUSES, VALID_DECISION_TEMPLATES,
+                        VALID_DECISIONS, Cohort, adl_cohort)
+from Oya_loader import cached_parquet, clear_cache, read_export
+
+# A cohort read against reading the whole export and filtering it with pandas afterwards:
+# same rows, index labels, columns and dtypes, on every route through the loader
+ENCOUNTER_COLUMNS = ["PatientPseudoKey", "EncounterType", "Department", "DischargeInstant"]
+DECISION_COLUMNS = ["PatientPseudoKey", "DecisionTemplate", "DecisionValidDate"]
+DISPOSITIONS = ["Feilregistrert", "*Unspecified"]
+
+CASES = {
+    "encounters": ("Øya_encounters.csv", SYKEHUS_ENCOUNTERS.select(ENCOUNTER_COLUMNS),
+                   lambda df: df[(df["PatientPseudoKey"] != 2384) & (df["EncounterType"] == "Sykehuskontakt")][ENCOUNTER_COLUMNS]),
+    "missing values": ("Øya_encounters.csv",
+                       Cohort().where("DischargeDisposition", "not in", DISPOSITIONS).where("AdmissionSource", "!=", "Annet"),
+                       lambda df: df[~df["DischargeDisposition"].isin(DISPOSITIONS) & (df["AdmissionSource"] != "Annet")]),
+    "hospital": ("Øya_2_hospitalencounters.csv", HOME_ADMISSIONS,
+                 lambda df: df[(df["PatientPseudoKey"] != 2384) & (df["AdmissionSource"] == "Bosted/arbeidsted")]),
+    "decisions": ("Øya_decisions.csv", VALID_DECISIONS.select(DECISION_COLUMNS),
+                  lambda df: df[(df["PatientPseudoKey"] != 2384) & df["DecisionTemplate"].isin(VALID_DECISION_TEMPLATES)
+                                & df["DecisionStatus"].isin(VALID_DECISION_STATUSES)][DECISION_COLUMNS]),
+    "adl": ("Øya_2_ADL.csv", adl_cohort(["ADL", "Total score ADL"]),
+            lambda df: df[(df["PatientPseudoKey"] != 2384) & df["MeasurementName"].isin(["ADL", "Total score ADL"])]
+            [["PatientPseudoKey", "MeasurementName", "MeasurementTime", "Value"]]),
+}
+
+def _read(path, cohort, route):
+    if route == "csv":
+        return read_export(path, use_cache=False, cohort=cohort)
+    if route == "first read":
+        return read_export(path, cohort=cohort)  # Parses and caches the whole export, then filters
+    read_export(path)
+    if route == "parquet cache":
+        clear_cache()
+        assert cached_parquet(path) is not None
+    return read_export(path, cohort=cohort)
+
+@pytest.mark.parametrize("route", ["csv", "first read", "parquet cache", "in-process"])
+@pytest.mark.parametrize("case", list(CASES))
+def test_cohort_read_matches_filtering_the_whole_export(exports, case, route):
+    path, cohort, expected = CASES[case]
+    expected = expected(read_export(path, use_cache=False))
+    actual = _read(path, cohort, route)
+    assert 0 < len(actual) < len(read_export(path, use_cache=False))
+    pd.testing.assert_frame_equal(actual, expected)
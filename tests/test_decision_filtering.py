@@ -0,0 +1,32 @@
+import pandas as pd
+
+from Oya_Decition_Filtering import analyze_outcomes_for_longterm_decision
+
+LONGTERM = "Vedtak om langtidsopphold i institusjon"
+SENT_HOME = "Ut til hjemmet - Ingen melding går"
+
+def test_longterm_sent_home_with_missing_discharge(tmp_path, monkeypatch, capsys):
+    # Patient 1: decision before discharge; 2: discharge date missing; 3: decision after discharge
+    monkeypatch.chdir(tmp_path)
+    pd.DataFrame({
+        "PatientPseudoKey": [1, 2, 3],
+        "EncounterPseudoKey": [11, 12, 13],
+        "EncounterType": ["Sykehuskontakt"] * 3,
+        "LengthOfStay": [5, 5, 5],
+        "DischargeDisposition": [SENT_HOME] * 3,
+        "DischargeDestination": ["Bosted/arbeidsted"] * 3,
+        "DischargeInstant": ["2022-03-10 12:00:00", None, "2022-03-10 12:00:00"],
+    }).to_csv("Øya_encounters.csv", index=False)
+    pd.DataFrame({
+        "PatientPseudoKey": [1, 2, 3],
+        "DecisionTemplate": [LONGTERM] * 3,
+        "DecisionStatus": ["Signert"] * 3,
+        "DecisionValidDate": ["10/03/2022", "01/03/2022", "11/03/2022"],
+    }).to_csv("Øya_decisions.csv", index=False)
+
+    dispositions = analyze_outcomes_for_longterm_decision()
+    assert dispositions.set_index("DischargeDisposition")["NumberOfPatients"].to_dict() == {SENT_HOME: 3}
+
+    lines = capsys.readouterr().out.splitlines()
+    counts = {" ".join(line.split()[1:-1]): int(line.split()[-1]) for line in lines if "Sendt hjem" in line}
+    assert counts == {"Sendt hjem med vedtak": 1, "Sendt hjem uten vedtak": 2}
@@ -0,0 +1,87 @@
+import os
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+
+from CFS_Outcomes import analyze_adl_development_matrix
+from Hospital_encounters import analyze_daily_admissions, analyze_daily_deaths
+from Oya_encounters import analyze_encounters
+from Oya_incremental import (admission_rows, death_rows, incremental_adl_development_matrix, incremental_daily_admissions,
+                             incremental_daily_deaths, incremental_encounter_summary, transition_stays)
+from Oya_loader import clear_cache, read_export
+from Oya_partitions import partitioned_encounter_summary
+
+@pytest.mark.parametrize("rows", [death_rows, admission_rows, transition_stays])
+def test_row_selection_does_not_write_into_a_slice(exports, rows):
+    hospital = read_export("Øya_2_hospitalencounters.csv")
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", pd.errors.SettingWithCopyWarning)
+        selected = rows(hospital)
+    assert 2384 not in set(selected["PatientPseudoKey"])
+
+def test_encounter_summary_is_identical_to_the_full_analysis(exports):
+    expected = analyze_encounters()
+    pd.testing.assert_frame_equal(incremental_encounter_summary(state_dir="state"), expected)
+    # Refreshed from the saved state
+    pd.testing.assert_frame_equal(incremental_encounter_summary(state_dir="state"), expected)
+    pd.testing.assert_frame_equal(partitioned_encounter_summary(memory_mb=0.01), expected)
+
+def test_daily_counts_match_the_full_analyses(exports):
+    pd.testing.assert_series_equal(incremental_daily_deaths(state_dir="state"), analyze_daily_deaths(), check_dtype=False)
+    pd.testing.assert_series_equal(incremental_daily_admissions(state_dir="state"), analyze_daily_admissions(), check_dtype=False)
+
+### --- Refresh after the Export Changes --- ###
+
+BINNING = [1.0, 2.0, 3.0, 4.0, 5.0]  # Fixed, so new values do not force a full build
+
+# Export -> time column the monthly appends follow
+TIMES = {"Øya_2_hospitalencounters.csv": "EncounterEnd", "Øya_encounters.csv": "EncounterEnd",
+         "Øya_2_ADL.csv": "MeasurementTime", "Øya_decisions.csv": "DecisionValidDate"}
+
+# Export -> (column, value) written into a few existing rows
+CHANGED = {
+    "Øya_2_hospitalencounters.csv": ("DeathDate", "01.02.2021"),
+    "Øya_encounters.csv": ("Department", "TRD H ØYA HELSEHUS 2. ET. AVD. C"),
+    "Øya_2_ADL.csv": ("Value", "4.5"),
+    "Øya_decisions.csv": ("DecisionStatus", "Signert"),
+}
+
+def _rewrite(path, df, version):
+    df.to_csv(path, index=False)
+    os.utime(path, ns=(10**18 + version * 10**9,) * 2)  # A new mtime even within the file system's resolution
+    clear_cache()
+
+def _assert_refresh_matches_full_recompute():
+    # Refreshed from the saved state against the in-memory analyses on the current exports
+    refreshed = {
+        "deaths": incremental_daily_deaths(state_dir="state"), "admissions": incremental_daily_admissions(state_dir="state"),
+        "encounters": incremental_encounter_summary(state_dir="state"),
+        "matrix": incremental_adl_development_matrix(binning=BINNING, state_dir="state"),
+    }
+    pd.testing.assert_series_equal(refreshed["deaths"], analyze_daily_deaths(), check_dtype=False)
+    pd.testing.assert_series_equal(refreshed["admissions"], analyze_daily_admissions(), check_dtype=False)
+    pd.testing.assert_frame_equal(refreshed["encounters"], analyze_encounters())
+    pd.testing.assert_frame_equal(refreshed["matrix"], analyze_adl_development_matrix(binning=BINNING))
+
+def test_refresh_after_appended_and_edited_rows(exports):
+    # In time order, so the appended rows fall after the watermark as in a monthly export
+    exports_read = {}
+    for path, col in TIMES.items():
+        df = pd.read_csv(path, dtype=str, keep_default_na=False)
+        times = pd.to_datetime(df[col], format="mixed", dayfirst=True, errors="coerce")
+        exports_read[path] = df.iloc[np.argsort(times.to_numpy(), kind="stable")].reset_index(drop=True)
+    # First run on the older part of every export; the rest is appended as next month's rows
+    for path, df in exports_read.items():
+        _rewrite(path, df.iloc[: len(df) * 2 // 3], 0)
+    _assert_refresh_matches_full_recompute()
+    for path, df in exports_read.items():
+        _rewrite(path, df, 1)
+    _assert_refresh_matches_full_recompute()
+
+    # Edits of existing rows
+    for path, (col, value) in CHANGED.items():
+        df = exports_read[path].copy()
+        df.loc[df.index[[3, 17, 42]], col] = value
+        _rewrite(path, df, 2)
+    _assert_refresh_matches_full_recompute()
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from CFS_Outcomes import load_home_admissions, pair_consecutive_stays
+from Hospital_encounters import classify_readmissions
+from Oya_adl import apply_bins, load_adl_measurements, resolve_bin_spec
+from Oya_joins import enclosing_interval, nearest_in_time
+from Oya_kernels import DIRECTIONS, NAT
+from Oya_loader import read_export
+
+# The kernel joins (compiled when numba is installed, plain Python otherwise) against the
+# NumPy/pandas implementations, on random data with many ties and on the synthetic exports
+ROUNDS = 50
+OPTIONS = [dict(direction=direction, tolerance=tolerance, allow_exact_matches=exact) for direction in DIRECTIONS
+           for tolerance in (None, pd.Timedelta(days=1)) for exact in (True, False)]
+
+def _option_id(kwargs):
+    return "-".join(str(value) for value in kwargs.values())
+
+def _random_events(rng, n, n_patients=6, n_times=10):
+    # Few patients and few distinct times, so ties and empty segments are common
+    keys = rng.integers(0, n_patients, n)
+    times = rng.integers(0, n_times, n).astype(np.int64) * pd.Timedelta(hours=12).value
+    times[rng.random(n) < 0.05] = NAT
+    return pd.DataFrame({"PatientPseudoKey": keys, "Time": pd.to_datetime(times)})
+
+def _random_rounds(seed=0):
+    rng = np.random.default_rng(seed)
+    for _ in range(ROUNDS):
+        yield rng, _random_events(rng, 40), _random_events(rng, 30)
+
+def _assert_same_pairs(a, b):
+    for x, y in zip(a, b):
+        np.testing.assert_array_equal(x, y)
+
+@pytest.fixture
+def export_frames(exports):
+    encounters = read_export("Øya_encounters.csv")
+    cfs = read_export("Øya_CFS.csv").assign(IntervalStart=lambda df: df["TakenInstant"].dt.normalize())
+    adl_df = next(iter(load_adl_measurements(measurement_name="R HP COCM IPLOS/ADL TOTAL VANLIG GJENNOMSNITT").values()))
+    adl_df = apply_bins(adl_df, resolve_bin_spec(None, adl_df["Value"]), label_col=None)
+    stays = load_home_admissions().dropna(subset=["EncounterEnd"])
+    return {"encounters": encounters, "cfs": cfs, "adl": adl_df, "stays": stays}
+
+@pytest.mark.parametrize("kwargs", OPTIONS, ids=_option_id)
+def test_nearest_random(kwargs):
+    for _, left, right in _random_rounds():
+        np.testing.assert_array_equal(nearest_in_time(left, right, "Time", "Time", kernels=True, **kwargs),
+                                      nearest_in_time(left, right, "Time", "Time", kernels=False, **kwargs))
+
+@pytest.mark.parametrize("kwargs", OPTIONS, ids=_option_id)
+def test_nearest_exports(export_frames, kwargs):
+    stays, adl_df = export_frames["stays"], export_frames["adl"]
+    np.testing.assert_array_equal(nearest_in_time(stays, adl_df, "EncounterEnd", "MeasurementTime", kernels=True, **kwargs),
+                                  nearest_in_time(stays, adl_df, "EncounterEnd", "MeasurementTime", kernels=False, **kwargs))
+
+def test_interval_random():
+    for _, left, right in _random_rounds():
+        np.testing.assert_array_equal(enclosing_interval(left, right, "Time", "Time", kernels=True),
+                                      enclosing_interval(left, right, "Time", "Time", kernels=False))
+
+def test_interval_exports(export_frames):
+    encounters, cfs = export_frames["encounters"], export_frames["cfs"]
+    np.testing.assert_array_equal(enclosing_interval(encounters, cfs, "DischargeInstant", "IntervalStart", kernels=True),
+                                  enclosing_interval(encounters, cfs, "DischargeInstant", "IntervalStart", kernels=False))
+
+def test_previous_random():
+    for _, left, right in _random_rounds():
+        pd.testing.assert_frame_equal(classify_readmissions(left, right, (7,), "Time", "Time", kernels=True),
+                                      classify_readmissions(left, right, (7,), "Time", "Time", kernels=False))
+
+def test_previous_exports(export_frames):
+    stays, encounters = export_frames["stays"], export_frames["encounters"]
+    discharges = pd.concat([stays[["PatientPseudoKey", "EncounterEnd"]], encounters[["PatientPseudoKey", "EncounterEnd"]]],
+                           ignore_index=True)
+    pd.testing.assert_frame_equal(classify_readmissions(stays, discharges, kernels=True),
+                                  classify_readmissions(stays, discharges, kernels=False))
+
+def test_pairs_random():
+    for rng, left, right in _random_rounds():
+        stays = left.dropna(subset=["Time"]).rename(columns={"Time": "EncounterEnd"})
+        measurements = right.rename(columns={"Time": "MeasurementTime"}).assign(Decile=rng.integers(0, 5, len(right)))
+        _assert_same_pairs(pair_consecutive_stays(stays, measurements, 1, kernels=True),
+                           pair_consecutive_stays(stays, measurements, 1, kernels=False))
+
+def test_pairs_exports(export_frames):
+    stays, adl_df = export_frames["stays"], export_frames["adl"]
+    _assert_same_pairs(pair_consecutive_stays(stays, adl_df, kernels=True),
+                       pair_consecutive_stays(stays, adl_df, kernels=False))
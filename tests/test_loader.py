@@ -0,0 +1,21 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from conftest import assert_same
+from Oya_loader import CACHE_DIR, clear_cache, read_export
+
+def _rows(file_path):
+    return len(read_export(file_path))
+
+def test_concurrent_first_reads_leave_one_complete_cache(exports):
+    # Worker processes of a batch run building the same caches at once
+    paths = ["Øya_2_ADL.csv", "Øya_encounters.csv"] * 4
+    with ProcessPoolExecutor(max_workers=4) as pool:
+        rows = list(pool.map(_rows, paths))
+    assert sorted(os.listdir(CACHE_DIR)) == ["Øya_2_ADL.json", "Øya_2_ADL.parquet", "Øya_encounters.json", "Øya_encounters.parquet"]
+
+    clear_cache()
+    for path, n in zip(paths, rows):
+        cached = read_export(path)
+        assert len(cached) == n
+        assert_same(cached, read_export(path, use_cache=False))
@@ -0,0 +1,39 @@
+import os
+import pandas as pd
+import pytest
+
+import Oya_partitions
+from conftest import assert_same
+from Oya_Decition_Filtering import analyze_decision_patterns
+from Oya_partitions import PARTITION_DIR, partition_export, partitioned_decision_patterns
+
+def _meta_mtimes():
+    return {entry: os.path.getmtime(os.path.join(PARTITION_DIR, entry, "partitions.json")) for entry in os.listdir(PARTITION_DIR)}
+
+def test_partitionings_are_kept_until_the_export_changes(exports):
+    partition_export("Øya_encounters.csv", 2)
+    partition_export("Øya_decisions.csv", 2)
+    partition_export("Øya_decisions.csv", 3)
+    assert sorted(os.listdir(PARTITION_DIR)) == ["Øya_decisions-2", "Øya_decisions-3", "Øya_encounters-2"]
+    # Alternating partition counts reuse what is on disk
+    written = _meta_mtimes()
+    partition_export("Øya_decisions.csv", 2)
+    partition_export("Øya_decisions.csv", 3)
+    assert _meta_mtimes() == written
+
+    # A changed export removes its partitionings for every count
+    pd.read_csv("Øya_decisions.csv").iloc[:-5].to_csv("Øya_decisions.csv", index=False)
+    parts = partition_export("Øya_decisions.csv", 3)
+    assert sorted(os.listdir(PARTITION_DIR)) == ["Øya_decisions-3", "Øya_encounters-2"]
+    assert sum(len(pd.read_csv(part)) for part in parts) == len(pd.read_csv("Øya_decisions.csv"))
+
+def test_interrupted_partitioning_leaves_nothing_behind(exports, monkeypatch):
+    def interrupted(keys, n_partitions):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(Oya_partitions, "partition_of", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        partition_export("Øya_decisions.csv", 2)
+    assert os.listdir(PARTITION_DIR) == []
+
+def test_partitioned_patterns_match_in_memory(exports):
+    assert_same(partitioned_decision_patterns(memory_mb=0.01), analyze_decision_patterns())
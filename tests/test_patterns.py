@@ -0,0 +1,129 @@
+import itertools
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+import Oya_Decition_Filtering as decisions
+from Oya_incremental import incremental_decision_patterns, saved_decision_patterns
+from Oya_loader import clear_cache
+from Oya_patterns import (DAY_NS, association_rules, encode_sequences, encode_transactions, frequent_itemsets,
+                          mine_sequences, support_sweep)
+
+METRICS = ["support", "confidence", "lift", "leverage", "conviction"]
+
+def _random_decisions(rng, n_patients, n_templates, rows_per_patient, concentration=0.5):
+    p = rng.dirichlet(np.ones(n_templates) * concentration)
+    n = n_patients * rows_per_patient
+    return pd.DataFrame({"PatientPseudoKey": rng.integers(0, n_patients, n),
+                         "DecisionTemplate": [f"T{i}" for i in rng.choice(n_templates, n, p=p)]})
+
+def _mlxtend_itemsets(df, min_support):
+    preprocessing = pytest.importorskip("mlxtend.preprocessing")
+    frequent_patterns = pytest.importorskip("mlxtend.frequent_patterns")
+    transactions = df.groupby("PatientPseudoKey")["DecisionTemplate"].apply(lambda x: list(set(x))).tolist()
+    encoder = preprocessing.TransactionEncoder()
+    onehot = pd.DataFrame(encoder.fit(transactions).transform(transactions), columns=encoder.columns_)
+    itemsets = frequent_patterns.fpgrowth(onehot, min_support=min_support, use_colnames=True)
+    return dict(zip(itemsets["itemsets"], itemsets["support"]))
+
+### --- Itemsets and Rules --- ###
+
+def test_itemsets_match_mlxtend():
+    rng = np.random.default_rng(1)
+    for _ in range(15):
+        df = _random_decisions(rng, int(rng.integers(1, 300)), int(rng.integers(1, 12)), 3)
+        encoded = encode_transactions(df)
+        for min_support, itemsets in support_sweep(encoded, [0.01, 0.05, 0.1, 0.3]).items():
+            expected = _mlxtend_itemsets(df, min_support)
+            found = dict(zip(itemsets["itemsets"], itemsets["support"]))
+            assert found.keys() == expected.keys()
+            assert all(found[itemset] == pytest.approx(expected[itemset], abs=1e-12) for itemset in expected)
+            pd.testing.assert_frame_equal(itemsets, frequent_itemsets(encoded, min_support))
+
+def test_rules_match_mlxtend():
+    frequent_patterns = pytest.importorskip("mlxtend.frequent_patterns")
+    rng = np.random.default_rng(2)
+    for _ in range(15):
+        df = _random_decisions(rng, int(rng.integers(5, 300)), int(rng.integers(2, 10)), 4)
+        itemsets = frequent_itemsets(encode_transactions(df), 0.05)
+        # Thresholds off the exact count ratios, where mlxtend's float support ratios may round either way
+        for min_confidence in (0.0, 0.31, 0.79):
+            ours = association_rules(itemsets, min_confidence)
+            if itemsets["itemset_size"].max() < 2:
+                assert ours.empty
+                continue
+            theirs = frequent_patterns.association_rules(itemsets, num_itemsets=df["PatientPseudoKey"].nunique(),
+                                                         metric="confidence", min_threshold=min_confidence)
+            ours = {(a, c): row for a, c, row in zip(ours["antecedents"], ours["consequents"], ours[METRICS].to_numpy())}
+            theirs = {(a, c): row for a, c, row in zip(theirs["antecedents"], theirs["consequents"], theirs[METRICS].to_numpy())}
+            assert ours.keys() == theirs.keys()
+            for rule in ours:
+                np.testing.assert_allclose(ours[rule], theirs[rule], equal_nan=True)
+
+        lifted = association_rules(itemsets, 0.2, min_lift=1.1, min_leverage=0.01)
+        assert (lifted["confidence"] >= 0.2).all() and (lifted["lift"] >= 1.1).all() and (lifted["leverage"] >= 0.01).all()
+
+### --- Sequences --- ###
+
+def _contains(events, pattern, max_gap):
+    # Any embedding of pattern in the (code, time) events with at most max_gap between consecutive steps
+    def embed(step, start, previous):
+        if step == len(pattern):
+            return True
+        return any(code == pattern[step] and (previous is None or max_gap is None or time - previous <= max_gap)
+                   and embed(step + 1, q + 1, time) for q, (code, time) in enumerate(events[start:], start))
+    return embed(0, 0, None)
+
+def test_sequences_match_brute_force():
+    rng = np.random.default_rng(3)
+    for round_ in range(12):
+        n_patients, n_templates = int(rng.integers(1, 40)), int(rng.integers(1, 5))
+        n = n_patients * 4
+        df = pd.DataFrame({"PatientPseudoKey": rng.integers(0, n_patients, n),
+                           "DecisionTemplate": [f"T{i}" for i in rng.choice(n_templates, n)],
+                           "DecisionValidDate": pd.Timestamp("2022-01-01") + pd.to_timedelta(rng.integers(0, 200, n), unit="D")})
+        encoded = encode_sequences(df, collapse_repeats=bool(round_ % 2))
+        codes, times, offsets = encoded["codes"], encoded["times"], encoded["offsets"]
+        patients = [list(zip(codes[a:b].tolist(), times[a:b].tolist())) for a, b in zip(offsets[:-1], offsets[1:])]
+        for max_gap_days in (None, 10, 40):
+            max_gap = None if max_gap_days is None else max_gap_days * DAY_NS
+            for min_support in (0.05, 0.3):
+                found = mine_sequences(encoded, min_support, max_gap_days, max_length=3)
+                expected = {}
+                for length in range(1, 4):
+                    for pattern in itertools.product(range(len(encoded["items"])), repeat=length):
+                        count = sum(_contains(events, pattern, max_gap) for events in patients)
+                        if count / len(patients) >= min_support:
+                            expected[pattern] = count
+                assert {pattern: found[pattern][0] for pattern in found} == expected
+
+### --- Incremental Itemsets --- ###
+
+@pytest.mark.parametrize("all_templates", [True, False])
+def test_incremental_itemsets_match_a_full_remine(exports, all_templates):
+    # Grow, edit and delete rows of the export; the maintained itemsets must equal a full remine
+    rng = np.random.default_rng(5)
+    full = pd.read_csv("Øya_decisions.csv")
+    path, state = os.path.join("growing", "Øya_decisions.csv"), "state"
+    os.makedirs("growing")
+    current = full.sample(frac=0.6, random_state=1).sort_index()
+    for step in range(6):
+        if step:
+            current = pd.concat([current, full.drop(current.index, errors="ignore").sample(frac=0.3, random_state=step)])
+            edited = current.sample(n=5, random_state=step).index
+            current.loc[edited, "DecisionTemplate"] = rng.choice(full["DecisionTemplate"].unique(), len(edited))
+            if step % 3 == 0:
+                current = current[~current["PatientPseudoKey"].isin(rng.choice(current["PatientPseudoKey"].unique(), 10, replace=False))]
+        current.to_csv(path, index=False)
+        os.utime(path, ns=(10**18 + step * 10**9,) * 2)  # A new mtime even within the file system's resolution
+        clear_cache()
+
+        maintained = incremental_decision_patterns(path, 0.05, all_templates, 0.05, state)
+        if all_templates:
+            expected = decisions.analyze_all_templates_for_valid_patients(path, 0.05, export_excel=False)
+        else:
+            expected = decisions.analyze_decision_patterns(path, 0.05)
+        pd.testing.assert_frame_equal(maintained, expected)
+        pd.testing.assert_frame_equal(saved_decision_patterns(0.12, path, all_templates, 0.05, state),
+                                      expected[expected["support"] >= 0.12].reset_index(drop=True))
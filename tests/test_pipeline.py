@@ -0,0 +1,16 @@
+import os
+import shutil
+
+from conftest import assert_same
+from CFS_Outcomes import analyze_adl_outcomes_by_decile
+from Oya_pipeline import run_pipeline
+
+def test_adl_outcomes_read_the_given_decisions_export(exports):
+    expected = analyze_adl_outcomes_by_decile()
+    os.makedirs("elsewhere")
+    shutil.move("Øya_decisions.csv", os.path.join("elsewhere", "decisions.csv"))
+    path = os.path.join("elsewhere", "decisions.csv")
+
+    assert_same(analyze_adl_outcomes_by_decile(decisions_path=path), expected)
+    results, _ = run_pipeline(["analyze_adl_outcomes_by_decile"], verbose=False, show_timings=False, decisions_path=path)
+    assert_same(results["analyze_adl_outcomes_by_decile"], expected)
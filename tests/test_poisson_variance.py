@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from poisson_variance import simulate_totals
+
+POISSON_SPLIT = [({"dist": "poisson", "lam": 0.1}, 200)]
+MIXED = [({"dist": "discrete", "values": [0, 1, 2], "p": [0.2, 0.5, 0.3]}, 3),
+         ({"dist": "triangular", "left": 1, "mode": 3, "right": 10}, 2),
+         ({"dist": "uniform", "low": 0, "high": 1}, 1)]
+
+def _assert_identical(a, b):
+    assert a.keys() == b.keys()
+    for key in a:
+        np.testing.assert_array_equal(a[key], b[key])
+
+@pytest.mark.parametrize("terms", [POISSON_SPLIT, MIXED], ids=["poisson", "mixed"])
+def test_same_result_for_any_number_of_workers(terms):
+    single = simulate_totals(terms, 25_000, seed=7, workers=1, chunk_size=4_000)
+    _assert_identical(single, simulate_totals(terms, 25_000, seed=7, workers=3, chunk_size=4_000))
+    _assert_identical(single, simulate_totals(terms, 25_000, seed=7, workers=1, chunk_size=4_000))
+    assert single["histogram"].sum() + single["below"] + single["above"] == 25_000
+
+@pytest.mark.parametrize("terms", [POISSON_SPLIT, MIXED], ids=["poisson", "mixed"])
+def test_moments_match_theory(terms):
+    result = simulate_totals(terms, 200_000, seed=1, workers=1, chunk_size=30_000)
+    se = np.sqrt(result["expected_variance"] / result["replications"])
+    assert abs(result["mean"] - result["expected_mean"]) < 5 * se
+    assert result["variance"] == pytest.approx(result["expected_variance"], rel=0.03)
+
+@pytest.mark.parametrize("replications", [0, -5, 2.5, "100"])
+def test_replications_must_be_a_positive_whole_number(replications):
+    with pytest.raises(ValueError, match="replications"):
+        simulate_totals(POISSON_SPLIT, replications)
+
+def test_unknown_distributions_and_parameters_are_rejected():
+    with pytest.raises(ValueError, match="Unknown distribution"):
+        simulate_totals([({"dist": "gamma", "shape": 2}, 1)], 10)
+    with pytest.raises(ValueError, match="unknown"):
+        simulate_totals([({"dist": "poisson", "lam": 1, "scale": 2}, 1)], 10)
+    with pytest.raises(ValueError, match="draws"):
+        simulate_totals([({"dist": "poisson", "lam": 1}, 0)], 10)
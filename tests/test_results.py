@@ -0,0 +1,28 @@
+from conftest import assert_same
+from CFS_Outcomes import analyze_adl_outcomes_by_decile
+from Oya_pipeline import ANALYSES
+from Oya_results import PLOTTING, cache_size_mb, cached_call, is_cacheable
+
+def test_cached_call_replays_the_result(exports, capsys):
+    kwargs = {"adl_path": "Øya_2_ADL.csv", "encounters_path": "Øya_encounters.csv", "measurement_name": "ADL"}
+    expected = analyze_adl_outcomes_by_decile(**kwargs)
+    printed = capsys.readouterr().out
+
+    assert_same(cached_call(analyze_adl_outcomes_by_decile, **kwargs), expected)
+    assert cache_size_mb() > 0
+    capsys.readouterr()
+    # A hit returns the stored result and replays the printed output
+    assert_same(cached_call(analyze_adl_outcomes_by_decile, **kwargs), expected)
+    assert capsys.readouterr().out == printed
+
+def test_figures_are_never_cached(exports):
+    for name in PLOTTING:
+        assert not is_cacheable(ANALYSES[name][0], {})
+
+    calls = []
+    def flow_visualization(file_path="Øya_encounters.csv"):
+        calls.append(file_path)
+    cached_call(flow_visualization)
+    cached_call(flow_visualization)
+    assert len(calls) == 2
+    assert cache_size_mb() == 0
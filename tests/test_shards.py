@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+
+from conftest import assert_same
+from CFS_Outcomes import analyze_adl_development_matrix, analyze_cfs_destinations_by_intervals
+from Oya_shards import run_sharded, sharded_adl_development_matrix, sharded_cfs_destinations_by_intervals
+
+def _shard_rows(frames, offset):
+    # Every frame of the shard as the worker sees it, plus a number to check the summing
+    return {name: frame.assign(Shifted=frame["PatientPseudoKey"] + offset) for name, frame in frames.items()}, len(frames["a"])
+
+def _frames(index):
+    rng = np.random.default_rng(0)
+    n = len(index)
+    return {
+        "a": pd.DataFrame({
+            "PatientPseudoKey": rng.integers(0, 30, n).astype(np.int32),
+            "Time": pd.Timestamp("2022-01-01") + pd.to_timedelta(rng.integers(0, 10**6, n), unit="min"),
+            "Group": pd.Categorical(rng.choice(["x", "y", "z"], n), categories=["z", "y", "x"]),
+            "Value": rng.normal(size=n),
+            "Text": rng.choice(np.array(["one", "two", None], dtype=object), n),
+        }, index=index),
+        "b": pd.DataFrame({"PatientPseudoKey": rng.integers(0, 30, 50), "Flag": rng.random(50) < 0.5}),
+    }
+
+def test_shards_hand_over_every_column_and_the_index(exports):
+    indexes = [pd.Index(np.random.default_rng(1).permutation(200) * 3 + 7, name="row"),
+               pd.date_range("2022-01-01", periods=200, freq="h"), pd.Index([f"row{i}" for i in range(200)])]
+    for index in indexes:
+        frames = _frames(index)
+        (sharded, n), (expected, expected_n) = run_sharded(_shard_rows, frames, (5,), workers=2), _shard_rows(frames, 5)
+        assert n == expected_n
+        for name in frames:
+            pd.testing.assert_frame_equal(sharded[name].loc[expected[name].index], expected[name], check_freq=False)
+
+def test_sharded_analyses_match_in_process(exports):
+    assert_same(sharded_adl_development_matrix(workers=2), analyze_adl_development_matrix())
+    assert_same(sharded_cfs_destinations_by_intervals(workers=2), analyze_cfs_destinations_by_intervals())